@@ -0,0 +1,243 @@
+"""Runs tasks on worker processes, possibly on other machines, which connect to
+a coordinator over TCP.
+
+A Coordinator listens for workers, and its Map runs a function over a list of
+arguments on whichever workers are connected. Serve starts worker processes
+on a machine, which each run Work to take tasks from the coordinator one at a
+time. Functions and arguments are pickled, so functions must be importable
+on the workers.
+"""
+
+import collections
+import multiprocessing
+import multiprocessing.connection
+import pickle
+import threading
+import time
+import traceback
+
+# Seconds between the heartbeats a worker sends while running a task
+HEARTBEAT_INTERVAL = 1
+
+# Seconds without a heartbeat or result after which the coordinator gives up
+# on a worker running a task, and hands the task to another
+WORKER_TIMEOUT = 30
+
+# Seconds a worker keeps trying to connect to a coordinator that isn't up yet
+CONNECT_RETRY_TIME = 60
+
+# Seconds between checks of Map's cancel event
+CANCEL_POLL_INTERVAL = 0.2
+
+
+def ParseAddress(address):
+  """Parses a HOST:PORT address into a (host, port) tuple."""
+  host, _, port = address.rpartition(':')
+  if not host or not port.isdigit():
+    raise ValueError("%s is not a HOST:PORT address" % address)
+  return host, int(port)
+
+
+class Coordinator(object):
+  """Listens for workers at address, a (host, port) tuple, and runs tasks on
+  them. A port of 0 picks a free port, and the address attribute is the one
+  actually listened on.
+
+  Each connected worker runs one task at a time. If a worker's connection is
+  lost, or it sends nothing for worker_timeout seconds while running a task,
+  the task is handed to another worker.
+  """
+  def __init__(self, address, authkey, worker_timeout=WORKER_TIMEOUT):
+    self.worker_timeout = worker_timeout
+    self._listener = multiprocessing.connection.Listener(address, authkey=authkey)
+    self.address = self._listener.address
+    self._condition = threading.Condition()
+    self._tasks = {}  # Task id to pickled function and arguments
+    self._pending = collections.deque()  # Ids of tasks waiting for a worker
+    self._results = {}  # Task id to success and result or traceback
+    self._next_task = 0
+    self._workers = 0
+    self._closed = False
+    threading.Thread(target=self._Accept, daemon=True).start()
+
+  def _Accept(self):
+    while True:
+      try:
+        connection = self._listener.accept()
+      except (OSError, EOFError, multiprocessing.AuthenticationError):
+        if self._closed:
+          return
+        continue
+      threading.Thread(target=self._Serve, args=(connection,), daemon=True).start()
+
+  def _Serve(self, connection):
+    """Sends tasks to the worker on connection one at a time, until it is lost
+    or the coordinator is closed."""
+    task_id = None
+    with self._condition:
+      self._workers += 1
+    try:
+      while True:
+        with self._condition:
+          while not self._pending and not self._closed:
+            self._condition.wait()
+          if self._closed:
+            connection.send(("stop",))
+            return
+          task_id = self._pending.popleft()
+          task = self._tasks[task_id]
+        connection.send(("task", task_id, task))
+        while True:
+          if not connection.poll(self.worker_timeout):
+            return
+          message = connection.recv()
+          if message[0] == "result":
+            break
+        _, _, succeeded, value = message
+        with self._condition:
+          if task_id in self._tasks:
+            self._results[task_id] = (succeeded, value)
+            self._condition.notify_all()
+        task_id = None
+    except (OSError, EOFError):
+      pass
+    finally:
+      with self._condition:
+        self._workers -= 1
+        if task_id is not None and task_id in self._tasks:
+          self._pending.appendleft(task_id)
+          self._condition.notify_all()
+      connection.close()
+
+  def Workers(self):
+    """Returns the number of workers connected."""
+    with self._condition:
+      return self._workers
+
+  def Map(self, function, args_list, cancel=None):
+    """Runs function with each of the argument tuples in args_list on the
+    workers, and returns the list of results in the same order. Raises
+    RuntimeError with the worker's traceback if a task fails.
+
+    Once cancel, a threading.Event, is set, tasks no worker has started are
+    dropped, and their results are None.
+    """
+    with self._condition:
+      task_ids = range(self._next_task, self._next_task + len(args_list))
+      self._next_task += len(args_list)
+      for task_id, args in zip(task_ids, args_list):
+        self._tasks[task_id] = pickle.dumps((function, args), pickle.HIGHEST_PROTOCOL)
+      self._pending.extend(task_ids)
+      self._condition.notify_all()
+
+    results = []
+    cancelled = set()
+    try:
+      for task_id in task_ids:
+        with self._condition:
+          while task_id not in self._results:
+            if cancel is not None and cancel.is_set():
+              cancelled.update(pending for pending in self._pending if pending in task_ids)
+              self._pending = collections.deque(pending for pending in self._pending if pending not in cancelled)
+              if task_id in cancelled:
+                break
+            self._condition.wait(None if cancel is None else CANCEL_POLL_INTERVAL)
+          if task_id in cancelled:
+            results.append(None)
+            continue
+          succeeded, value = self._results.pop(task_id)
+          del self._tasks[task_id]
+        if not succeeded:
+          raise RuntimeError("Task failed on a worker:\n%s" % value)
+        results.append(value)
+    finally:
+      # Drop what's left of the tasks if one failed
+      with self._condition:
+        for task_id in task_ids:
+          self._tasks.pop(task_id, None)
+          self._results.pop(task_id, None)
+        self._pending = collections.deque(task_id for task_id in self._pending if task_id in self._tasks)
+    return results
+
+  def Close(self):
+    """Stops listening, and tells connected workers to stop once they finish
+    their current task."""
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+    self._listener.close()
+
+
+def _Heartbeat(connection, lock, done):
+  try:
+    while not done.wait(HEARTBEAT_INTERVAL):
+      with lock:
+        connection.send(("heartbeat",))
+  except OSError:
+    pass
+
+def Work(address, authkey, retry_time=CONNECT_RETRY_TIME, initializer=None, initargs=(), connected=None):
+  """Connects to the coordinator at address, retrying for up to retry_time
+  seconds, and runs the tasks it sends until it says to stop or the
+  connection is lost. initializer is called with initargs first.
+
+  connected, a multiprocessing.Event shared by the workers on a machine, is
+  set once one of them connects. A refused connection after that means the
+  coordinator has been and gone, so the worker returns instead of retrying.
+  """
+  if initializer is not None:
+    initializer(*initargs)
+  deadline = time.monotonic() + retry_time
+  while True:
+    try:
+      connection = multiprocessing.connection.Client(address, authkey=authkey)
+      break
+    except ConnectionRefusedError:
+      if connected is not None and connected.is_set():
+        return
+      if time.monotonic() > deadline:
+        raise
+      time.sleep(0.5)
+  if connected is not None:
+    connected.set()
+
+  lock = threading.Lock()
+  with connection:
+    while True:
+      try:
+        message = connection.recv()
+      except (OSError, EOFError):
+        return
+      if message[0] == "stop":
+        return
+      _, task_id, task = message
+
+      done = threading.Event()
+      heartbeat = threading.Thread(target=_Heartbeat, args=(connection, lock, done), daemon=True)
+      heartbeat.start()
+      try:
+        function, args = pickle.loads(task)
+        value = function(*args)
+        succeeded = True
+      except Exception:
+        value = traceback.format_exc()
+        succeeded = False
+      done.set()
+      heartbeat.join()
+
+      try:
+        with lock:
+          connection.send(("result", task_id, succeeded, value))
+      except OSError:
+        return
+
+def Serve(address, authkey, workers, retry_time=CONNECT_RETRY_TIME, initializer=None, initargs=()):
+  """Runs Work in the given number of worker processes, and returns when they
+  have all stopped."""
+  connected = multiprocessing.Event()
+  processes = [multiprocessing.Process(target=Work, args=(address, authkey, retry_time, initializer, initargs, connected))
+               for _ in range(workers)]
+  for process in processes:
+    process.start()
+  for process in processes:
+    process.join()
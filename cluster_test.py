@@ -0,0 +1,128 @@
+import os
+import multiprocessing
+import multiprocessing.connection
+import tempfile
+import threading
+import time
+import unittest
+import cluster
+
+AUTHKEY = b"cluster_test"
+
+def ExitOnce(marker):
+  """Exits the worker process the first time it runs, as if the worker were lost."""
+  if not os.path.exists(marker):
+    open(marker, "w").close()
+    os._exit(1)
+  return "retried"
+
+def Hang(seconds):
+  time.sleep(seconds)
+  return seconds
+
+class ClusterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.coordinator = cluster.Coordinator(("localhost", 0), AUTHKEY, worker_timeout=5)
+    self.workers = []
+
+  def tearDown(self):
+    self.coordinator.Close()
+    for worker in self.workers:
+      worker.join(10)
+      if worker.is_alive():
+        worker.terminate()
+
+  def StartWorkers(self, n):
+    for _ in range(n):
+      worker = multiprocessing.Process(target=cluster.Work, args=(self.coordinator.address, AUTHKEY, 10))
+      worker.start()
+      self.workers.append(worker)
+
+  def testParseAddress(self):
+    self.assertEqual(cluster.ParseAddress("localhost:8000"), ("localhost", 8000))
+    self.assertEqual(cluster.ParseAddress("::1:8000"), ("::1", 8000))
+    with self.assertRaises(ValueError):
+      cluster.ParseAddress("localhost")
+    with self.assertRaises(ValueError):
+      cluster.ParseAddress(":8000")
+
+  def testMap(self):
+    self.StartWorkers(3)
+    self.assertEqual(self.coordinator.Map(pow, [(2, i) for i in range(50)]), [2**i for i in range(50)])
+    self.assertEqual(self.coordinator.Map(max, [(3, 1), (1, 3)]), [3, 3])
+
+  def testWorkersStartedFirst(self):
+    address = self.coordinator.address
+    self.coordinator.Close()
+    worker = multiprocessing.Process(target=cluster.Work, args=(address, AUTHKEY, 10))
+    worker.start()
+    self.workers.append(worker)
+    time.sleep(0.5)
+    self.coordinator = cluster.Coordinator(address, AUTHKEY)
+    self.assertEqual(self.coordinator.Map(abs, [(-1,)]), [1])
+
+  def testRefusedAfterSessionStops(self):
+    connected = multiprocessing.Event()
+    worker = multiprocessing.Process(target=cluster.Work, args=(self.coordinator.address, AUTHKEY, 10, None, (), connected))
+    worker.start()
+    self.workers.append(worker)
+    self.assertEqual(self.coordinator.Map(abs, [(-1,)]), [1])
+    self.assertTrue(connected.is_set())
+    self.coordinator.Close()
+    worker.join(5)
+    self.assertEqual(worker.exitcode, 0)
+
+    # A worker that only gets going once the coordinator has gone stops
+    # straight away, rather than retrying and failing
+    late = multiprocessing.Process(target=cluster.Work, args=(self.coordinator.address, AUTHKEY, 10, None, (), connected))
+    late.start()
+    self.workers.append(late)
+    late.join(5)
+    self.assertEqual(late.exitcode, 0)
+
+  def testTaskFailure(self):
+    self.StartWorkers(1)
+    with self.assertRaisesRegex(RuntimeError, "ValueError"):
+      self.coordinator.Map(int, [("1",), ("x",)])
+    # The worker carries on after a failed task
+    self.assertEqual(self.coordinator.Map(int, [("2",)]), [2])
+
+  def testLostWorker(self):
+    self.StartWorkers(2)
+    with tempfile.TemporaryDirectory() as directory:
+      marker = os.path.join(directory, "exited")
+      self.assertEqual(self.coordinator.Map(ExitOnce, [(marker,)]), ["retried"])
+    self.assertEqual(self.coordinator.Workers(), 1)
+
+  def testSlowTask(self):
+    self.coordinator.worker_timeout = 2 * cluster.HEARTBEAT_INTERVAL
+    self.StartWorkers(1)
+    # Heartbeats keep a task running for longer than the timeout going
+    self.assertEqual(self.coordinator.Map(Hang, [(3 * cluster.HEARTBEAT_INTERVAL,)]), [3 * cluster.HEARTBEAT_INTERVAL])
+
+  def testCancel(self):
+    self.StartWorkers(1)
+    while self.coordinator.Workers() < 1:
+      time.sleep(0.01)
+    cancel = threading.Event()
+    threading.Timer(0.5, cancel.set).start()
+    # The running task finishes, and the others are dropped
+    self.assertEqual(self.coordinator.Map(Hang, [(1,), (1,), (1,)], cancel), [1, None, None])
+
+  def testUnresponsiveWorker(self):
+    self.coordinator.worker_timeout = 0.5
+    unresponsive = multiprocessing.connection.Client(self.coordinator.address, authkey=AUTHKEY)
+    while self.coordinator.Workers() < 1:
+      time.sleep(0.01)
+    results = []
+    mapper = threading.Thread(target=lambda: results.append(self.coordinator.Map(abs, [(-3,)])))
+    mapper.start()
+    self.assertEqual(unresponsive.recv()[0], "task")
+    self.StartWorkers(1)
+    mapper.join(10)
+    self.assertEqual(results, [[3]])
+    unresponsive.close()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -30,7 +30,8 @@ STRATEGY_PARAMETERS = [
 
 def extract_fitness(f):
   header = next(f)
-  if header != "Generation,Best Fitness,Fitness Mean,Fitness Stddev,Best Individual ID\n":
+  # Later columns, like the best fitness confidence interval, are optional
+  if not header.startswith("Generation,Best Fitness,Fitness Mean,Fitness Stddev,Best Individual ID"):
     raise ValueError("%s does not appear to contain fitness values" % f.name)
 
   col = []
@@ -0,0 +1,194 @@
+"""Economic scenarios: the paths of inflation, investment returns and real wage
+growth that simulated lives experience.
+
+EconomicModel generates whole paths for many lives in one call. A scenario
+bank holds pre-drawn paths for many lives in a .npy file (NumPy's array file
+format, written and read here with the standard library). Worker processes
+memory-map the bank read-only, so they share its pages and see the same draws
+on every run and machine.
+"""
+
+import array
+import ast
+import math
+import mmap
+import random
+import struct
+import sys
+
+import world
+
+# Economic factors stored for each simulated year, in storage order
+INFLATION = 0
+INVESTMENT_RETURN = 1
+REAL_WAGE_GROWTH = 2
+FACTORS = (INFLATION, INVESTMENT_RETURN, REAL_WAGE_GROWTH)
+
+# Number of simulated years a scenario must cover to outlive any person
+SCENARIO_YEARS = max(max(world.MALE_MORTALITY.keys()), max(world.FEMALE_MORTALITY.keys())) - world.START_AGE + 1
+
+_NPY_MAGIC = b'\x93NUMPY\x01\x00'
+_NPY_ALIGNMENT = 64
+
+
+class ScenarioPath(object):
+  """The economic conditions faced by one simulated life, by simulation year."""
+
+  def __init__(self, values):
+    self._values = values
+
+  def Inflation(self, year_index):
+    return self._values[year_index * len(FACTORS) + INFLATION]
+
+  def InvestmentReturn(self, year_index):
+    return self._values[year_index * len(FACTORS) + INVESTMENT_RETURN]
+
+  def RealWageGrowth(self, year_index):
+    return self._values[year_index * len(FACTORS) + REAL_WAGE_GROWTH]
+
+
+def _Cholesky(matrix):
+  """Returns the lower triangular Cholesky factor of a symmetric positive definite matrix."""
+  size = len(matrix)
+  lower = [[0.0] * size for _ in range(size)]
+  for i in range(size):
+    for j in range(i + 1):
+      partial = sum(lower[i][k] * lower[j][k] for k in range(j))
+      if i == j:
+        if matrix[i][i] - partial <= 0:
+          raise ValueError("matrix is not positive definite")
+        lower[i][j] = math.sqrt(matrix[i][i] - partial)
+      else:
+        lower[i][j] = (matrix[i][j] - partial) / lower[j][j]
+  return lower
+
+
+class EconomicModel(object):
+  """A first order vector autoregression over the economic factors.
+
+  Each year, the vector of factors x is drawn as
+
+    x[t] = means + persistence * (x[t-1] - means) + stddevs * (chol(correlations) * e[t])
+
+  where e[t] holds independent standard normal variates and x[-1] = means.
+  With no persistence and no correlation, each factor is an independent normal
+  draw every year, which is how Person draws its economy when it has no path.
+  """
+
+  def __init__(self, means, stddevs, correlations=None, persistence=None):
+    if len(means) != len(FACTORS) or len(stddevs) != len(FACTORS):
+      raise ValueError("expected one mean and one standard deviation for each of the %d factors" % len(FACTORS))
+    identity = [[1.0 if i == j else 0.0 for j in FACTORS] for i in FACTORS]
+    self.means = list(means)
+    self.stddevs = list(stddevs)
+    self.correlations = correlations or identity
+    self.persistence = persistence or [[0.0] * len(FACTORS) for _ in FACTORS]
+    self._correlation_factor = _Cholesky(self.correlations)
+
+  def GeneratePaths(self, n_lives, n_years=SCENARIO_YEARS, rng=random):
+    """Returns a list of n_lives ScenarioPaths covering n_years each.
+
+    Paths are generated one life at a time, so the first k paths drawn from a
+    given random state are the same whatever n_lives is.
+    """
+    means = self.means
+    stddevs = self.stddevs
+    persistence = self.persistence
+    factor = self._correlation_factor
+    indices = range(len(FACTORS))
+    gauss = rng.normalvariate
+
+    paths = []
+    for _ in range(n_lives):
+      values = array.array('d')
+      previous = means
+      for _ in range(n_years):
+        shocks = [gauss(0, 1) for _ in indices]
+        current = [means[i] +
+                   sum(persistence[i][j] * (previous[j] - means[j]) for j in indices) +
+                   stddevs[i] * sum(factor[i][j] * shocks[j] for j in indices)
+                   for i in indices]
+        values.extend(current)
+        previous = current
+      paths.append(ScenarioPath(values))
+    return paths
+
+
+# The economy the model has always used: independent normal inflation and
+# investment returns, and constant real wage growth
+INDEPENDENT_NORMAL_MODEL = EconomicModel(
+    means=(world.INFLATION_MEAN, world.MEAN_INVESTMENT_RETURN, world.PARGE),
+    stddevs=(world.INFLATION_STDDEV, world.STD_INVESTMENT_RETURN, 0))
+
+
+def WriteScenarioBank(filename, n_scenarios, seed=None, n_years=SCENARIO_YEARS, model=INDEPENDENT_NORMAL_MODEL):
+  """Draws n_scenarios economic paths from model and writes them to filename.
+
+  The file holds a float64 array of shape (n_scenarios, n_years, len(FACTORS)).
+  The same seed always produces the same file.
+  """
+  values = array.array('d')
+  for path in model.GeneratePaths(n_scenarios, n_years, random.Random(seed)):
+    values.extend(path._values)
+  if sys.byteorder == 'big':
+    values.byteswap()
+
+  header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d, %d), }" % (n_scenarios, n_years, len(FACTORS))
+  # The header is padded with spaces and ends in a newline so the data is aligned
+  padding = -(len(_NPY_MAGIC) + 2 + len(header) + 1) % _NPY_ALIGNMENT
+  header = header + ' ' * padding + '\n'
+
+  with open(filename, 'wb') as f:
+    f.write(_NPY_MAGIC)
+    f.write(struct.pack('<H', len(header)))
+    f.write(header.encode('latin1'))
+    values.tofile(f)
+
+
+class ScenarioBank(object):
+  """A read-only, memory-mapped bank of economic scenarios."""
+
+  def __init__(self, filename):
+    with open(filename, 'rb') as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if self._mmap[:len(_NPY_MAGIC)] != _NPY_MAGIC:
+      raise ValueError("%s is not a version 1.0 .npy file" % filename)
+    header_start = len(_NPY_MAGIC) + 2
+    header_len, = struct.unpack('<H', self._mmap[len(_NPY_MAGIC):header_start])
+    header = ast.literal_eval(self._mmap[header_start:header_start + header_len].decode('latin1'))
+    shape = header['shape']
+    if header['descr'] != '<f8' or header['fortran_order'] or len(shape) != 3 or shape[2] != len(FACTORS):
+      raise ValueError("%s does not hold a scenario bank" % filename)
+    self.n_scenarios, self.n_years, _ = shape
+    if self.n_years < SCENARIO_YEARS:
+      raise ValueError("scenarios in %s cover %d years, but lives can last %d" % (filename, self.n_years, SCENARIO_YEARS))
+
+    data_start = header_start + header_len
+    data = memoryview(self._mmap)[data_start:data_start + self.n_scenarios * self.n_years * len(FACTORS) * 8]
+    if sys.byteorder == 'little':
+      self._values = data.cast('d')
+    else:
+      # Can't map little endian floats directly, so take a private copy
+      self._values = array.array('d', data.tobytes())
+      self._values.byteswap()
+
+  def __len__(self):
+    return self.n_scenarios
+
+  def Scenario(self, index):
+    """Returns the path for scenario index, wrapping around past the end of the
+    bank. Lives that share a scenario aren't independent, so callers check the
+    bank has enough for the lives they run."""
+    stride = self.n_years * len(FACTORS)
+    start = (index % self.n_scenarios) * stride
+    return ScenarioPath(self._values[start:start + stride])
+
+
+_open_banks = {}
+
+def OpenScenarioBank(filename):
+  """Returns a ScenarioBank for filename, mapping the file only once per process."""
+  if filename not in _open_banks:
+    _open_banks[filename] = ScenarioBank(filename)
+  return _open_banks[filename]
@@ -0,0 +1,142 @@
+import array
+import os
+import random
+import tempfile
+import unittest
+import economy
+import world
+
+class EconomicModelTest(unittest.TestCase):
+
+  def testCholesky(self):
+    lower = economy._Cholesky([[4, 2], [2, 10]])
+    self.assertEqual(lower, [[2, 0], [1, 3]])
+
+  def testCholeskyNotPositiveDefinite(self):
+    with self.assertRaises(ValueError):
+      economy._Cholesky([[1, 2], [2, 1]])
+
+  def testWrongNumberOfFactors(self):
+    with self.assertRaises(ValueError):
+      economy.EconomicModel(means=(0, 0), stddevs=(1, 1))
+
+  def testIndependentNormalModelMatchesScalarDraws(self):
+    paths = economy.INDEPENDENT_NORMAL_MODEL.GeneratePaths(2, n_years=3, rng=random.Random(5))
+    rng = random.Random(5)
+    for path in paths:
+      for year in range(3):
+        self.assertEqual(path.Inflation(year), rng.normalvariate(world.INFLATION_MEAN, world.INFLATION_STDDEV))
+        self.assertEqual(path.InvestmentReturn(year), rng.normalvariate(world.MEAN_INVESTMENT_RETURN, world.STD_INVESTMENT_RETURN))
+        rng.normalvariate(0, 1)  # The real wage growth shock, which has no effect
+        self.assertEqual(path.RealWageGrowth(year), world.PARGE)
+
+  def testPathsDoNotDependOnNumberOfLives(self):
+    model = economy.INDEPENDENT_NORMAL_MODEL
+    few = model.GeneratePaths(2, n_years=4, rng=random.Random(1))
+    many = model.GeneratePaths(5, n_years=4, rng=random.Random(1))
+    self.assertEqual(few[1].InvestmentReturn(3), many[1].InvestmentReturn(3))
+
+  def testCorrelatedFactors(self):
+    model = economy.EconomicModel(
+        means=(0, 0, 0), stddevs=(1, 2, 0),
+        correlations=[[1, 0.8, 0], [0.8, 1, 0], [0, 0, 1]])
+    path = model.GeneratePaths(1, n_years=5000, rng=random.Random(3))[0]
+    inflation = [path.Inflation(y) for y in range(5000)]
+    returns = [path.InvestmentReturn(y) for y in range(5000)]
+    covariance = sum(a * b for a, b in zip(inflation, returns)) / 5000
+    self.assertAlmostEqual(covariance, 0.8 * 1 * 2, delta=0.1)
+    self.assertEqual(path.RealWageGrowth(100), 0)
+
+  def testPersistence(self):
+    model = economy.EconomicModel(
+        means=(0.02, 0, 0), stddevs=(0, 0, 0),
+        persistence=[[0.5, 0, 0], [0, 0, 0], [0, 0, 0]])
+    path = model.GeneratePaths(1, n_years=3)[0]
+    self.assertEqual([path.Inflation(y) for y in range(3)], [0.02, 0.02, 0.02])
+
+    model = economy.EconomicModel(
+        means=(0, 0, 0), stddevs=(1, 0, 0),
+        persistence=[[0.9, 0, 0], [0, 0, 0], [0, 0, 0]])
+    path = model.GeneratePaths(1, n_years=5000, rng=random.Random(3))[0]
+    inflation = [path.Inflation(y) for y in range(5000)]
+    autocovariance = sum(a * b for a, b in zip(inflation, inflation[1:])) / 4999
+    variance = sum(a * a for a in inflation) / 5000
+    self.assertAlmostEqual(autocovariance / variance, 0.9, delta=0.03)
+
+
+class ScenarioBankTest(unittest.TestCase):
+
+  def setUp(self):
+    fd, self.filename = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+
+  def tearDown(self):
+    economy._open_banks.pop(self.filename, None)
+    os.remove(self.filename)
+
+  def testScenarioPath(self):
+    path = economy.ScenarioPath(array.array('d', [0.01, 0.05, 0.011, 0.02, -0.1, 0.009]))
+    self.assertEqual(path.Inflation(0), 0.01)
+    self.assertEqual(path.InvestmentReturn(0), 0.05)
+    self.assertEqual(path.RealWageGrowth(0), 0.011)
+    self.assertEqual(path.Inflation(1), 0.02)
+    self.assertEqual(path.InvestmentReturn(1), -0.1)
+    self.assertEqual(path.RealWageGrowth(1), 0.009)
+
+  def testWriteAndRead(self):
+    economy.WriteScenarioBank(self.filename, 3, seed=1)
+    bank = economy.ScenarioBank(self.filename)
+
+    self.assertEqual(len(bank), 3)
+    self.assertEqual(bank.n_years, economy.SCENARIO_YEARS)
+    path = bank.Scenario(2)
+    last_year = economy.SCENARIO_YEARS - 1
+    self.assertNotEqual(path.Inflation(last_year), path.InvestmentReturn(last_year))
+
+  def testDataIsAligned(self):
+    economy.WriteScenarioBank(self.filename, 1, seed=1)
+    size = os.path.getsize(self.filename)
+    self.assertEqual((size - economy.SCENARIO_YEARS * len(economy.FACTORS) * 8) % 64, 0)
+
+  def testSeedIsReproducible(self):
+    economy.WriteScenarioBank(self.filename, 2, seed=42)
+    with open(self.filename, 'rb') as f:
+      first = f.read()
+    economy.WriteScenarioBank(self.filename, 2, seed=42)
+    with open(self.filename, 'rb') as f:
+      second = f.read()
+    self.assertEqual(first, second)
+
+  def testScenarioWrapsAround(self):
+    economy.WriteScenarioBank(self.filename, 2, seed=1)
+    bank = economy.ScenarioBank(self.filename)
+    self.assertEqual(bank.Scenario(3).Inflation(5), bank.Scenario(1).Inflation(5))
+    self.assertNotEqual(bank.Scenario(0).Inflation(5), bank.Scenario(1).Inflation(5))
+
+  def testDrawsMatchWorldParameters(self):
+    economy.WriteScenarioBank(self.filename, 50, seed=7)
+    bank = economy.ScenarioBank(self.filename)
+    inflations = [bank.Scenario(i).Inflation(y) for i in range(50) for y in range(bank.n_years)]
+    returns = [bank.Scenario(i).InvestmentReturn(y) for i in range(50) for y in range(bank.n_years)]
+    self.assertAlmostEqual(sum(inflations)/len(inflations), world.INFLATION_MEAN, places=3)
+    self.assertAlmostEqual(sum(returns)/len(returns), world.MEAN_INVESTMENT_RETURN, places=2)
+    self.assertEqual(bank.Scenario(3).RealWageGrowth(10), world.PARGE)
+
+  def testShortScenariosRejected(self):
+    economy.WriteScenarioBank(self.filename, 1, seed=1, n_years=economy.SCENARIO_YEARS-1)
+    with self.assertRaises(ValueError):
+      economy.ScenarioBank(self.filename)
+
+  def testNotABank(self):
+    with open(self.filename, 'wb') as f:
+      f.write(b'not a numpy file')
+    with self.assertRaises(ValueError):
+      economy.ScenarioBank(self.filename)
+
+  def testOpenScenarioBankIsCached(self):
+    economy.WriteScenarioBank(self.filename, 1, seed=1)
+    self.assertIs(economy.OpenScenarioBank(self.filename), economy.OpenScenarioBank(self.filename))
+
+
+if __name__ == '__main__':
+  unittest.main()
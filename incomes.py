@@ -45,14 +45,15 @@ class Income(object):
 
 class Earnings(Income):
   
-  def __init__(self):
+  def __init__(self, rng=random):
+    self.rng = rng  # Source of random draws: a random.Random or the random module
     self.taxable = True
     self.income_type = INCOME_TYPE_EARNINGS
 
   def CalcAmount(self, year_rec):
     if year_rec.is_employed:
-      earnings_capacity = utils.Indexed(world.YMPE, year_rec.year, 1 + world.PARGE) * year_rec.cpi * world.EARNINGS_YMPE_FRACTION
-      earnings = max(random.normalvariate(earnings_capacity, world.YMPE_STDDEV * earnings_capacity), 0)
+      earnings_capacity = world.YMPE * year_rec.wage_index * year_rec.cpi * world.EARNINGS_YMPE_FRACTION
+      earnings = max(self.rng.normalvariate(earnings_capacity, world.YMPE_STDDEV * earnings_capacity), 0)
       return earnings
     else:
       return 0
@@ -89,7 +90,7 @@ class CPP(Income):
 
   def AnnualUpdate(self, year_rec):
     if not year_rec.is_retired:
-      self.ympe_fractions.append(year_rec.pensionable_earnings / (utils.Indexed(world.YMPE, year_rec.year, 1 + world.PARGE) * year_rec.cpi))
+      self.ympe_fractions.append(year_rec.pensionable_earnings / (world.YMPE * year_rec.wage_index * year_rec.cpi))
 
   def OnRetirement(self, person):
     self.ympe_fractions.sort(reverse=True)
@@ -101,7 +102,7 @@ class CPP(Income):
                             self.ympe_fractions[whole_year_index]*(cpp_earning_history_length - whole_year_index)) / cpp_earning_history_length
 
     # Calculate the average nominal YMPE for the previous 5 years (excluding current year)
-    nominal_ympe_history = [utils.Indexed(world.YMPE, person.year - i, 1 + world.PARGE) * person.cpi_history[-(i+1)]
+    nominal_ympe_history = [world.YMPE * person.wage_index_history[-(i+1)] * person.cpi_history[-(i+1)]
                             for i in range(1, world.MPEA_YEARS + 1)]
     indexed_mpea = sum(nominal_ympe_history)/world.MPEA_YEARS
 
@@ -156,6 +156,7 @@ class IncomeTest(unittest.TestCase):
     fake_person = unittest.mock.MagicMock()
     fake_person.age = 65
     fake_person.year = 2049
+    fake_person.wage_index_history = [utils.Indexed(1, 2049 - i) for i in range(5, -1, -1)]
     fake_person.cpi_history = [1, 1, 1, 1, 1, 1]
     fake_person.cpi = 1
     income.OnRetirement(fake_person)
@@ -167,6 +168,7 @@ class IncomeTest(unittest.TestCase):
     fake_person = unittest.mock.MagicMock()
     fake_person.age = 65
     fake_person.year = 2049
+    fake_person.wage_index_history = [utils.Indexed(1, 2049 - i) for i in range(5, -1, -1)]
     fake_person.cpi_history = [1, 1, 1, 1, 1, 1]
     fake_person.cpi = 1
     income.OnRetirement(fake_person)
@@ -178,6 +180,7 @@ class IncomeTest(unittest.TestCase):
     fake_person = unittest.mock.MagicMock()
     fake_person.age = 68
     fake_person.year = 2052
+    fake_person.wage_index_history = [utils.Indexed(1, 2052 - i) for i in range(5, -1, -1)]
     fake_person.cpi_history = [1, 1, 1, 1, 1, 1]
     fake_person.cpi = 1
     income.OnRetirement(fake_person)
@@ -189,6 +192,7 @@ class IncomeTest(unittest.TestCase):
     fake_person = unittest.mock.MagicMock()
     fake_person.age = 72
     fake_person.year = 2056
+    fake_person.wage_index_history = [utils.Indexed(1, 2056 - i) for i in range(5, -1, -1)]
     fake_person.cpi_history = [1, 1, 1, 1, 1, 1]
     fake_person.cpi = 1
     income.OnRetirement(fake_person)
@@ -200,6 +204,7 @@ class IncomeTest(unittest.TestCase):
     fake_person = unittest.mock.MagicMock()
     fake_person.age = 63
     fake_person.year = 2047
+    fake_person.wage_index_history = [utils.Indexed(1, 2047 - i) for i in range(5, -1, -1)]
     fake_person.cpi_history = [1, 1, 1, 1, 1, 1]
     fake_person.cpi = 1
     income.OnRetirement(fake_person)
@@ -211,6 +216,7 @@ class IncomeTest(unittest.TestCase):
     fake_person = unittest.mock.MagicMock()
     fake_person.age = 65
     fake_person.year = 2049
+    fake_person.wage_index_history = [utils.Indexed(1, 2049 - i) for i in range(5, -1, -1)]
     # We use a silly value for the current year's CPI to check we aren't using it.
     fake_person.cpi_history = [1, 1.02, 1.0404, 1.061208, 1.08243216, 100]
     fake_person.cpi = 100
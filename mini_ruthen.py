@@ -1,15 +1,24 @@
 
 import argparse
+import atexit
 import collections
+import concurrent.futures
 import csv
 import multiprocessing
 import os
+import queue
+import signal
 import sys
 import random
 import math
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
 
 from pyeasyga.pyeasyga import pyeasyga
 
+import cluster
+import economy
 import person
 import utils
 import world
@@ -56,38 +65,614 @@ DEFAULT_STRATEGY_BOUNDS = StrategyBounds(
     0, 1,  # drawdown_preferred_tfsa_fraction
     )
 
-def RunPopulationWorker(strategy, gender, n, basic, real_values):
-  # Initialize accumulators
-  accumulators = utils.AccumulatorBundle(basic_only=basic)
+def RunPopulationBatchesWorker(strategy, gender, n, basic, real_values, scenario_bank=None, first_scenario=0, economic_model=None, quantile_sketches=None, schema=utils.ACCUMULATOR_SCHEMA, batches=1, seed=None, variants=None, write_through=True, rng=random):
+  """Runs n lives, and returns a list of accumulators for each batch. Life i of
+  the population, counting from first_scenario, goes in batch i % batches.
 
-  # Run n Person instantiations
+  With variants, a list of (gender, real_values) pairs, gender and real_values
+  are ignored, and each life is lived once for each gender in variants, with
+  the same random draws and economy. The accumulators returned are those of
+  each batch for each variant in turn. A gender's real and nominal values come
+  from the same life.
+
+  The lives draw random numbers from rng, a random.Random or the random module
+  itself. With a seed, rng is seeded from it and i before each life, so a
+  life's draws, and its economic path when drawn from economic_model, don't
+  depend on which process or thread runs it.
+
+  With write_through, lives update their batch's accumulators directly.
+  Otherwise each life gets a bundle of its own, which is merged into the
+  batch's afterwards.
+  """
+  if scenario_bank:
+    bank = economy.OpenScenarioBank(scenario_bank)
+
+  if variants is None:
+    variants = [(gender, real_values)]
+  # For each gender, the indexes in variants of its real and nominal values
+  genders = {}
+  for index, (variant_gender, variant_real_values) in enumerate(variants):
+    genders.setdefault(variant_gender, [None, None])[0 if variant_real_values else 1] = index
+
+  def NewBundle():
+    return utils.AccumulatorBundle(basic_only=basic, quantile_sketches=quantile_sketches, schema=schema)
+  if write_through:
+    results = [NewBundle() for _ in range(batches * len(variants))]
+  else:
+    mergers = [utils.PairwiseMerger() for _ in range(batches * len(variants))]
+
+  # Run n Person instantiations for each gender
   for i in range(n):
-    p = person.Person(strategy, gender, basic, real_values)
-    p.LiveLife()
+    if seed is not None:
+      rng.seed("%s/%d" % (seed, first_scenario + i))
+    # The economy is drawn from the life's own random state, so it doesn't
+    # depend on how lives are split between chunks either
+    if scenario_bank:
+      path = bank.Scenario(first_scenario + i)
+    elif economic_model:
+      path = economic_model.GeneratePaths(1, rng=rng)[0]
+    else:
+      path = None
+    batch = (first_scenario + i) % batches
+    state = rng.getstate() if len(genders) > 1 else None
+    for life, (life_gender, (real_index, nominal_index)) in enumerate(genders.items()):
+      if life:
+        rng.setstate(state)
+      indexes = [index for index in (real_index, nominal_index) if index is not None]
+      if write_through:
+        bundles = [results[index * batches + batch] for index in indexes]
+      else:
+        bundles = [NewBundle() for _ in indexes]
+      p = person.Person(strategy, life_gender, basic, real_index is not None, economy=path, accumulators=bundles[0],
+                        rng=rng, nominal_accumulators=bundles[1] if len(bundles) > 1 else None)
+      p.LiveLife()
+      if not write_through:
+        for index, bundle in zip(indexes, bundles):
+          mergers[index * batches + batch].Add(bundle)
 
-    # Merge in the results to our accumulators
-    accumulators.Merge(p.accumulators)
+  if not write_through:
+    results = []
+    for merger in mergers:
+      accumulators = merger.Result()
+      if accumulators is None:
+        accumulators = NewBundle()
+      results.append(accumulators)
+  return results
 
-  return accumulators
+def RunPopulationWorker(strategy, gender, n, basic, real_values, scenario_bank=None, first_scenario=0, economic_model=None, quantile_sketches=None, schema=utils.ACCUMULATOR_SCHEMA):
+  return RunPopulationBatchesWorker(strategy, gender, n, basic, real_values, scenario_bank, first_scenario, economic_model, quantile_sketches, schema)[0]
+
+def RunPopulationBatchesWorkerPacked(*args):
+  """Runs RunPopulationBatchesWorker, and returns its accumulators packed by
+  ToBytes to send back to the parent process."""
+  return [accumulators.ToBytes() for accumulators in RunPopulationBatchesWorker(*args)]
+
+def MergeBatchLists(batches1, batches2):
+  """Merges a list of batch accumulators into another, batch by batch, and
+  returns the latter."""
+  for accumulators1, accumulators2 in zip(batches1, batches2):
+    accumulators1.Merge(accumulators2)
+  return batches1
+
+def _StoreResult(bundles, slot_name, slot_size):
+  """Packs a list of bundles into the shared memory slot named slot_name if
+  they fit in its slot_size bytes, and returns their size. Otherwise returns
+  the packed bytes, to send back through the pool instead."""
+  data = utils.PackBundles(bundles)
+  if len(data) > slot_size:
+    return data
+  slot = shared_memory.SharedMemory(slot_name)
+  slot.buf[:len(data)] = data
+  slot.close()
+  return len(data)
+
+def _LoadResult(result, slot_name, schema):
+  """Returns the list of bundles _StoreResult stored, given what it returned."""
+  if isinstance(result, bytes):
+    return utils.UnpackBundles(result, schema)
+  slot = shared_memory.SharedMemory(slot_name)
+  view = slot.buf[:result]
+  try:
+    return utils.UnpackBundles(view, schema)
+  finally:
+    view.release()
+    slot.close()
+
+def RunPopulationChunkShared(slot_name, slot_size, args):
+  """Runs a chunk of lives in a worker process, given the name and size of its
+  shared memory slot and the arguments for RunPopulationBatchesWorker.
+  Returns where _StoreResult put the chunk's accumulators."""
+  return _StoreResult(RunPopulationBatchesWorker(*args), slot_name, slot_size)
+
+def MergeShared(slot_name1, result1, slot_name2, result2, slot_size, schema):
+  """Merges two chunks' results stored by _StoreResult, batch by batch, and
+  stores the merge in the first chunk's slot."""
+  merged = MergeBatchLists(_LoadResult(result1, slot_name1, schema), _LoadResult(result2, slot_name2, schema))
+  return _StoreResult(merged, slot_name1, slot_size)
+
+# Ways of running lives in parallel: on a pool of worker processes, on a
+# pool of threads, which only run in parallel on free-threaded Python builds,
+# or on the worker processes of serve-workers nodes connected to a coordinator
+PROCESSES = "processes"
+THREADS = "threads"
+CLUSTER = "cluster"
+
+_pool = None
+_pool_workers = None
+_pool_pinned = False
+_thread_pool = None
+_thread_pool_workers = None
+_coordinator = None
+
+# Bytes of shared memory each chunk's results start out with. Slots are kept
+# for later calls, and grow if results don't fit. Calls take turns with the
+# slots, holding the lock for as long as they use them.
+SLOT_SIZE = 1 << 20
+_slots = []
+_slot_size = SLOT_SIZE
+_slots_lock = threading.Lock()
+
+# Chunks of lives each worker gets, on average, when the chunk size isn't
+# given. More chunks balance the load better, since lives vary in length.
+CHUNKS_PER_WORKER = 4
+
+# Chunks lives are split into on the cluster backend when the number of
+# workers isn't given. Nodes can connect at any time, so the number connected
+# when a run starts says little about how many will run its chunks.
+CLUSTER_CHUNKS = 256
+
+# Chunks handed out per worker at a time. More than one keeps workers busy
+# while the next chunk is handed out, and few means an interrupted run stops
+# soon after.
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+class Interrupted(Exception):
+  """Raised by RunPopulationBatches when it is interrupted. results holds the
+  accumulators of each batch for the lives that ran, and lives their number."""
+  def __init__(self, results, lives):
+    Exception.__init__(self, "interrupted after %d lives" % lives)
+    self.results = results
+    self.lives = lives
+
+def _RunChunks(start, count, in_flight, interrupt=None):
+  """Runs count chunks, starting them in order by calling start(i, done),
+  which arranges for done(i, result) or done(i, None, exception) to be called
+  from any thread when chunk i finishes. At most in_flight chunks run at once,
+  and no more start once interrupt, a threading.Event, is set.
+
+  Returns the list of the results of the chunks that started, which are the
+  first ones. Raises the exception of a chunk that failed.
+  """
+  finished = queue.Queue()
+  def done(i, result, exception=None):
+    finished.put((i, result, exception))
+  results = [None] * count
+  started = running = 0
+  while True:
+    while started < count and running < in_flight and not (interrupt is not None and interrupt.is_set()):
+      start(started, done)
+      started += 1
+      running += 1
+    if not running:
+      return results[:started]
+    i, result, exception = finished.get()
+    running -= 1
+    if exception is not None:
+      raise exception
+    results[i] = result
+
+def FreeThreaded():
+  """Returns whether Python threads run in parallel, as they do on
+  free-threaded builds with the GIL disabled."""
+  return hasattr(sys, "_is_gil_enabled") and not sys._is_gil_enabled()
+
+def InitializeWorker(scenario_bank=None, cpus=None, started=None, ignore_signals=False):
+  """Prepares a worker process for lives: generates the world tables they
+  look up, and maps the scenario bank if there is one.
+
+  With cpus, a list of CPUs, and started, a shared count of the workers
+  started so far, the worker pins itself to the next of the CPUs.
+
+  With ignore_signals, the worker ignores SIGINT and SIGTERM, which a Ctrl-C
+  or a batch scheduler may send the whole process group, and keeps running
+  the chunks it was handed until the parent closes the pool.
+  """
+  if ignore_signals:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+  if cpus:
+    with started.get_lock():
+      index = started.value
+      started.value += 1
+    os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+  world.PreloadTables()
+  if scenario_bank:
+    economy.OpenScenarioBank(scenario_bank)
+
+def GetPool(scenario_bank=None, workers=None, pin_workers=False):
+  """Returns the pool of worker processes, one per available CPU unless
+  workers is given, starting it on first use. The pool is shared by every
+  later call asking for the same workers, so they only start once per session.
+
+  With pin_workers, each worker is pinned to a different CPU of the
+  affinity mask, as long as there are enough.
+  """
+  global _pool, _pool_workers, _pool_pinned
+  if workers is None:
+    workers = utils.AvailableCPUs()
+  if _pool is not None and (_pool_workers, _pool_pinned) != (workers, pin_workers):
+    _pool.close()
+    _pool.join()
+    _pool = None
+  if _pool is None:
+    # Workers attaching to shared memory slots register them with the resource
+    # tracker. Starting it first means they share the parent's, rather than
+    # starting their own, which would unlink the slots when the workers exit.
+    resource_tracker.ensure_running()
+    if pin_workers:
+      initargs = (scenario_bank, sorted(os.sched_getaffinity(0)), multiprocessing.Value('i', 0), True)
+    else:
+      initargs = (scenario_bank, None, None, True)
+    _pool = multiprocessing.Pool(workers, initializer=InitializeWorker, initargs=initargs)
+    _pool_workers = workers
+    _pool_pinned = pin_workers
+  return _pool
+
+def GetSlots(count):
+  """Returns count shared memory slots of at least _slot_size bytes, for the
+  results of chunks of lives. The slots are reused by later calls, so callers
+  must hold _slots_lock until they are done with them."""
+  global _slots
+  if _slots and _slots[0].size < _slot_size:
+    _CloseSlots()
+  while len(_slots) < count:
+    _slots.append(shared_memory.SharedMemory(create=True, size=_slot_size))
+  return _slots[:count]
+
+def _CloseSlots():
+  global _slots
+  for slot in _slots:
+    slot.close()
+    slot.unlink()
+  _slots = []
+
+def GetThreadPool(workers=None):
+  """Returns the pool of worker threads, one per available CPU unless workers
+  is given, starting it on first use. Like GetPool, the pool is shared by
+  every later call asking for the same workers.
+
+  The threads share the world tables, which are generated when the pool starts.
+  """
+  global _thread_pool, _thread_pool_workers
+  if workers is None:
+    workers = utils.AvailableCPUs()
+  if _thread_pool is not None and _thread_pool_workers != workers:
+    _thread_pool.shutdown()
+    _thread_pool = None
+  if _thread_pool is None:
+    world.PreloadTables()
+    _thread_pool = concurrent.futures.ThreadPoolExecutor(workers)
+    _thread_pool_workers = workers
+  return _thread_pool
+
+def StartCoordinator(address, authkey, worker_timeout=cluster.WORKER_TIMEOUT):
+  """Starts listening at address, a (host, port) tuple, for the worker nodes
+  the CLUSTER backend runs lives on, and returns the cluster.Coordinator."""
+  global _coordinator
+  if _coordinator is not None:
+    _coordinator.Close()
+  _coordinator = cluster.Coordinator(address, authkey, worker_timeout)
+  return _coordinator
 
-def RunPopulation(strategy, gender, n, basic, real_values, use_multiprocessing):
-  """Runs population multithreaded"""
+def ServeWorkers(address, authkey, workers=None):
+  """Runs workers worker processes, one per available CPU by default, for the
+  coordinator at address, and returns when the coordinator stops them or is
+  lost."""
+  if workers is None:
+    workers = utils.AvailableCPUs()
+  cluster.Serve(address, authkey, workers, initializer=InitializeWorker)
+
+def ClosePool():
+  """Shuts down the pools of worker processes and threads, and the
+  coordinator, if they were started."""
+  global _pool, _pool_workers, _pool_pinned, _thread_pool, _thread_pool_workers, _coordinator
+  if _pool is not None:
+    _pool.close()
+    _pool.join()
+    _pool = None
+    _pool_workers = None
+    _pool_pinned = False
+  with _slots_lock:
+    _CloseSlots()
+  if _thread_pool is not None:
+    _thread_pool.shutdown()
+    _thread_pool = None
+    _thread_pool_workers = None
+  if _coordinator is not None:
+    _coordinator.Close()
+    _coordinator = None
+
+atexit.register(ClosePool)
+
+def RunPopulationBatches(strategy, gender, n, basic, real_values, use_multiprocessing, scenario_bank=None, economic_model=None, quantile_sketches=None, schema=utils.ACCUMULATOR_SCHEMA, batches=1, first_life=0, seed=None, workers=None, chunk_size=None, pin_workers=False, backend=None, interrupt=None, variants=None):
+  """Runs population multithreaded, and returns accumulators for each of
+  batches independent batches of lives. With variants, a list of (gender,
+  real_values) pairs, every life is lived for each of them, and there are
+  accumulators for each batch of each variant in turn, as for
+  RunPopulationBatchesWorker.
+
+  The lives are numbered from first_life, so that a slice of a larger
+  population can be run. With a seed, each life's random draws depend only
+  on the seed and its number.
+
+  If scenario_bank names a scenario bank file, life i experiences scenario i
+  from the bank. Reusing scenarios would make the lives look more independent
+  than they are, so ValueError is raised if the bank has too few. Otherwise,
+  if an economy.EconomicModel is given, each life's economic path is drawn
+  from it, with the life's random draws. Without either, lives draw their own
+  economic conditions each year.
+
+  quantile_sketches chooses the sketch behind each quantile accumulator, and
+  schema the accumulators, as for utils.AccumulatorBundle.
+
+  The lives are split into chunks of chunk_size, which are handed out to
+  workers in order as they become free. By default each worker gets
+  CHUNKS_PER_WORKER chunks on average. The chunks' results are merged in life
+  order, whichever finishes first.
+
+  Once interrupt, a threading.Event, is set, no more chunks are handed out,
+  and Interrupted is raised with the results of those already running once
+  they finish. Lives run without multiprocessing aren't interrupted.
+
+  backend is PROCESSES to run the chunks on the pool GetPool returns for
+  workers and pin_workers, or THREADS to run them on the pool GetThreadPool
+  returns for workers, where each chunk draws from a random.Random of its
+  own. It defaults to THREADS on free-threaded Python builds, and PROCESSES
+  elsewhere. CLUSTER runs the chunks on the worker nodes connected to the
+  coordinator started by StartCoordinator. There, workers is the number of
+  worker processes expected across the nodes, and without it the lives are
+  split into CLUSTER_CHUNKS chunks.
+  """
+  if scenario_bank:
+    scenarios = len(economy.OpenScenarioBank(scenario_bank))
+    if first_life + n > scenarios:
+      raise ValueError("lives %d to %d need more scenarios than the %d in %s" % (first_life, first_life + n - 1, scenarios, scenario_bank))
   if not use_multiprocessing:
-    return RunPopulationWorker(strategy, gender, n, basic, real_values)
+    # Seeded lives get a generator of their own, rather than reseeding the
+    # random module under the caller
+    return RunPopulationBatchesWorker(strategy, gender, n, basic, real_values, scenario_bank, first_life, economic_model, quantile_sketches, schema, batches, seed, variants,
+                                      rng=random.Random() if seed is not None else random)
+
+  if backend is None:
+    backend = THREADS if FreeThreaded() else PROCESSES
+  if backend == CLUSTER and _coordinator is None:
+    raise ValueError("the cluster backend needs a coordinator from StartCoordinator")
+  if chunk_size is None and backend == CLUSTER and workers is None:
+    chunk_size = max(1, math.ceil(n / CLUSTER_CHUNKS))
+  if workers is None:
+    workers = utils.AvailableCPUs()
+  if chunk_size is None:
+    chunk_size = max(1, math.ceil(n / (workers * CHUNKS_PER_WORKER)))
+  chunks = [(strategy, gender, min(chunk_size, n - start), basic, real_values, scenario_bank, first_life + start, economic_model, quantile_sketches, schema, batches, seed, variants)
+            for start in range(0, max(n, 1), chunk_size)]
+
+  if backend == THREADS:
+    # Threads share memory, so results are merged without packing them
+    pool = GetThreadPool(workers)
+    def StartThread(i, done):
+      future = pool.submit(RunPopulationBatchesWorker, *chunks[i], rng=random.Random())
+      future.add_done_callback(lambda future: done(i, None, future.exception()) if future.exception() else done(i, future.result()))
+    results = _RunChunks(StartThread, len(chunks), workers * CHUNKS_IN_FLIGHT_PER_WORKER, interrupt)
+    ran = list(range(len(results)))
+    while len(results) > 1:
+      merged = list(pool.map(MergeBatchLists, results[::2], results[1::2]))
+      results = merged + results[2*len(merged):]
+
+  elif backend == CLUSTER:
+    # Worker nodes send back packed results, which are merged here
+    packed = _coordinator.Map(RunPopulationBatchesWorkerPacked, chunks, interrupt)
+    ran = [i for i, batches_packed in enumerate(packed) if batches_packed is not None]
+    results = [[utils.AccumulatorBundle.FromBytes(batch, schema) for batch in packed[i]] for i in ran]
+    while len(results) > 1:
+      merged = [MergeBatchLists(results1, results2) for results1, results2 in zip(results[::2], results[1::2])]
+      results = merged + results[2*len(merged):]
+
+  else:
+    # Farm work out to worker process pool. Each chunk stores its results in a
+    # shared memory slot of its own, so only their sizes come back through the
+    # pool.
+    global _slot_size
+    with _slots_lock:
+      pool = GetPool(scenario_bank, workers, pin_workers)
+      slot_size = _slot_size
+      slot_names = [slot.name for slot in GetSlots(len(chunks))]
+      def StartProcess(i, done):
+        pool.apply_async(RunPopulationChunkShared, (slot_names[i], slot_size, chunks[i]),
+                         callback=lambda result: done(i, result), error_callback=lambda exception: done(i, None, exception))
+      results = _RunChunks(StartProcess, len(chunks), workers * CHUNKS_IN_FLIGHT_PER_WORKER, interrupt)
+      ran = list(range(len(results)))
+
+      # Reduce the chunks' results pairwise in the pool, so the parent only
+      # unpacks the final bundles. Neighbouring chunks are merged, so the order
+      # of merges doesn't depend on which chunks finished first.
+      stored = list(zip(slot_names, results))
+      while len(stored) > 1:
+        merged = pool.starmap(MergeShared, [(name1, result1, name2, result2, slot_size, schema) for (name1, result1), (name2, result2) in zip(stored[::2], stored[1::2])])
+        results += merged
+        stored = [(name, result) for (name, _), result in zip(stored[::2], merged)] + stored[2*len(merged):]
+
+      # Give later calls bigger slots if results didn't fit
+      if results:
+        largest = max(result if isinstance(result, int) else len(result) for result in results)
+        if largest > slot_size:
+          _slot_size = max(_slot_size, 2 * largest)
+      results = [_LoadResult(stored[0][1], stored[0][0], schema)] if stored else []
+
+  if not results:
+    results = [[utils.AccumulatorBundle(basic_only=basic, quantile_sketches=quantile_sketches, schema=schema) for _ in range(batches * len(variants or [None]))]]
+  if len(ran) < len(chunks):
+    raise Interrupted(results[0], sum(chunks[i][2] for i in ran))
+  return results[0]
+
+def RunPopulation(strategy, gender, n, basic, real_values, use_multiprocessing, scenario_bank=None, economic_model=None, quantile_sketches=None, schema=utils.ACCUMULATOR_SCHEMA):
+  """Runs population multithreaded, and returns its accumulators. The
+  arguments are as for RunPopulationBatches."""
+  return RunPopulationBatches(strategy, gender, n, basic, real_values, use_multiprocessing, scenario_bank, economic_model, quantile_sketches, schema)[0]
 
-  # Initialize accumulators for calculation of fitness function
-  accumulators = utils.AccumulatorBundle(basic_only=basic)
+def RunPopulationVariants(strategy, variants, n, basic, use_multiprocessing, scenario_bank=None, economic_model=None, quantile_sketches=None, schema=utils.ACCUMULATOR_SCHEMA):
+  """Runs population once for a list of (gender, real_values) variants, each
+  life being lived for each gender with the same random draws, and returns a
+  dict of each variant's accumulators. The other arguments are as for
+  RunPopulationBatches."""
+  return dict(zip(variants, RunPopulationBatches(strategy, None, n, basic, None, use_multiprocessing, scenario_bank, economic_model, quantile_sketches, schema, variants=variants)))
 
-  # Farm work out to worker process pool
-  args = [(strategy, gender, n//os.cpu_count(), basic, real_values) for _ in range(os.cpu_count()-1)]
-  args.append((strategy, gender, n - n//os.cpu_count() * (os.cpu_count()-1), basic, real_values))
-  with multiprocessing.Pool() as pool:
-    for result in [pool.apply_async(RunPopulationWorker, arg) for arg in args]:
-      accumulators.Merge(result.get())
+# Lives per batch in the first round of a run to standard error targets, so
+# that the batch means standard errors the next rounds are sized from are
+# worth trusting
+MIN_LIVES_PER_BATCH = 10
 
+# Most a round grows the number of lives run so far by, so that a poor early
+# estimate of the lives needed isn't acted on all at once
+MAX_ROUND_GROWTH = 4
+
+def RunPopulationRounds(strategy, gender, basic, real_values, use_multiprocessing, scenario_bank=None, economic_model=None, quantile_sketches=None, schema=utils.ACCUMULATOR_SCHEMA, batches=1, first_life=0, seed=None, workers=None, chunk_size=None, pin_workers=False, backend=None, max_number=None, time_budget=None, stderr_targets=(), weights=None, round_size=None, progress=None, interrupt=None, variants=None):
+  """Runs lives in rounds until about time_budget seconds have passed, the
+  standard error targets are met, or max_number lives have run, whichever
+  comes first, and returns accumulators for each of batches batches and the
+  number of lives run. stderr_targets is a list of StderrTargets, with the
+  fitness function weights in weights, and with variants, each variant's
+  lives must meet them. The other arguments are as for RunPopulationBatches.
+
+  Lives are run in rounds of RunPopulationBatches, numbered on from those of
+  earlier rounds, so with a seed the lives run are the same as for a run of
+  that number. Without a time budget or targets, all max_number lives run in
+  one round. The first round otherwise runs a life per batch or worker,
+  whichever are more, or MIN_LIVES_PER_BATCH lives per batch with standard
+  error targets. Later rounds are sized to take half the time left, and to
+  run the lives the batch means standard errors so far say the targets need,
+  growing by at most MAX_ROUND_GROWTH times. No round runs more than
+  round_size lives.
+
+  After each round, progress is called with the accumulators of each batch so
+  far, which later rounds merge into, and the number of lives run. Once
+  interrupt, a threading.Event, is set, the lives under way finish and no
+  more are run.
+
+  With a scenario bank, max_number defaults to the lives it has scenarios for.
+  """
+  if scenario_bank and max_number is None:
+    max_number = max(len(economy.OpenScenarioBank(scenario_bank)) - first_life, 0)
+  if time_budget is None and not stderr_targets and max_number is None:
+    raise ValueError("RunPopulationRounds needs a time budget, standard error targets or a number of lives")
+  if stderr_targets and batches < 2:
+    raise ValueError("standard error targets need at least 2 batches")
+  deadline = None if time_budget is None else time.monotonic() + time_budget
+  def Parallelism():
+    if not use_multiprocessing:
+      return 1
+    elif workers is not None:
+      return workers
+    elif backend == CLUSTER:
+      # Nodes can connect during the run, so count them for each round
+      return max(_coordinator.Workers(), 1)
+    else:
+      return utils.AvailableCPUs()
+  parallelism = Parallelism()
+  if time_budget is None and not stderr_targets:
+    size = max_number
+  else:
+    size = max(batches, parallelism)
+  if stderr_targets:
+    size = max(size, batches * MIN_LIVES_PER_BATCH)
+  results = None
+  lives = 0
+  elapsed = 0
+  while max_number is None or lives < max_number:
+    if max_number is not None:
+      size = min(size, max_number - lives)
+    if round_size is not None:
+      size = min(size, round_size)
+    start = time.monotonic()
+    try:
+      round_results = RunPopulationBatches(strategy, gender, size, basic, real_values, use_multiprocessing, scenario_bank, economic_model, quantile_sketches, schema, batches, first_life + lives, seed, workers, chunk_size, pin_workers, backend, interrupt, variants)
+    except Interrupted as e:
+      round_results, size = e.results, e.lives
+    results = round_results if results is None else MergeBatchLists(results, round_results)
+    lives += size
+    elapsed += time.monotonic() - start
+    if progress is not None:
+      progress(results, lives)
+    parallelism = Parallelism()
+    if interrupt is not None and interrupt.is_set():
+      break
+    if stderr_targets:
+      needed = max(LivesForStderrTargets(results[i:i + batches], weights, stderr_targets, lives) for i in range(0, len(results), batches))
+      if needed <= lives:
+        break
+      size = max(min(needed - lives, lives * MAX_ROUND_GROWTH), parallelism)
+    if deadline is not None:
+      remaining = deadline - time.monotonic()
+      time_size = int(lives / elapsed * remaining / 2)
+      # Stop once a round would leave workers idle
+      if time_size < parallelism:
+        break
+      size = min(size, time_size) if stderr_targets else time_size
+    elif not stderr_targets:
+      size = max_number - lives
+  return results, lives
+
+def MergeBatches(batches):
+  """Returns the merge of a list of batch accumulators, leaving them unchanged.
+  A single batch is returned as it is."""
+  if len(batches) == 1:
+    return batches[0]
+  accumulators = batches[0].Copy()
+  for batch in batches[1:]:
+    accumulators.Merge(batch)
   return accumulators
 
 
+def ParseGenders(genders):
+  """Parses a --gender value, a comma separated list of genders."""
+  parsed = genders.split(',')
+  if not set(parsed) <= {person.MALE, person.FEMALE} or len(set(parsed)) < len(parsed):
+    raise argparse.ArgumentTypeError('gender must be %s, %s or both, comma separated' % (person.MALE, person.FEMALE))
+  return parsed
+
+def ParseShard(shard):
+  """Parses a --shard value i/k into the pair (i, k)."""
+  try:
+    i, k = (int(part) for part in shard.split('/'))
+  except ValueError:
+    raise argparse.ArgumentTypeError('shard must look like i/k')
+  if not 0 <= i < k:
+    raise argparse.ArgumentTypeError('shard i/k must have 0 <= i < k')
+  return i, k
+
+def MergeSnapshots(snapshots):
+  """Merges the metadata and batch accumulators read from shard snapshot files.
+
+  With a seed, the means and variances merged are those of an unsharded run,
+  up to floating point rounding. Quantile sketches merge differently in a
+  different order, so their quantiles can differ slightly.
+
+  Raises ValueError if the snapshots come from different runs, or hold the
+  same shard twice.
+  """
+  metadata, _ = snapshots[0]
+  def RunMetadata(metadata):
+    return {key: value for key, value in metadata.items() if key not in ("shard", "first_life", "lives")}
+  shards = set()
+  for snapshot_metadata, _ in snapshots:
+    if RunMetadata(snapshot_metadata) != RunMetadata(metadata):
+      raise ValueError("snapshots come from runs with different parameters")
+    if tuple(snapshot_metadata["shard"]) in shards:
+      raise ValueError("shard %d/%d appears more than once" % tuple(snapshot_metadata["shard"]))
+    shards.add(tuple(snapshot_metadata["shard"]))
+  metadata = dict(metadata, lives=sum(snapshot_metadata["lives"] for snapshot_metadata, _ in snapshots))
+  batch_accumulators = [MergeBatches([batches[k] for _, batches in snapshots]) for k in range(metadata["batches"])]
+  return metadata, batch_accumulators
+
 def ValidateStrategy(strategy, bounds=DEFAULT_STRATEGY_BOUNDS):
   """Do bounds checking on a strategy and clip anything outside the valid range"""
   return person.Strategy(
@@ -105,8 +690,40 @@ def ValidateStrategy(strategy, bounds=DEFAULT_STRATEGY_BOUNDS):
       drawdown_preferred_tfsa_fraction=min(max(bounds.drawdown_preferred_tfsa_fraction_min, strategy.drawdown_preferred_tfsa_fraction), bounds.drawdown_preferred_tfsa_fraction_max),
   )
 
-def Optimize(gender, n, weights, population_size, max_generations, use_multiprocessing, bounds):
-  """Run a genetic algorithm to optimize a strategy based on fitness function weights"""
+GenerationRow = collections.namedtuple("GenerationRow", ["generation", "best_fitness", "fitness_mean", "fitness_stddev", "best_individual_id", "best_fitness_ci_low", "best_fitness_ci_high"])
+
+OptimizationResult = collections.namedtuple("OptimizationResult", ["strategy", "fitness", "ci_low", "ci_high", "generations"])
+OptimizationResult.__doc__ = """The best strategy an optimization found, its
+fitness and the batch means confidence interval for it, and a GenerationRow
+for each generation."""
+
+def Optimize(weights, bounds=DEFAULT_STRATEGY_BOUNDS, n=None, gender=person.FEMALE, population_size=150, max_generations=10, scenario_bank=None, economic_model=None, quantile_sketches=None, batches=1, seed=None, use_multiprocessing=True, workers=None, chunk_size=None, pin_workers=False, backend=None, time_budget=None, stderr_targets=(), out=None):
+  """Run a genetic algorithm to optimize a strategy within bounds based on
+  fitness function weights, a dict of the nonzero ones, and return an
+  OptimizationResult.
+
+  With a scenario bank, every candidate strategy faces the same economic
+  scenarios. With a seed, every candidate lives the same lives, and the
+  genetic algorithm's own random choices are seeded from it too, so a run can
+  be repeated. Lives only accumulate what the weighted fitness function
+  components need. With more than one batch, the output also reports a
+  confidence interval for the best fitness, in columns after the others.
+
+  Each fitness evaluation runs n lives, DEFAULT_NUMBER by default. With a
+  time_budget or stderr_targets, it runs lives in rounds as
+  RunPopulationRounds does, up to n of them unless n is None. The other
+  arguments are as for SimulateVariants. With out, a csv table of each
+  generation's fitness values is written to it as it goes.
+  """
+  weights = Weights(weights)
+  if n is None and time_budget is None and not stderr_targets:
+    n = DEFAULT_NUMBER
+  if seed is not None:
+    # The genetic algorithm draws from the random module
+    random.seed("%s/optimize" % seed)
+  schema = SubscribedSchema(weights, ())
+  fitness_intervals = {}
+  generations = []
 
   def individual_to_strategy(individual):
     return ValidateStrategy(person.Strategy(
@@ -128,26 +745,39 @@ def Optimize(gender, n, weights, population_size, max_generations, use_multiproc
   class MyGeneticAlgorithm(pyeasyga.GeneticAlgorithm):
 
     def run(self):
-      """Run (solve) the Genetic Algorithm. Also a hack to output a csv table of generation fitness values as it goes."""
+      """Run (solve) the Genetic Algorithm. Also a hack to keep a GenerationRow
+      for each generation, and output a csv table of them as it goes."""
       self.create_first_generation()
 
+      writer = csv.writer(out, lineterminator='\n') if out is not None else None
+      # Columns for the confidence interval only appear when there is one
+      columns = len(GenerationRow._fields) if batches > 1 else GenerationRow._fields.index("best_fitness_ci_low")
+
       def OutputRow(i):
         mean = sum(individual.fitness for individual in self.current_generation)/len(self.current_generation)
         stdev = math.sqrt(sum((individual.fitness - mean)**2 for individual in self.current_generation)/len(self.current_generation))
-        row = [
+        ci_low, ci_high = fitness_intervals.get(tuple(self.best_individual()[1]), (None, None))
+        row = GenerationRow(
           i,
           self.best_individual()[0],
           mean,
           stdev,
-          hash(tuple(self.best_individual()[1]))
-          ]
-        return ",".join(str(e) for e in row)
+          hash(tuple(self.best_individual()[1])),
+          ci_low,
+          ci_high,
+          )
+        generations.append(row)
+        if writer is not None:
+          writer.writerow(["" if e is None else e for e in row[:columns]])
 
-      print("Generation,Best Fitness,Fitness Mean,Fitness Stddev,Best Individual ID")
+      if writer is not None:
+        writer.writerow(["Generation", "Best Fitness", "Fitness Mean", "Fitness Stddev", "Best Individual ID", "Best Fitness CI Low", "Best Fitness CI High"][:columns])
       for i in range(0, self.generations):
-        print("%s" % OutputRow(i))
+        OutputRow(i)
         self.create_next_generation()
-      print("%s\n" % OutputRow(self.generations))
+      OutputRow(self.generations)
+      if out is not None:
+        out.write('\n')
       
   ga = MyGeneticAlgorithm(weights, population_size=population_size, generations=max_generations, elitism=True, maximise_fitness=True)
 
@@ -173,95 +803,253 @@ def Optimize(gender, n, weights, population_size, max_generations, use_multiproc
 
   def fitness_function(individual, weights):
     strategy = individual_to_strategy(individual)
-    accumulators = RunPopulation(strategy, gender, n, True, True, use_multiprocessing)
-    return sum(component.contribution for component in GetFitnessFunctionCompositionTableRows(accumulators, weights))
+    if time_budget or stderr_targets:
+      batch_accumulators, _ = RunPopulationRounds(strategy, gender, True, True, use_multiprocessing, scenario_bank, economic_model, quantile_sketches, schema, batches, seed=seed, workers=workers, chunk_size=chunk_size, pin_workers=pin_workers, backend=backend, max_number=n, time_budget=time_budget, stderr_targets=stderr_targets, weights=weights)
+    else:
+      batch_accumulators = RunPopulationBatches(strategy, gender, n, True, True, use_multiprocessing, scenario_bank, economic_model, quantile_sketches, schema, batches, seed=seed, workers=workers, chunk_size=chunk_size, pin_workers=pin_workers, backend=backend)
+    total = GetFitnessTotalRow(MergeBatches(batch_accumulators), weights, batch_accumulators)
+    fitness_intervals[tuple(individual)] = (total.ci_low, total.ci_high)
+    return total.contribution
   ga.fitness_function = fitness_function
 
   ga.run()
 
   fitness, best_individual = ga.best_individual()
-  return individual_to_strategy(best_individual)
-
-
-FitnessFunctionCompositionRow = collections.namedtuple("FitnessFunctionCompositionRow", ["component", "value", "stderr", "weight", "contribution"])
-
-def GetFitnessFunctionCompositionTableRows(accumulators, weights):
-  return [
-    FitnessFunctionCompositionRow("ConsumptionAvgLifetime", accumulators.lifetime_consumption_summary.mean, accumulators.lifetime_consumption_summary.stderr, weights["ConsumptionAvgLifetime"], weights["ConsumptionAvgLifetime"] * accumulators.lifetime_consumption_summary.mean),
-    FitnessFunctionCompositionRow("ConsumptionAvgWorking", accumulators.working_consumption_summary.mean, accumulators.working_consumption_summary.stderr, weights["ConsumptionAvgWorking"], weights["ConsumptionAvgWorking"] * accumulators.working_consumption_summary.mean),
-    FitnessFunctionCompositionRow("ConsumptionAvgRetired", accumulators.retired_consumption_summary.mean, accumulators.retired_consumption_summary.stderr, weights["ConsumptionAvgRetired"], weights["ConsumptionAvgRetired"] * accumulators.retired_consumption_summary.mean),
-    FitnessFunctionCompositionRow("ConsumptionAvgRetiredPreDisability", accumulators.pre_disability_retired_consumption_summary.mean, accumulators.pre_disability_retired_consumption_summary.stderr, weights["ConsumptionAvgRetiredPreDisability"], weights["ConsumptionAvgRetiredPreDisability"] * accumulators.pre_disability_retired_consumption_summary.mean),
-    FitnessFunctionCompositionRow("ConsumptionDiscountedLifetime", accumulators.discounted_lifetime_consumption_summary.mean, accumulators.discounted_lifetime_consumption_summary.stderr, weights["ConsumptionDiscountedLifetime"], weights["ConsumptionDiscountedLifetime"] * accumulators.discounted_lifetime_consumption_summary.mean),
-    FitnessFunctionCompositionRow("Consumption10PctLifetime", accumulators.lifetime_consumption_hist.Quantile(0.1), None, weights["Consumption10PctLifetime"], weights["Consumption10PctLifetime"] * accumulators.lifetime_consumption_hist.Quantile(0.1)),
-    FitnessFunctionCompositionRow("Consumption20PctLifetime", accumulators.lifetime_consumption_hist.Quantile(0.2), None, weights["Consumption20PctLifetime"], weights["Consumption20PctLifetime"] * accumulators.lifetime_consumption_hist.Quantile(0.2)),
-    FitnessFunctionCompositionRow("ConsumptionMedianLifetime", accumulators.lifetime_consumption_hist.Quantile(0.5), None, weights["ConsumptionMedianLifetime"], weights["ConsumptionMedianLifetime"] * accumulators.lifetime_consumption_hist.Quantile(0.5)),
-    FitnessFunctionCompositionRow("Consumption10PctRetired", accumulators.retired_consumption_hist.Quantile(0.1), None, weights["Consumption10PctRetired"], weights["Consumption10PctRetired"] * accumulators.retired_consumption_hist.Quantile(0.1)),
-    FitnessFunctionCompositionRow("Consumption20PctRetired", accumulators.retired_consumption_hist.Quantile(0.2), None, weights["Consumption20PctRetired"], weights["Consumption20PctRetired"] * accumulators.retired_consumption_hist.Quantile(0.2)),
-    FitnessFunctionCompositionRow("ConsumptionMedianRetired", accumulators.retired_consumption_hist.Quantile(0.5), None, weights["ConsumptionMedianRetired"], weights["ConsumptionMedianRetired"] * accumulators.retired_consumption_hist.Quantile(0.5)),
-    FitnessFunctionCompositionRow("StdConsumptionLifetime", accumulators.lifetime_consumption_summary.stddev, None, weights["StdConsumptionLifetime"], weights["StdConsumptionLifetime"] * accumulators.lifetime_consumption_summary.stddev),
-    FitnessFunctionCompositionRow("StdConsumptionWorking", accumulators.working_consumption_summary.stddev, None, weights["StdConsumptionWorking"], weights["StdConsumptionWorking"] * accumulators.working_consumption_summary.stddev),
-    FitnessFunctionCompositionRow("StdConsumptionRetired", accumulators.retired_consumption_summary.stddev, None, weights["StdConsumptionRetired"], weights["StdConsumptionRetired"] * accumulators.retired_consumption_summary.stddev),
-    FitnessFunctionCompositionRow("EarningsAvgLateWorking", accumulators.earnings_late_working_summary.mean, accumulators.earnings_late_working_summary.stderr, weights["EarningsAvgLateWorking"], weights["EarningsAvgLateWorking"] * accumulators.earnings_late_working_summary.mean),
-    FitnessFunctionCompositionRow("FractionPersonsRuined", accumulators.fraction_persons_ruined.mean, accumulators.fraction_persons_ruined.stderr, weights["FractionPersonsRuined"], weights["FractionPersonsRuined"] * accumulators.fraction_persons_ruined.mean),
-    FitnessFunctionCompositionRow("FractionRetirementYearsRuined", accumulators.fraction_retirement_years_ruined.mean, accumulators.fraction_retirement_years_ruined.stderr, weights["FractionRetirementYearsRuined"], weights["FractionRetirementYearsRuined"] * accumulators.fraction_retirement_years_ruined.mean),
-    FitnessFunctionCompositionRow("FractionRetirementYearsBelowYMPE", accumulators.fraction_retirement_years_below_ympe.mean, accumulators.fraction_retirement_years_below_ympe.stderr, weights["FractionRetirementYearsBelowYMPE"], weights["FractionRetirementYearsBelowYMPE"] * accumulators.fraction_retirement_years_below_ympe.mean),
-    FitnessFunctionCompositionRow("FractionRetirementYearsBelowTwiceYMPE", accumulators.fraction_retirement_years_below_twice_ympe.mean, accumulators.fraction_retirement_years_below_twice_ympe.stderr, weights["FractionRetirementYearsBelowTwiceYMPE"], weights["FractionRetirementYearsBelowTwiceYMPE"] * accumulators.fraction_retirement_years_below_twice_ympe.mean),
-    FitnessFunctionCompositionRow("FractionRetireesReceivingGIS", accumulators.fraction_retirees_receiving_gis.mean, accumulators.fraction_retirees_receiving_gis.stderr, weights["FractionRetireesReceivingGIS"], weights["FractionRetireesReceivingGIS"] * accumulators.fraction_retirees_receiving_gis.mean),
-    FitnessFunctionCompositionRow("FractionRetirementYearsReceivingGIS", accumulators.fraction_retirement_years_receiving_gis.mean, accumulators.fraction_retirement_years_receiving_gis.stderr, weights["FractionRetirementYearsReceivingGIS"], weights["FractionRetirementYearsReceivingGIS"] * accumulators.fraction_retirement_years_receiving_gis.mean),
-    FitnessFunctionCompositionRow("AverageBenefitsGIS", accumulators.benefits_gis.mean, accumulators.benefits_gis.stderr, weights["AverageBenefitsGIS"], weights["AverageBenefitsGIS"] * accumulators.benefits_gis.mean),
-    FitnessFunctionCompositionRow("FractionRetireesEverBelowLICO", accumulators.fraction_retirees_ever_below_lico.mean, accumulators.fraction_retirees_ever_below_lico.stderr, weights["FractionRetireesEverBelowLICO"], weights["FractionRetireesEverBelowLICO"] * accumulators.fraction_retirees_ever_below_lico.mean),
-    FitnessFunctionCompositionRow("FractionRetirementYearsBelowLICO", accumulators.fraction_retirement_years_below_lico.mean, accumulators.fraction_retirement_years_below_lico.stderr, weights["FractionRetirementYearsBelowLICO"], weights["FractionRetirementYearsBelowLICO"] * accumulators.fraction_retirement_years_below_lico.mean),
-    FitnessFunctionCompositionRow("AverageLICOGapWorking", accumulators.lico_gap_working.mean, accumulators.lico_gap_working.stderr, weights["AverageLICOGapWorking"], weights["AverageLICOGapWorking"] * accumulators.lico_gap_working.mean),
-    FitnessFunctionCompositionRow("AverageLICOGapRetired", accumulators.lico_gap_retired.mean, accumulators.lico_gap_retired.stderr, weights["AverageLICOGapRetired"], weights["AverageLICOGapRetired"] * accumulators.lico_gap_retired.mean),
-    FitnessFunctionCompositionRow("FractionPersonsWithWithdrawalsBelowRetirementAssets", accumulators.fraction_persons_with_withdrawals_below_retirement_assets.mean, accumulators.fraction_persons_with_withdrawals_below_retirement_assets.stderr, weights["FractionPersonsWithWithdrawalsBelowRetirementAssets"], weights["FractionPersonsWithWithdrawalsBelowRetirementAssets"] * accumulators.fraction_persons_with_withdrawals_below_retirement_assets.mean),
-    FitnessFunctionCompositionRow("FractionRetireesWithWithdrawalsBelowRetirementAssets", accumulators.fraction_retirees_with_withdrawals_below_retirement_assets.mean, accumulators.fraction_retirees_with_withdrawals_below_retirement_assets.stderr, weights["FractionRetireesWithWithdrawalsBelowRetirementAssets"], weights["FractionRetireesWithWithdrawalsBelowRetirementAssets"] * accumulators.fraction_retirees_with_withdrawals_below_retirement_assets.mean),
-    FitnessFunctionCompositionRow("AverageLifetimeWithdrawalsLessSavings", accumulators.lifetime_withdrawals_less_savings.mean, accumulators.lifetime_withdrawals_less_savings.stderr, weights["AverageLifetimeWithdrawalsLessSavings"], weights["AverageLifetimeWithdrawalsLessSavings"] * accumulators.lifetime_withdrawals_less_savings.mean),
-    FitnessFunctionCompositionRow("ConsumptionAvgRetirementBelowFractionAvgWorking", accumulators.retirement_consumption_less_working_consumption.mean, accumulators.retirement_consumption_less_working_consumption.stderr, weights["ConsumptionAvgRetirementBelowFractionAvgWorking"], weights["ConsumptionAvgRetirementBelowFractionAvgWorking"] * accumulators.retirement_consumption_less_working_consumption.mean),
-    FitnessFunctionCompositionRow("AverageDistributableEstate", accumulators.distributable_estate.mean, accumulators.distributable_estate.stderr, weights["AverageDistributableEstate"], weights["AverageDistributableEstate"] * accumulators.distributable_estate.mean),
-  ]
+  ci_low, ci_high = fitness_intervals.get(tuple(best_individual), (None, None))
+  return OptimizationResult(individual_to_strategy(best_individual), fitness, ci_low, ci_high, generations)
 
-def WriteFitnessFunctionCompositionTable(rows, out):
+
+FitnessFunctionCompositionRow = collections.namedtuple("FitnessFunctionCompositionRow", ["component", "value", "stderr", "weight", "contribution", "ci_low", "ci_high"], defaults=(None, None))
+
+FitnessComponent = collections.namedtuple("FitnessComponent", ["name", "accumulator", "statistic"])
+FitnessComponent.__doc__ = """A fitness function component.
+
+Its value is the statistic of the named accumulator: MEAN, STDDEV, or a
+quantile.
+"""
+
+MEAN = "mean"
+STDDEV = "stddev"
+
+FITNESS_COMPONENTS = (
+  FitnessComponent("ConsumptionAvgLifetime", "lifetime_consumption_summary", MEAN),
+  FitnessComponent("ConsumptionAvgWorking", "working_consumption_summary", MEAN),
+  FitnessComponent("ConsumptionAvgRetired", "retired_consumption_summary", MEAN),
+  FitnessComponent("ConsumptionAvgRetiredPreDisability", "pre_disability_retired_consumption_summary", MEAN),
+  FitnessComponent("ConsumptionDiscountedLifetime", "discounted_lifetime_consumption_summary", MEAN),
+  FitnessComponent("Consumption10PctLifetime", "lifetime_consumption_hist", 0.1),
+  FitnessComponent("Consumption20PctLifetime", "lifetime_consumption_hist", 0.2),
+  FitnessComponent("ConsumptionMedianLifetime", "lifetime_consumption_hist", 0.5),
+  FitnessComponent("Consumption10PctRetired", "retired_consumption_hist", 0.1),
+  FitnessComponent("Consumption20PctRetired", "retired_consumption_hist", 0.2),
+  FitnessComponent("ConsumptionMedianRetired", "retired_consumption_hist", 0.5),
+  FitnessComponent("StdConsumptionLifetime", "lifetime_consumption_summary", STDDEV),
+  FitnessComponent("StdConsumptionWorking", "working_consumption_summary", STDDEV),
+  FitnessComponent("StdConsumptionRetired", "retired_consumption_summary", STDDEV),
+  FitnessComponent("EarningsAvgLateWorking", "earnings_late_working_summary", MEAN),
+  FitnessComponent("FractionPersonsRuined", "fraction_persons_ruined", MEAN),
+  FitnessComponent("FractionRetirementYearsRuined", "fraction_retirement_years_ruined", MEAN),
+  FitnessComponent("FractionRetirementYearsBelowYMPE", "fraction_retirement_years_below_ympe", MEAN),
+  FitnessComponent("FractionRetirementYearsBelowTwiceYMPE", "fraction_retirement_years_below_twice_ympe", MEAN),
+  FitnessComponent("FractionRetireesReceivingGIS", "fraction_retirees_receiving_gis", MEAN),
+  FitnessComponent("FractionRetirementYearsReceivingGIS", "fraction_retirement_years_receiving_gis", MEAN),
+  FitnessComponent("AverageBenefitsGIS", "benefits_gis", MEAN),
+  FitnessComponent("FractionRetireesEverBelowLICO", "fraction_retirees_ever_below_lico", MEAN),
+  FitnessComponent("FractionRetirementYearsBelowLICO", "fraction_retirement_years_below_lico", MEAN),
+  FitnessComponent("AverageLICOGapWorking", "lico_gap_working", MEAN),
+  FitnessComponent("AverageLICOGapRetired", "lico_gap_retired", MEAN),
+  FitnessComponent("FractionPersonsWithWithdrawalsBelowRetirementAssets", "fraction_persons_with_withdrawals_below_retirement_assets", MEAN),
+  FitnessComponent("FractionRetireesWithWithdrawalsBelowRetirementAssets", "fraction_retirees_with_withdrawals_below_retirement_assets", MEAN),
+  FitnessComponent("AverageLifetimeWithdrawalsLessSavings", "lifetime_withdrawals_less_savings", MEAN),
+  FitnessComponent("ConsumptionAvgRetirementBelowFractionAvgWorking", "retirement_consumption_less_working_consumption", MEAN),
+  FitnessComponent("AverageDistributableEstate", "distributable_estate", MEAN),
+)
+
+# Value of fitness function components with no weight, which aren't accumulated
+NOT_COMPUTED = "not computed"
+
+# Name of the fitness function value in --target_stderr and the fitness
+# function composition table
+TOTAL = "Total"
+
+# Output tables, in the order they are written, and the accumulators each
+# reads, as names and usages. The fitness function composition table only
+# reads the accumulators of weighted components.
+TABLES = ("summary", "strategy", "fitness", "period", "age")
+TABLE_SUBSCRIPTIONS = {
+  "summary": (("lifetime_consumption_summary", "period_consumption", "period_distributable_estate"), (utils.SUMMARY_TABLE,)),
+  "strategy": ((), ()),
+  "fitness": ((), ()),
+  "period": ((), (utils.PERIOD_TABLE,)),
+  "age": ((), (utils.AGE_TABLE,)),
+}
+
+def SubscribedSchema(weights, tables):
+  """Returns the schema of the accumulators needed for the fitness function
+  components with nonzero weights and the given tables."""
+  names = set()
+  usages = set()
+  for component in FITNESS_COMPONENTS:
+    if weights[component.name]:
+      names.add(component.accumulator)
+  for table in tables:
+    table_names, table_usages = TABLE_SUBSCRIPTIONS[table]
+    names.update(table_names)
+    usages.update(table_usages)
+  return utils.SubscribedSchema(names, usages)
+
+def ComponentValue(accumulators, component):
+  """Returns the value of a fitness function component, and its standard error if it is a mean."""
+  accumulator = getattr(accumulators, component.accumulator)
+  if component.statistic == MEAN:
+    return accumulator.mean, accumulator.stderr
+  elif component.statistic == STDDEV:
+    return accumulator.stddev, None
+  else:
+    return accumulator.Quantile(component.statistic), None
+
+def GetFitnessFunctionCompositionTableRows(accumulators, weights, batches=()):
+  """Returns a row for each fitness function component. Components with no
+  weight aren't computed, and contribute nothing.
+
+  Given the accumulators of independent batches of the lives, each computed
+  component gets a batch means confidence interval for its value.
+  """
+  rows = []
+  for component in FITNESS_COMPONENTS:
+    weight = weights[component.name]
+    if not weight:
+      rows.append(FitnessFunctionCompositionRow(component.name, NOT_COMPUTED, None, weight, 0))
+      continue
+    value, stderr = ComponentValue(accumulators, component)
+    ci_low, ci_high = utils.BatchMeansInterval(value, [ComponentValue(batch, component)[0] for batch in batches])
+    rows.append(FitnessFunctionCompositionRow(component.name, value, stderr, weight, weight * value, ci_low, ci_high))
+  return rows
+
+def Fitness(accumulators, weights):
+  """Returns the fitness function value: the weighted sum of its components."""
+  return sum(weights[component.name] * ComponentValue(accumulators, component)[0]
+             for component in FITNESS_COMPONENTS if weights[component.name])
+
+def GetFitnessTotalRow(accumulators, weights, batches=()):
+  """Returns a row for the fitness function value, with a batch means
+  confidence interval if given the accumulators of batches of the lives."""
+  fitness = Fitness(accumulators, weights)
+  ci_low, ci_high = utils.BatchMeansInterval(fitness, [Fitness(batch, weights) for batch in batches])
+  return FitnessFunctionCompositionRow(TOTAL, fitness, None, None, fitness, ci_low, ci_high)
+
+StderrTarget = collections.namedtuple("StderrTarget", ["component", "value", "relative"])
+StderrTarget.__doc__ = """A target for the standard error of the fitness
+function value, or of a fitness function component named by component. A
+relative target's value is a fraction of the absolute value estimated."""
+
+def ParseStderrTargets(targets):
+  """Parses a --target_stderr value: comma separated targets, each a number,
+  or a percentage for a relative target, optionally after a component name
+  and '='. Targets without a name are for the fitness function value."""
+  names = {component.name for component in FITNESS_COMPONENTS} | {TOTAL}
+  parsed = []
+  for target in targets.split(','):
+    name, _, value = target.rpartition('=')
+    name = name or TOTAL
+    if name not in names:
+      raise argparse.ArgumentTypeError('%s is not a fitness function component' % name)
+    relative = value.endswith('%')
+    try:
+      value = float(value[:-1]) / 100 if relative else float(value)
+    except ValueError:
+      raise argparse.ArgumentTypeError('%s is not a number or percentage' % value)
+    if not value > 0:
+      raise argparse.ArgumentTypeError('standard error targets must be positive')
+    parsed.append(StderrTarget(name, value, relative))
+  return parsed
+
+def LivesForStderrTargets(batches, weights, targets, lives):
+  """Returns about how many lives need to run for the batch means standard
+  errors of the StderrTargets to meet them, given the accumulators of batches
+  of lives lives. Standard errors shrink as the square root of the lives.
+
+  A value the same in every batch only meets its target once there are
+  MIN_LIVES_PER_BATCH lives per batch, since with few lives that is more
+  likely luck than a value that doesn't vary. A standard error or relative
+  goal that isn't a number, like a mean over no lives, never meets its
+  target, so the result is then infinite.
+  """
+  needed = lives
+  for target in targets:
+    if target.component == TOTAL:
+      values = [Fitness(batch, weights) for batch in batches]
+    else:
+      component = next(component for component in FITNESS_COMPONENTS if component.name == target.component)
+      values = [ComponentValue(batch, component)[0] for batch in batches]
+    stderr = utils.BatchMeansStderr(values)
+    if stderr is None:
+      continue
+    if not math.isfinite(stderr):
+      return math.inf
+    if not stderr:
+      needed = max(needed, len(batches) * MIN_LIVES_PER_BATCH)
+      continue
+    goal = target.value * abs(math.fsum(values) / len(values)) if target.relative else target.value
+    if not goal or not math.isfinite(goal):
+      return math.inf
+    needed = max(needed, math.ceil(lives * (stderr / goal)**2))
+  return needed
+
+def _WriteRows(rows, out):
   writer = csv.writer(out, lineterminator='\n')
-  writer.writerow(FitnessFunctionCompositionRow._fields)
   for row in rows:
     writer.writerow(row)
 
+def FitnessFunctionCompositionTable(rows):
+  """Returns the rows of the fitness function composition table, starting
+  with its header, given the FitnessFunctionCompositionRows."""
+  return [FitnessFunctionCompositionRow._fields] + list(rows)
+
+def WriteFitnessFunctionCompositionTable(rows, out):
+  _WriteRows(FitnessFunctionCompositionTable(rows), out)
+
+def SummaryTable(gender, group_size, accumulators, weights, population_size, max_generations, accumulate_nominal):
+  """Returns the rows of the summary table, starting with its header."""
+  rows = [("measure", "value")]
+  rows.append(("Population Size", population_size))
+  rows.append(("Max Generations", max_generations))
+  rows.append(("Group Size", group_size))
+  rows.append(("Fitness Function Value", Fitness(accumulators, weights)))
+  rows.append(("Gender", gender))
+  rows.append(("Start Age", world.START_AGE))
+  rows.append(("Nominal Accumulators", accumulate_nominal))
+  rows.append(("Real Return on Investments", world.MEAN_INVESTMENT_RETURN))
+  rows.append(("Earnings Capacity YMPE Fraction", world.EARNINGS_YMPE_FRACTION))
+  rows.append(("Age at Death", accumulators.age_at_death.mean))
+  rows.append(("Average Years Worked", accumulators.years_worked_with_earnings.mean))
+  rows.append(("Average Earnings Per Year Worked", accumulators.earnings_working.mean))
+  rows.append(("Fraction of Persons Retiring Involuntarily", accumulators.fraction_persons_involuntarily_retired.mean))
+  rows.append(("Fraction of Persons Dying Before Retiring", accumulators.fraction_persons_dying_before_retiring.mean))
+  rows.append(("Average Annual Consumption", accumulators.lifetime_consumption_summary.mean))
+  rows.append(("Average Annual EI/CPP Deductions in Working Period", accumulators.working_annual_ei_cpp_deductions.mean))
+  rows.append(("Average Annual Taxes in Working Period", accumulators.working_taxes.mean))
+  rows.append(("Average Annual Taxes in Retirement Period", accumulators.retirement_taxes.mean))
+  rows.append(("Average Years with Positive Savings", accumulators.positive_savings_years.mean))
+  rows.append(("Average Fraction of Earnings Saved", accumulators.fraction_earnings_saved.mean))
+  rows.append(("Average Years Receiving EI Benefits", accumulators.years_receiving_ei.mean))
+  rows.append(("Average Positive EI Benefits Received", accumulators.positive_ei_benefits.mean))
+  rows.append(("Average Years Receiving GIS Benefits", accumulators.years_receiving_gis.mean))
+  rows.append(("Average Positive GIS Benefits Level", accumulators.positive_gis_benefits.mean))
+  rows.append(("Average Positive CPP Benefits Level", accumulators.positive_cpp_benefits.mean))
+  rows.append(("Average Years Gross Income Below LICO", accumulators.years_income_below_lico.mean))
+  rows.append(("Average Years with No Financial Assets at BoY", accumulators.years_with_no_assets.mean))
+  rows.append(("Replacement Rate (Consumption Basis)", accumulators.period_consumption.Query([person.RETIRED, person.INVOLUNTARILY_RETIRED]).mean / accumulators.period_consumption.Query([person.EMPLOYED, person.UNEMPLOYED]).mean))
+  rows.append(("Distributable Estate", accumulators.period_distributable_estate.Query([person.EMPLOYED, person.UNEMPLOYED, person.RETIRED, person.INVOLUNTARILY_RETIRED]).mean))
+  rows.append(("Average Years With Negative Consumption", accumulators.years_with_negative_consumption.mean))
+  rows.append(("Average Net Government Revenue", accumulators.net_government_revenue.mean))
+  return rows
+
 def WriteSummaryTable(gender, group_size, accumulators, weights, population_size, max_generations, accumulate_nominal, out):
-  writer = csv.writer(out, lineterminator='\n')
-  writer.writerow(("measure", "value"))
-  writer.writerow(("Population Size", population_size))
-  writer.writerow(("Max Generations", max_generations))
-  writer.writerow(("Group Size", group_size))
-  writer.writerow(("Fitness Function Value", sum(component.contribution for component in GetFitnessFunctionCompositionTableRows(accumulators, weights))))
-  writer.writerow(("Gender", gender))
-  writer.writerow(("Start Age", world.START_AGE))
-  writer.writerow(("Nominal Accumulators", accumulate_nominal))
-  writer.writerow(("Real Return on Investments", world.MEAN_INVESTMENT_RETURN))
-  writer.writerow(("Earnings Capacity YMPE Fraction", world.EARNINGS_YMPE_FRACTION))
-  writer.writerow(("Age at Death", accumulators.age_at_death.mean))
-  writer.writerow(("Average Years Worked", accumulators.years_worked_with_earnings.mean))
-  writer.writerow(("Average Earnings Per Year Worked", accumulators.earnings_working.mean))
-  writer.writerow(("Fraction of Persons Retiring Involuntarily", accumulators.fraction_persons_involuntarily_retired.mean))
-  writer.writerow(("Fraction of Persons Dying Before Retiring", accumulators.fraction_persons_dying_before_retiring.mean))
-  writer.writerow(("Average Annual Consumption", accumulators.lifetime_consumption_summary.mean))
-  writer.writerow(("Average Annual EI/CPP Deductions in Working Period", accumulators.working_annual_ei_cpp_deductions.mean))
-  writer.writerow(("Average Annual Taxes in Working Period", accumulators.working_taxes.mean))
-  writer.writerow(("Average Annual Taxes in Retirement Period", accumulators.retirement_taxes.mean))
-  writer.writerow(("Average Years with Positive Savings", accumulators.positive_savings_years.mean))
-  writer.writerow(("Average Fraction of Earnings Saved", accumulators.fraction_earnings_saved.mean))
-  writer.writerow(("Average Years Receiving EI Benefits", accumulators.years_receiving_ei.mean))
-  writer.writerow(("Average Positive EI Benefits Received", accumulators.positive_ei_benefits.mean))
-  writer.writerow(("Average Years Receiving GIS Benefits", accumulators.years_receiving_gis.mean))
-  writer.writerow(("Average Positive GIS Benefits Level", accumulators.positive_gis_benefits.mean))
-  writer.writerow(("Average Positive CPP Benefits Level", accumulators.positive_cpp_benefits.mean))
-  writer.writerow(("Average Years Gross Income Below LICO", accumulators.years_income_below_lico.mean))
-  writer.writerow(("Average Years with No Financial Assets at BoY", accumulators.years_with_no_assets.mean))
-  writer.writerow(("Replacement Rate (Consumption Basis)", accumulators.period_consumption.Query([person.RETIRED, person.INVOLUNTARILY_RETIRED]).mean / accumulators.period_consumption.Query([person.EMPLOYED, person.UNEMPLOYED]).mean))
-  writer.writerow(("Distributable Estate", accumulators.period_distributable_estate.Query([person.EMPLOYED, person.UNEMPLOYED, person.RETIRED, person.INVOLUNTARILY_RETIRED]).mean))
-  writer.writerow(("Average Years With Negative Consumption", accumulators.years_with_negative_consumption.mean))
-  writer.writerow(("Average Net Government Revenue", accumulators.net_government_revenue.mean))
+  _WriteRows(SummaryTable(gender, group_size, accumulators, weights, population_size, max_generations, accumulate_nominal), out)
 
-def WritePeriodSpecificTable(accumulators, out):
+def PeriodSpecificTable(accumulators):
+  """Returns the rows of the period specific table, starting with its header."""
   def GetRow(name, accumulator):
     return [name,
             accumulator.Query([person.EMPLOYED, person.UNEMPLOYED, person.RETIRED, person.INVOLUNTARILY_RETIRED]).mean,
@@ -270,36 +1058,40 @@ def WritePeriodSpecificTable(accumulators, out):
             accumulator.Query([person.RETIRED]).mean,
             accumulator.Query([person.INVOLUNTARILY_RETIRED]).mean]
 
-  writer = csv.writer(out, lineterminator='\n')
-  writer.writerow(("measure", "lifetime", "employed", "unemployed", "planned retirement", "unplanned retirement"))
+  rows = [("measure", "lifetime", "employed", "unemployed", "planned retirement", "unplanned retirement")]
   years_row = GetRow("Simulated years", accumulators.period_years)
   years_row[1] = None
-  writer.writerow(years_row)
-  writer.writerow(GetRow("Earnings", accumulators.period_earnings))
-  writer.writerow(GetRow("CPP benefits", accumulators.period_cpp_benefits))
-  writer.writerow(GetRow("OAS benefits", accumulators.period_oas_benefits))
-  writer.writerow(GetRow("Taxable capital gains", accumulators.period_taxable_gains))
-  writer.writerow(GetRow("GIS benefits", accumulators.period_gis_benefits))
-  writer.writerow(GetRow("Social benefits repaid", accumulators.period_social_benefits_repaid))
-  writer.writerow(GetRow("RRSP withdrawals", accumulators.period_rrsp_withdrawals))
-  writer.writerow(GetRow("TFSA withdrawals", accumulators.period_tfsa_withdrawals))
-  writer.writerow(GetRow("Nonregistered withdrawals", accumulators.period_nonreg_withdrawals))
-  writer.writerow(GetRow("CPP contributions", accumulators.period_cpp_contributions))
-  writer.writerow(GetRow("EI premiums", accumulators.period_ei_premiums))
-  writer.writerow(GetRow("Taxable income", accumulators.period_taxable_income))
-  writer.writerow(GetRow("Income tax", accumulators.period_income_tax))
-  writer.writerow(GetRow("Sales tax", accumulators.period_sales_tax))
-  writer.writerow(GetRow("Consumption", accumulators.period_consumption))
-  writer.writerow(GetRow("RRSP savings", accumulators.period_rrsp_savings))
-  writer.writerow(GetRow("TFSA savings", accumulators.period_tfsa_savings))
-  writer.writerow(GetRow("Nonregistered savings", accumulators.period_nonreg_savings))
-  writer.writerow(GetRow("Annual Fund Growth", accumulators.period_fund_growth))
-  writer.writerow(GetRow("Gross Estate", accumulators.period_gross_estate))
-  writer.writerow(GetRow("Estate Taxes", accumulators.period_estate_taxes))
-  writer.writerow(GetRow("Executor and Funeral Cost", accumulators.period_executor_funeral_costs))
-  writer.writerow(GetRow("Distributable Estate", accumulators.period_distributable_estate))
+  rows.append(years_row)
+  rows.append(GetRow("Earnings", accumulators.period_earnings))
+  rows.append(GetRow("CPP benefits", accumulators.period_cpp_benefits))
+  rows.append(GetRow("OAS benefits", accumulators.period_oas_benefits))
+  rows.append(GetRow("Taxable capital gains", accumulators.period_taxable_gains))
+  rows.append(GetRow("GIS benefits", accumulators.period_gis_benefits))
+  rows.append(GetRow("Social benefits repaid", accumulators.period_social_benefits_repaid))
+  rows.append(GetRow("RRSP withdrawals", accumulators.period_rrsp_withdrawals))
+  rows.append(GetRow("TFSA withdrawals", accumulators.period_tfsa_withdrawals))
+  rows.append(GetRow("Nonregistered withdrawals", accumulators.period_nonreg_withdrawals))
+  rows.append(GetRow("CPP contributions", accumulators.period_cpp_contributions))
+  rows.append(GetRow("EI premiums", accumulators.period_ei_premiums))
+  rows.append(GetRow("Taxable income", accumulators.period_taxable_income))
+  rows.append(GetRow("Income tax", accumulators.period_income_tax))
+  rows.append(GetRow("Sales tax", accumulators.period_sales_tax))
+  rows.append(GetRow("Consumption", accumulators.period_consumption))
+  rows.append(GetRow("RRSP savings", accumulators.period_rrsp_savings))
+  rows.append(GetRow("TFSA savings", accumulators.period_tfsa_savings))
+  rows.append(GetRow("Nonregistered savings", accumulators.period_nonreg_savings))
+  rows.append(GetRow("Annual Fund Growth", accumulators.period_fund_growth))
+  rows.append(GetRow("Gross Estate", accumulators.period_gross_estate))
+  rows.append(GetRow("Estate Taxes", accumulators.period_estate_taxes))
+  rows.append(GetRow("Executor and Funeral Cost", accumulators.period_executor_funeral_costs))
+  rows.append(GetRow("Distributable Estate", accumulators.period_distributable_estate))
+  return rows
 
-def WriteAgeSpecificTable(accumulators, group_size, out):
+def WritePeriodSpecificTable(accumulators, out):
+  _WriteRows(PeriodSpecificTable(accumulators), out)
+
+def AgeSpecificTable(accumulators, group_size):
+  """Returns the rows of the age specific table, starting with its header."""
   def GetRow(age):
     return [age,
             accumulators.persons_alive_by_age.Query([age]).n,
@@ -339,37 +1131,189 @@ def WriteAgeSpecificTable(accumulators, group_size, out):
             accumulators.consumption_by_age.Query([age]).cv,
             ]
 
-  writer = csv.writer(out, lineterminator='\n')
-  writer.writerow(("age", "Persons", "Gross Earnings", "Income Tax", "EI Premiums", "CPP Contrib", "Sales Tax", "EI Benefits", "CPP Benefits", "OAS Benefits", "GIS Benefits", "Total Savings", "RRSP Withdrawals", "RRSP Assets", "Bridging Assets", "TFSA Withdrawals", "TFSA Assets", "Non Registered Withdrawals", "NonRegistered Assets", "Consumption Mean", "Consumption 10th %ile", "Consumption 90th %ile", "CD Withdrawals", "CD Requested", "CED Withdrawals", "CED Requested", "RRSP CED Assets", "TFSA CED Assets", "Non Registered CED Assets", "RRSP CD Assets", "TFSA CD Assets", "Non Registered CD Assets", "CED Ruined", "CD Ruined", "Earnings CoV", "Consumption CoV"))
+  rows = [("age", "Persons", "Gross Earnings", "Income Tax", "EI Premiums", "CPP Contrib", "Sales Tax", "EI Benefits", "CPP Benefits", "OAS Benefits", "GIS Benefits", "Total Savings", "RRSP Withdrawals", "RRSP Assets", "Bridging Assets", "TFSA Withdrawals", "TFSA Assets", "Non Registered Withdrawals", "NonRegistered Assets", "Consumption Mean", "Consumption 10th %ile", "Consumption 90th %ile", "CD Withdrawals", "CD Requested", "CED Withdrawals", "CED Requested", "RRSP CED Assets", "TFSA CED Assets", "Non Registered CED Assets", "RRSP CD Assets", "TFSA CD Assets", "Non Registered CD Assets", "CED Ruined", "CD Ruined", "Earnings CoV", "Consumption CoV")]
   for age in range(world.START_AGE, max(world.MALE_MORTALITY.keys())+1):
-    writer.writerow(GetRow(age))
+    rows.append(GetRow(age))
+  return rows
+
+def WriteAgeSpecificTable(accumulators, group_size, out):
+  _WriteRows(AgeSpecificTable(accumulators, group_size), out)
+
+def StrategyTable(strategy):
+  """Returns the rows of the strategy table, starting with its header."""
+  rows = [("parameter", "value")]
+  rows.append(("Planned Retirement Age", strategy.planned_retirement_age))
+  rows.append(("Savings Threshold", strategy.savings_threshold))
+  rows.append(("Savings Rate", strategy.savings_rate))
+  rows.append(("Savings RRSP Fraction", strategy.savings_rrsp_fraction))
+  rows.append(("Savings TFSA Fraction", strategy.savings_tfsa_fraction))
+  rows.append(("Working Period Drawdown TFSA Fraction", strategy.working_period_drawdown_tfsa_fraction))
+  rows.append(("Working Period Drawdown NonReg Fraction", strategy.working_period_drawdown_nonreg_fraction))
+  rows.append(("OAS Bridging Fraction", strategy.oas_bridging_fraction))
+  rows.append(("Drawdown CED Fraction", strategy.drawdown_ced_fraction))
+  rows.append(("Initial CD Fraction", strategy.initial_cd_fraction))
+  rows.append(("Drawdown Preferred RRSP Fraction", strategy.drawdown_preferred_rrsp_fraction))
+  rows.append(("Drawdown Preferred TFSA Fraction", strategy.drawdown_preferred_tfsa_fraction))
+  return rows
 
 def WriteStrategyTable(strategy, out):
-  writer = csv.writer(out, lineterminator='\n')
-  writer.writerow(("parameter", "value"))
-  writer.writerow(("Planned Retirement Age", strategy.planned_retirement_age))
-  writer.writerow(("Savings Threshold", strategy.savings_threshold))
-  writer.writerow(("Savings Rate", strategy.savings_rate))
-  writer.writerow(("Savings RRSP Fraction", strategy.savings_rrsp_fraction))
-  writer.writerow(("Savings TFSA Fraction", strategy.savings_tfsa_fraction))
-  writer.writerow(("Working Period Drawdown TFSA Fraction", strategy.working_period_drawdown_tfsa_fraction))
-  writer.writerow(("Working Period Drawdown NonReg Fraction", strategy.working_period_drawdown_nonreg_fraction))
-  writer.writerow(("OAS Bridging Fraction", strategy.oas_bridging_fraction))
-  writer.writerow(("Drawdown CED Fraction", strategy.drawdown_ced_fraction))
-  writer.writerow(("Initial CD Fraction", strategy.initial_cd_fraction))
-  writer.writerow(("Drawdown Preferred RRSP Fraction", strategy.drawdown_preferred_rrsp_fraction))
-  writer.writerow(("Drawdown Preferred TFSA Fraction", strategy.drawdown_preferred_tfsa_fraction))
+  _WriteRows(StrategyTable(strategy), out)
+
+
+def ReportTables(tables, gender, group_size, strategy, batch_accumulators, weights, population_size, max_generations, accumulate_nominal):
+  """Returns a dict of the rows of each report table named in tables, in the
+  order of TABLES, for the accumulators of each batch of a population of
+  group_size lives."""
+  accumulators = MergeBatches(batch_accumulators)
+  builders = {
+    "summary": lambda: SummaryTable(gender, group_size, accumulators, weights, population_size, max_generations, accumulate_nominal),
+    "strategy": lambda: StrategyTable(strategy),
+    "fitness": lambda: FitnessFunctionCompositionTable(
+        GetFitnessFunctionCompositionTableRows(accumulators, weights, batch_accumulators) + [GetFitnessTotalRow(accumulators, weights, batch_accumulators)]),
+    "period": lambda: PeriodSpecificTable(accumulators),
+    "age": lambda: AgeSpecificTable(accumulators, group_size),
+  }
+  return {table: builders[table]() for table in TABLES if table in tables}
+
+def _WriteTables(tables, out):
+  for i, rows in enumerate(tables.values()):
+    if i:
+      out.write('\n')
+    _WriteRows(rows, out)
+
+def WriteReports(tables, gender, group_size, strategy, batch_accumulators, weights, population_size, max_generations, accumulate_nominal, out):
+  """Writes the report tables named in tables to out, in the order of TABLES
+  and separated by blank lines, as for ReportTables."""
+  _WriteTables(ReportTables(tables, gender, group_size, strategy, batch_accumulators, weights, population_size, max_generations, accumulate_nominal), out)
+
+
+# Lives to simulate when --number isn't given, without --time_budget or
+# --target_stderr
+DEFAULT_NUMBER = 1000
+
+# Batches lives are split into for confidence intervals, when not given. The
+# optimizer runs lives in a single batch unless it needs more, since it only
+# reads the fitness.
+DEFAULT_BATCHES = 10
+
+def Weights(weights=None):
+  """Returns fitness function weights for every component, from a dict of the
+  nonzero ones."""
+  weights = dict(weights or {})
+  unknown = set(weights) - {component.name for component in FITNESS_COMPONENTS}
+  if unknown:
+    raise ValueError('%s are not fitness function components' % ', '.join(sorted(unknown)))
+  return {component.name: float(weights[component.name]) if component.name in weights else 0 for component in FITNESS_COMPONENTS}
+
+class Results(object):
+  """The accumulators of each batch of lives lives simulated for a strategy,
+  with the fitness function weights and tables they were simulated for.
+  interrupted is whether the run was interrupted, so the lives may be fewer
+  than asked for."""
+
+  def __init__(self, strategy, gender, real_values, lives, batch_accumulators, weights, tables, interrupted=False):
+    self.strategy = strategy
+    self.gender = gender
+    self.real_values = real_values
+    self.lives = lives
+    self.batch_accumulators = batch_accumulators
+    self.weights = weights
+    self.tables = tables
+    self.interrupted = interrupted
+
+  @property
+  def accumulators(self):
+    """The accumulators of all the lives."""
+    return MergeBatches(self.batch_accumulators)
+
+  def Fitness(self):
+    return Fitness(self.accumulators, self.weights)
+
+  def FitnessRows(self):
+    """Returns a FitnessFunctionCompositionRow for each component, and one for
+    the total."""
+    accumulators = self.accumulators
+    return (GetFitnessFunctionCompositionTableRows(accumulators, self.weights, self.batch_accumulators) +
+            [GetFitnessTotalRow(accumulators, self.weights, self.batch_accumulators)])
+
+  def Tables(self, tables=None):
+    """Returns the rows of the report tables, as for ReportTables, for tables
+    from those simulated for, or all of them."""
+    tables = self.tables if tables is None else tables
+    if not set(tables) <= set(self.tables):
+      raise ValueError('the lives were not simulated for the %s tables' % ','.join(sorted(set(tables) - set(self.tables))))
+    return ReportTables(tables, self.gender, self.lives, self.strategy, self.batch_accumulators, self.weights, 1, 1, not self.real_values)
 
+  def Write(self, out, tables=None):
+    """Writes the report tables to out, as the run command does."""
+    _WriteTables(self.Tables(tables), out)
+
+def SimulateVariants(strategy, variants, n=None, weights=None, tables=TABLES, scenario_bank=None, economic_model=None, quantile_sketches=None, batches=DEFAULT_BATCHES, seed=None, use_multiprocessing=True, workers=None, chunk_size=None, pin_workers=False, backend=None, time_budget=None, stderr_targets=(), round_size=None, progress=None, interrupt=None):
+  """Simulates lives for a strategy once for a list of (gender, real_values)
+  variants, as for RunPopulationVariants, and returns a dict of each
+  variant's Results.
+
+  weights is a dict of the nonzero fitness function weights, and tables names
+  the report tables the lives are simulated for. Without time_budget or
+  stderr_targets, n lives run, DEFAULT_NUMBER by default. Otherwise lives run
+  in rounds as for RunPopulationRounds, up to n of them unless n is None. The
+  other arguments are as for RunPopulationRounds. Worker processes are kept
+  for later calls until ClosePool.
+  """
+  weights = Weights(weights)
+  if not set(tables) <= set(TABLES):
+    raise ValueError('tables must be from %s' % ','.join(TABLES))
+  if n is None and time_budget is None and not stderr_targets:
+    n = DEFAULT_NUMBER
+  schema = SubscribedSchema(weights, tables)
+  basic = not set(tables) & {'summary', 'period', 'age'}
+  (gender, real_values), = variants[:1]
+  batch_accumulators, lives = RunPopulationRounds(strategy, gender, basic, real_values, use_multiprocessing, scenario_bank, economic_model, quantile_sketches, schema, batches, seed=seed, workers=workers, chunk_size=chunk_size, pin_workers=pin_workers, backend=backend, max_number=n, time_budget=time_budget, stderr_targets=stderr_targets, weights=weights, round_size=round_size, progress=progress, interrupt=interrupt, variants=variants if len(variants) > 1 else None)
+  interrupted = interrupt is not None and interrupt.is_set()
+  return {variant: Results(strategy, variant[0], variant[1], lives, batch_accumulators[i*batches:(i + 1)*batches], weights, tables, interrupted)
+          for i, variant in enumerate(variants)}
+
+def Simulate(strategy, n=None, gender=person.FEMALE, real_values=True, **kwargs):
+  """Simulates lives for a strategy, and returns their Results. The other
+  arguments are as for SimulateVariants."""
+  return SimulateVariants(strategy, [(gender, real_values)], n, **kwargs)[(gender, real_values)]
 
 if __name__ == '__main__':
   # Set up flags
   parser = argparse.ArgumentParser(fromfile_prefix_chars='@')
 
-  parser.add_argument('--number', help='Number of lives to simulate', type=int, default=1000)
-  parser.add_argument('--gender', help='The gender of the people to simulate', choices=[person.MALE, person.FEMALE], default=person.FEMALE)
+  parser.add_argument('command', help='run simulates lives and outputs the tables. merge outputs the tables for the lives in shard snapshot files. serve-workers runs worker processes for the run at --coordinator.', nargs='?', choices=['run', 'merge', 'serve-workers'], default='run')
+  parser.add_argument('snapshots', help='Snapshot files to merge', nargs='*')
+
+  parser.add_argument('--number', help='Number of lives to simulate. Defaults to %d. Use --max_number with --time_budget or --target_stderr' % DEFAULT_NUMBER, type=int, default=None)
+  parser.add_argument('--time_budget', help='Seconds to keep simulating lives for. With --optimize, the budget of each fitness evaluation', type=float, default=None)
+  parser.add_argument('--target_stderr', help='Keep simulating lives until the batch means standard errors meet these targets. Comma separated targets, each a number or a percentage of the value, for the fitness function value or after COMPONENT= for a weighted component, like 1%%,FractionPersonsRuined=0.002. With --optimize, applies to each fitness evaluation', type=ParseStderrTargets, default=None)
+  parser.add_argument('--max_number', help='Most lives to simulate with --time_budget or --target_stderr. Defaults to no limit', type=int, default=None)
+  parser.add_argument('--report_every', help='Simulate lives in rounds of this many, and after each write the lives so far to --interim_report and --snapshot_out', type=int, default=None)
+  parser.add_argument('--interim_report', help='File to write the report tables for the lives so far to after each round of --report_every lives', default=None)
+  parser.add_argument('--gender', help='The gender of the people to simulate, %s or %s. Both, comma separated, simulates each life for each gender with the same random draws' % (person.MALE, person.FEMALE), type=ParseGenders, default=[person.FEMALE])
   parser.add_argument('--disable_multiprocessing', help='Only run on a single process', action='store_true', default=False)
-  parser.add_argument('--basic_run', help='Only output the fitness function component and strategy tables', action='store_true', default=False)
+  parser.add_argument('--workers', help='Number of worker processes. Defaults to the number of CPUs available, allowing for the CPU affinity mask and cgroup CPU quota. With --coordinator, the number expected across the serve-workers nodes, which sizes the chunks of lives; without it, the lives are split into %d chunks' % CLUSTER_CHUNKS, type=int, default=None)
+  parser.add_argument('--pin_workers', help='Pin each worker process to a different CPU', action='store_true', default=False)
+  parser.add_argument('--backend', help='Run lives on worker processes or threads. Defaults to threads on free-threaded Python builds, and processes elsewhere', choices=[PROCESSES, THREADS], default=None)
+  parser.add_argument('--coordinator', help='HOST:PORT a run listens on for serve-workers nodes to run its lives, or that serve-workers connects to', type=cluster.ParseAddress, default=None)
+  parser.add_argument('--authkey', help='Key that serve-workers nodes and the run at --coordinator authenticate each other with. Defaults to the MINI_RUTHEN_AUTHKEY environment variable', default=os.environ.get('MINI_RUTHEN_AUTHKEY'))
+  parser.add_argument('--worker_timeout', help='Seconds a run at --coordinator waits to hear from a node running lives before handing them to another', type=float, default=cluster.WORKER_TIMEOUT)
+  parser.add_argument('--chunk_size', help='Lives handed to a worker process at a time. Defaults to splitting the lives into %d chunks per worker' % CHUNKS_PER_WORKER, type=int, default=None)
+  parser.add_argument('--basic_run', help='Only output the fitness function component and strategy tables. Same as --tables=strategy,fitness', action='store_true', default=False)
+  parser.add_argument('--batches', help='Independent batches the lives are split into, to estimate confidence intervals for the fitness function and its components. Defaults to %d, or as many as there are lives if fewer' % DEFAULT_BATCHES, type=int, default=None)
+  parser.add_argument('--shard', help='Only simulate shard i of k equal slices of the --number lives, counting from 0, as i/k', type=ParseShard, default=(0, 1))
+  parser.add_argument('--snapshot_out', help='Write the accumulators to this snapshot file for the merge command, instead of outputting tables')
+  parser.add_argument('--seed', help='Seed each life from this and its number, so means and variances do not depend on how lives are split between processes and shards', default=None)
+  parser.add_argument('--tables', help='Comma separated tables to output, from %s. Only the accumulators they need are kept.' % ','.join(TABLES), default=','.join(TABLES))
   parser.add_argument('--accumulate_nominal_values', help='Store nominal dollar amounts in accumulators. Ignored for optimization runs.', action='store_true', default=False)
+  parser.add_argument('--accumulate_real_and_nominal_values', help='Store real and nominal dollar amounts in separate accumulators, from the same lives, and report on each', action='store_true', default=False)
+  parser.add_argument('--output', help='File to write the report tables to, instead of standard output. With more than one gender, or real and nominal values, {gender} and {values} are replaced by each one\'s gender and real or nominal, to name its file', default=None)
+  parser.add_argument('--scenario_bank', help='File of pre-drawn economic scenarios to use instead of drawing them for each life')
+  parser.add_argument('--generate_scenarios', help='Write this many economic scenarios to --scenario_bank before running', type=int, default=0)
+  parser.add_argument('--scenario_seed', help='Random seed for --generate_scenarios', type=int, default=None)
+  parser.add_argument('--quantile_sketch', help='Sketch used to estimate all consumption quantiles, instead of the defaults', choices=sorted(utils.QUANTILE_SKETCHES), default=None)
+  parser.add_argument('--quantile_sketch_size', help='Size parameter of --quantile_sketch: bins for histogram and grid, compression for tdigest, k for kll', type=int, default=None)
 
   # Strategy parameters (validation runs only)
   parser.add_argument("--planned_retirement_age", help="strategy parameter", type=int, default=65)
@@ -450,6 +1394,90 @@ if __name__ == '__main__':
   parser.add_argument("--population_size", help="Individuals in the genetic algorithm's population", type=int, default=150)
 
   args = parser.parse_args()
+  if args.generate_scenarios and not args.scenario_bank:
+    parser.error('--generate_scenarios requires --scenario_bank')
+  tables = ('strategy', 'fitness') if args.basic_run else args.tables.split(',')
+  if not set(tables) <= set(TABLES):
+    parser.error('--tables must be from %s' % ','.join(TABLES))
+  basic = not set(tables) & {'summary', 'period', 'age'}
+  rounds = args.time_budget is not None or args.target_stderr is not None
+  if rounds and args.number is not None:
+    parser.error('--number cannot be used with --time_budget or --target_stderr. Use --max_number')
+  if not rounds and args.max_number is not None:
+    parser.error('--max_number requires --time_budget or --target_stderr')
+  if not rounds:
+    args.number = DEFAULT_NUMBER if args.number is None else args.number
+  max_number = args.max_number if rounds else args.number
+  # The optimizer only needs batches for --target_stderr, or to report the
+  # intervals asked for
+  batches_given = args.batches is not None
+  if not batches_given:
+    args.batches = DEFAULT_BATCHES if max_number is None else max(min(DEFAULT_BATCHES, max_number), 1)
+  optimize_batches = args.batches if batches_given or args.target_stderr is not None else 1
+  if args.batches < 1 or (max_number is not None and args.batches > max_number):
+    parser.error('--batches must be between 1 and --number or --max_number')
+  if args.time_budget is not None and args.time_budget <= 0:
+    parser.error('--time_budget must be positive')
+  if args.target_stderr is not None and args.batches < 2:
+    parser.error('--target_stderr requires --batches of at least 2')
+  if rounds and (args.command == 'merge' or args.shard != (0, 1)):
+    parser.error('--time_budget and --target_stderr cannot be used with merge or --shard')
+  if args.report_every is not None and args.report_every < 1:
+    parser.error('--report_every must be at least 1')
+  if args.report_every is not None and not (args.interim_report or args.snapshot_out):
+    parser.error('--report_every requires --interim_report or --snapshot_out')
+  if args.interim_report and args.report_every is None:
+    parser.error('--interim_report requires --report_every')
+  if args.report_every is not None and (args.command == 'merge' or args.optimize):
+    parser.error('--report_every cannot be used with merge or --optimize')
+  if args.accumulate_nominal_values and args.accumulate_real_and_nominal_values:
+    parser.error('--accumulate_nominal_values cannot be used with --accumulate_real_and_nominal_values')
+  if args.accumulate_real_and_nominal_values:
+    values = [True, False]
+  else:
+    values = [not args.accumulate_nominal_values]
+  variants = [(gender, real_values) for gender in args.gender for real_values in values]
+  if len(variants) > 1 and (args.command == 'merge' or args.optimize or args.snapshot_out):
+    parser.error('more than one gender, or real and nominal values, cannot be used with merge, --optimize or --snapshot_out')
+  for template in (args.output, args.interim_report):
+    if template is None:
+      continue
+    try:
+      names = {template.format(gender=gender, values="real" if real_values else "nominal") for gender, real_values in variants}
+    except (KeyError, IndexError, ValueError):
+      parser.error('%s may only have {gender} and {values} in braces' % template)
+    if len(names) < len(variants):
+      parser.error('with more than one gender, or real and nominal values, --output and --interim_report need {gender} or {values} to tell them apart')
+  if len(variants) > 1 and args.output is None:
+    parser.error('more than one gender, or real and nominal values, requires --output')
+  if args.command == 'merge' and not args.snapshots:
+    parser.error('merge requires snapshot files')
+  if args.command == 'run' and args.snapshots:
+    parser.error('snapshot files can only be given to merge')
+  if args.optimize and (args.command == 'merge' or args.snapshot_out or args.shard != (0, 1)):
+    parser.error('--optimize cannot be used with merge, --shard or --snapshot_out')
+  if args.workers is not None and args.workers < 1:
+    parser.error('--workers must be at least 1')
+  if args.chunk_size is not None and args.chunk_size < 1:
+    parser.error('--chunk_size must be at least 1')
+  if args.pin_workers and not hasattr(os, 'sched_setaffinity'):
+    parser.error('--pin_workers is not supported on this platform')
+  if args.pin_workers and args.backend == THREADS:
+    parser.error('--pin_workers only applies to worker processes')
+  if args.command == 'serve-workers' and not args.coordinator:
+    parser.error('serve-workers requires --coordinator')
+  if args.coordinator and args.command == 'merge':
+    parser.error('--coordinator cannot be used with merge')
+  if args.coordinator and (args.disable_multiprocessing or args.backend or args.pin_workers):
+    parser.error('--coordinator cannot be used with --disable_multiprocessing, --backend or --pin_workers')
+  if args.coordinator and not args.authkey:
+    parser.error('--coordinator requires --authkey or MINI_RUTHEN_AUTHKEY')
+
+  if args.command == 'serve-workers':
+    workers = args.workers or utils.AvailableCPUs()
+    sys.stderr.write('Running %d worker processes for the coordinator at %s:%d\n' % ((workers,) + args.coordinator))
+    ServeWorkers(args.coordinator, args.authkey.encode(), workers)
+    sys.exit()
 
   bounds = StrategyBounds(
       args.planned_retirement_age_min,
@@ -527,23 +1555,127 @@ if __name__ == '__main__':
     "ConsumptionAvgRetirementBelowFractionAvgWorking": args.consumption_avg_retirement_below_fraction_avg_working,
     "AverageDistributableEstate": args.average_distributable_estate,
   }
+  stderr_targets = args.target_stderr or ()
+  for target in stderr_targets:
+    if target.component != TOTAL and not weights[target.component]:
+      parser.error('--target_stderr component %s must have a nonzero weight' % target.component)
+
+  if args.quantile_sketch_size and not args.quantile_sketch:
+    parser.error('--quantile_sketch_size requires --quantile_sketch')
+  quantile_sketches = None
+  if args.quantile_sketch:
+    if args.quantile_sketch_size:
+      sketch = (args.quantile_sketch, args.quantile_sketch_size)
+    else:
+      sketch = args.quantile_sketch
+    quantile_sketches = {name: sketch for name in utils.QUANTILE_ACCUMULATORS}
+
+  workers = args.workers
+  backend = args.backend
+  if args.coordinator:
+    backend = CLUSTER
+    coordinator = StartCoordinator(args.coordinator, args.authkey.encode(), args.worker_timeout)
+    sys.stderr.write('Running lives on serve-workers nodes connected to %s:%d%s\n' % (coordinator.address + (' with %d worker processes expected' % workers if workers else '',)))
+  elif args.command == 'run' and not args.disable_multiprocessing:
+    cpus = utils.AvailableCPUs()
+    if workers is None:
+      workers = cpus
+    if backend is None:
+      backend = THREADS if FreeThreaded() else PROCESSES
+    sys.stderr.write('Running lives on %d worker %s, with %d CPUs available%s\n' % (workers, backend, cpus, ' and workers pinned' if args.pin_workers and backend == PROCESSES else ''))
+
+  if args.generate_scenarios:
+    economy.WriteScenarioBank(args.scenario_bank, args.generate_scenarios, args.scenario_seed)
+  if args.scenario_bank and args.command == 'run' and max_number is not None and max_number > len(economy.OpenScenarioBank(args.scenario_bank)):
+    parser.error('--scenario_bank has %d scenarios, fewer than the lives to simulate' % len(economy.OpenScenarioBank(args.scenario_bank)))
 
   if args.optimize:
-    strategy = Optimize(args.gender, args.number, weights, args.population_size, args.max_generations, not args.disable_multiprocessing, bounds)
-
-  # Run lives
-  accumulators = RunPopulation(strategy, args.gender, args.number, args.basic_run, not args.accumulate_nominal_values, not args.disable_multiprocessing)
-
-  # Output reports
-  if not args.basic_run:
-    WriteSummaryTable(args.gender, args.number, accumulators, weights, args.population_size if args.optimize else 1, args.max_generations if args.optimize else 1, args.accumulate_nominal_values, sys.stdout, )
-    sys.stdout.write('\n')
-  WriteStrategyTable(strategy, sys.stdout)
-  sys.stdout.write('\n')
-  fitness_fcn_comp_rows = GetFitnessFunctionCompositionTableRows(accumulators, weights)
-  WriteFitnessFunctionCompositionTable(fitness_fcn_comp_rows, sys.stdout)
-  if not args.basic_run:
-    sys.stdout.write('\n')
-    WritePeriodSpecificTable(accumulators, sys.stdout)
-    sys.stdout.write('\n')
-    WriteAgeSpecificTable(accumulators, args.number, sys.stdout)
+    strategy = Optimize(weights, bounds, max_number, args.gender[0], args.population_size, args.max_generations, args.scenario_bank, quantile_sketches=quantile_sketches, batches=optimize_batches, seed=args.seed,
+                        use_multiprocessing=not args.disable_multiprocessing, workers=workers, chunk_size=args.chunk_size, pin_workers=args.pin_workers, backend=backend,
+                        time_budget=args.time_budget, stderr_targets=stderr_targets, out=sys.stdout).strategy
+
+  schema = SubscribedSchema(weights, tables)
+  interrupted = []  # Signals that interrupted the run
+
+  def WriteVariantReports(template, variant_accumulators, group_size, population_size=1, max_generations=1):
+    """Writes the report tables for each variant and its batch accumulators,
+    to standard output without a template, or else replacing the file the
+    template names for it."""
+    for (gender, real_values), batch_accumulators in variant_accumulators:
+      if template is None:
+        WriteReports(tables, gender, group_size, strategy, batch_accumulators, weights, population_size, max_generations, not real_values, sys.stdout)
+        continue
+      filename = template.format(gender=gender, values="real" if real_values else "nominal")
+      with open(filename + '.tmp', 'w') as out:
+        WriteReports(tables, gender, group_size, strategy, batch_accumulators, weights, population_size, max_generations, not real_values, out)
+      os.replace(filename + '.tmp', filename)
+
+  if args.command == 'merge':
+    try:
+      metadata, batch_accumulators = MergeSnapshots([utils.ReadSnapshot(snapshot) for snapshot in args.snapshots])
+    except (OSError, ValueError) as e:
+      parser.error(str(e))
+    if not {spec.name for spec in schema} <= set(metadata["accumulators"]):
+      parser.error('the snapshots lack accumulators for these tables and weights. Use the --tables and weights of the shard runs.')
+    strategy = person.Strategy(**metadata["strategy"])
+    variant_accumulators = [((metadata["gender"], metadata["real_values"]), batch_accumulators)]
+    group_size = metadata["lives"]
+  else:
+    # Run lives. SIGINT or SIGTERM lets the lives under way finish, and
+    # reports those run so far.
+    interrupt = threading.Event()
+    def Interrupt(signum, frame):
+      if interrupt.is_set():
+        raise KeyboardInterrupt
+      interrupted.append(signum)
+      interrupt.set()
+      sys.stderr.write('Interrupted. Finishing the lives under way to report on, interrupt again to stop now\n')
+    signal.signal(signal.SIGINT, Interrupt)
+    signal.signal(signal.SIGTERM, Interrupt)
+
+    shard, shards = args.shard
+    first_life = 0
+    max_lives = args.max_number
+    if not rounds:
+      first_life = args.number * shard // shards
+      max_lives = args.number * (shard + 1) // shards - first_life
+
+    def WriteRunSnapshot(batch_accumulators, lives):
+      utils.WriteSnapshot(args.snapshot_out, batch_accumulators, {
+          "number": args.number or lives,
+          "shard": args.shard,
+          "first_life": first_life,
+          "lives": lives,
+          "batches": args.batches,
+          "seed": args.seed,
+          "gender": variants[0][0],
+          "real_values": variants[0][1],
+          "strategy": strategy._asdict(),
+          "quantile_sketch": [args.quantile_sketch, args.quantile_sketch_size],
+          "scenario_bank": args.scenario_bank,
+      })
+
+    def VariantAccumulators(results):
+      return [(variant, results[i*args.batches:(i + 1)*args.batches]) for i, variant in enumerate(variants)]
+
+    def Progress(batch_accumulators, lives):
+      if args.interim_report:
+        WriteVariantReports(args.interim_report, VariantAccumulators(batch_accumulators), lives)
+      if args.snapshot_out:
+        WriteRunSnapshot(batch_accumulators, lives)
+
+    start = time.monotonic()
+    batch_accumulators, lives = RunPopulationRounds(strategy, variants[0][0], basic, variants[0][1], not args.disable_multiprocessing, args.scenario_bank, quantile_sketches=quantile_sketches, schema=schema, batches=args.batches, first_life=first_life, seed=args.seed, workers=workers, chunk_size=args.chunk_size, pin_workers=args.pin_workers, backend=backend, max_number=max_lives, time_budget=args.time_budget, stderr_targets=stderr_targets, weights=weights, round_size=args.report_every, progress=Progress if args.report_every else None, interrupt=interrupt, variants=variants if len(variants) > 1 else None)
+    sys.stderr.write('Ran %d lives in %.1f seconds\n' % (lives, time.monotonic() - start))
+    if stderr_targets and not interrupted:
+      needed = max(LivesForStderrTargets(accumulators, weights, stderr_targets, lives) for _, accumulators in VariantAccumulators(batch_accumulators))
+      if needed > lives:
+        sys.stderr.write('Stopped short of --target_stderr, which needs about %s lives\n' % needed)
+    variant_accumulators = VariantAccumulators(batch_accumulators)
+    group_size = lives
+    if args.snapshot_out:
+      WriteRunSnapshot(batch_accumulators, lives)
+      sys.exit(128 + interrupted[0] if interrupted else None)
+  WriteVariantReports(args.output, variant_accumulators, group_size, args.population_size if args.optimize else 1, args.max_generations if args.optimize else 1)
+  if interrupted:
+    sys.exit(128 + interrupted[0])
@@ -0,0 +1,385 @@
+import argparse
+import concurrent.futures
+import io
+import math
+import multiprocessing
+import os
+import tempfile
+import unittest
+import unittest.mock
+import cluster
+import economy
+import mini_ruthen
+import person
+import utils
+import world
+
+def InterruptAt(interrupt, first_life):
+  """Returns a patch of the lives worker that sets interrupt as it finishes
+  the chunk starting with life first_life."""
+  worker = mini_ruthen.RunPopulationBatchesWorker
+  def Worker(*args, **kwargs):
+    results = worker(*args, **kwargs)
+    if args[6] == first_life:
+      interrupt.set()
+    return results
+  return unittest.mock.patch.object(mini_ruthen, "RunPopulationBatchesWorker", Worker)
+
+class RunPopulationTest(unittest.TestCase):
+
+  def setUp(self):
+    self.default_strategy = person.Strategy(
+        planned_retirement_age=65,
+        savings_threshold=0,
+        savings_rate=0.1,
+        savings_rrsp_fraction=0.1,
+        savings_tfsa_fraction=0.2,
+        working_period_drawdown_tfsa_fraction=0.5,
+        working_period_drawdown_nonreg_fraction=0.5,
+        oas_bridging_fraction=1.0,
+        drawdown_ced_fraction=0.8,
+        initial_cd_fraction=0.04,
+        drawdown_preferred_rrsp_fraction=0.35,
+        drawdown_preferred_tfsa_fraction=0.5,
+        )
+    self.economic_model = economy.EconomicModel(
+        means=(world.INFLATION_MEAN, world.MEAN_INVESTMENT_RETURN, world.PARGE),
+        stddevs=(0.01, 0.05, 0.01),
+        correlations=[[1, 0.3, 0.2], [0.3, 1, 0], [0.2, 0, 1]],
+        persistence=[[0.5, 0, 0], [0, 0, 0], [0, 0, 0.3]])
+
+  def tearDown(self):
+    mini_ruthen.ClosePool()
+
+  def assertSameLives(self, accumulators1, accumulators2):
+    for name in ("lifetime_consumption_summary", "earnings_late_working_summary"):
+      self.assertEqual(getattr(accumulators1, name).n, getattr(accumulators2, name).n)
+      self.assertAlmostEqual(getattr(accumulators1, name).mean, getattr(accumulators2, name).mean)
+
+  def testEconomicModelIndependentOfChunks(self):
+    def Run(use_multiprocessing, **kwargs):
+      return mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, 12, False, True, use_multiprocessing,
+                                              economic_model=self.economic_model, seed="chunks", **kwargs)[0]
+    unchunked = Run(False)
+    self.assertSameLives(unchunked, Run(True, backend=mini_ruthen.THREADS, workers=2, chunk_size=1))
+    self.assertSameLives(unchunked, Run(True, backend=mini_ruthen.THREADS, workers=3, chunk_size=5))
+    self.assertSameLives(unchunked, Run(True, backend=mini_ruthen.PROCESSES, workers=2, chunk_size=4))
+
+  def testEconomicModelShardsMatchUnshardedRun(self):
+    def Run(n, first_life):
+      return mini_ruthen.RunPopulationBatchesWorker(self.default_strategy, person.FEMALE, n, False, True, first_scenario=first_life,
+                                                   economic_model=self.economic_model, seed="shards")[0]
+    sharded = Run(5, 0)
+    sharded.Merge(Run(7, 5))
+    self.assertSameLives(Run(12, 0), sharded)
+
+  def testSeededRunsWithKLLSketchesMatch(self):
+    def Run():
+      return mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, 20, False, True, True, seed="kll",
+                                              quantile_sketches={name: ("kll", 8) for name in utils.QUANTILE_ACCUMULATORS},
+                                              backend=mini_ruthen.PROCESSES, workers=2, chunk_size=3)[0]
+    self.assertEqual(Run().ToBytes(), Run().ToBytes())
+
+  def testConcurrentProcessRuns(self):
+    def Run(seed):
+      return mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, 8, False, True, True, seed=seed,
+                                              backend=mini_ruthen.PROCESSES, workers=2, chunk_size=1)[0].ToBytes()
+    seeds = ["concurrent%d" % i for i in range(4)]
+    expected = [Run(seed) for seed in seeds]
+    with concurrent.futures.ThreadPoolExecutor(len(seeds)) as executor:
+      self.assertEqual(list(executor.map(Run, seeds)), expected)
+
+  def testShortfallComponentSubscribesOnlyItsAccumulator(self):
+    weights = {component.name: 0 for component in mini_ruthen.FITNESS_COMPONENTS}
+    weights["ConsumptionAvgRetirementBelowFractionAvgWorking"] = 1
+    schema = mini_ruthen.SubscribedSchema(weights, ())
+    self.assertEqual([spec.name for spec in schema], ["retirement_consumption_less_working_consumption"])
+    accumulators = mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, 3, True, True, False, schema=schema)[0]
+    self.assertEqual(accumulators.retirement_consumption_less_working_consumption.n, 3)
+
+  def testScenarioBankTooSmall(self):
+    fd, filename = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    self.addCleanup(os.remove, filename)
+    self.addCleanup(economy._open_banks.pop, filename, None)
+    economy.WriteScenarioBank(filename, 4, seed=1)
+    def Run(n, first_life=0):
+      return mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, n, True, True, False, scenario_bank=filename, first_life=first_life)
+    self.assertEqual(Run(4)[0].fraction_persons_ruined.n, 4)
+    with self.assertRaises(ValueError):
+      Run(5)
+    with self.assertRaises(ValueError):
+      Run(2, first_life=3)
+
+  def testClusterChunksDontDependOnNodesConnected(self):
+    coordinator = mini_ruthen.StartCoordinator(("localhost", 0), b"mini_ruthen_test")
+    calls = []
+    def Map(function, args_list, cancel=None):
+      calls.append(len(args_list))
+      return cluster.Coordinator.Map(coordinator, function, args_list, cancel)
+    node = multiprocessing.Process(target=cluster.Serve, args=(coordinator.address, b"mini_ruthen_test", 2, 10, mini_ruthen.InitializeWorker))
+    with unittest.mock.patch.object(coordinator, "Map", Map):
+      # No node has connected yet when the run starts
+      self.assertEqual(coordinator.Workers(), 0)
+      node.start()
+      accumulators = mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, 12, True, True, True, backend=mini_ruthen.CLUSTER)[0]
+    mini_ruthen.ClosePool()
+    node.join(10)
+    self.assertEqual(accumulators.fraction_persons_ruined.n, 12)
+    self.assertEqual(calls, [12])
+    self.assertEqual(node.exitcode, 0)
+
+  def testTimeBudget(self):
+    def Run():
+      rounds = []
+      results, lives = mini_ruthen.RunPopulationRounds(self.default_strategy, person.FEMALE, True, True, False, batches=2, seed="budget",
+                                                       time_budget=0.5, progress=lambda results, lives: rounds.append(lives))
+      return results, lives, rounds
+    for _ in range(2):
+      results, lives, rounds = Run()
+      # Lives run in whole rounds, the first a life per batch, each round
+      # sized from the time left
+      self.assertGreater(len(rounds), 1)
+      self.assertEqual(rounds[0], 2)
+      self.assertEqual(rounds[-1], lives)
+      self.assertEqual(rounds, sorted(set(rounds)))
+      self.assertEqual(sum(batch.fraction_persons_ruined.n for batch in results), lives)
+      # With a seed, the lives are those of a run of that number, however
+      # many rounds ran them
+      expected = mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, lives, True, True, False, batches=2, seed="budget")
+      self.assertSameLives(mini_ruthen.MergeBatches(expected), mini_ruthen.MergeBatches(results))
+
+  def testRunChunksInterrupted(self):
+    interrupt = multiprocessing.Event()
+    started = []
+    def Start(i, done):
+      started.append(i)
+      if i == 2:
+        interrupt.set()
+      done(i, i * 10)
+    self.assertEqual(mini_ruthen._RunChunks(Start, 6, 1, interrupt), [0, 10, 20])
+    self.assertEqual(started, [0, 1, 2])
+
+  def testInterrupted(self):
+    interrupt = multiprocessing.Event()
+    # One thread runs the chunks, with two handed out at a time, so that of
+    # life 1 has been handed out when the first sets interrupt
+    with InterruptAt(interrupt, 0), self.assertRaises(mini_ruthen.Interrupted) as raised:
+      mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, 12, False, True, True, batches=2, seed="interrupted",
+                                       backend=mini_ruthen.THREADS, workers=1, chunk_size=1, interrupt=interrupt)
+    self.assertEqual(raised.exception.lives, 2)
+    self.assertEqual(len(raised.exception.results), 2)
+    expected = mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, 2, False, True, False, batches=2, seed="interrupted")
+    self.assertSameLives(mini_ruthen.MergeBatches(expected), mini_ruthen.MergeBatches(raised.exception.results))
+
+
+class ShardTest(unittest.TestCase):
+
+  def setUp(self):
+    self.default_strategy = person.Strategy(
+        planned_retirement_age=65,
+        savings_threshold=0,
+        savings_rate=0.1,
+        savings_rrsp_fraction=0.1,
+        savings_tfsa_fraction=0.2,
+        working_period_drawdown_tfsa_fraction=0.5,
+        working_period_drawdown_nonreg_fraction=0.5,
+        oas_bridging_fraction=1.0,
+        drawdown_ced_fraction=0.8,
+        initial_cd_fraction=0.04,
+        drawdown_preferred_rrsp_fraction=0.35,
+        drawdown_preferred_tfsa_fraction=0.5,
+        )
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+
+  def Snapshot(self, n, shard, shards):
+    """Runs a shard of n lives as the run command does, and returns what
+    reading its snapshot file gives."""
+    first_life = n * shard // shards
+    lives = n * (shard + 1) // shards - first_life
+    batches = mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, lives, False, True, False, batches=2, first_life=first_life, seed="shards")
+    filename = os.path.join(self.directory.name, "%d.snapshot" % shard)
+    utils.WriteSnapshot(filename, batches, {
+        "number": n, "shard": [shard, shards], "first_life": first_life, "lives": lives, "batches": 2, "seed": "shards",
+        "gender": person.FEMALE, "real_values": True, "strategy": self.default_strategy._asdict()})
+    return utils.ReadSnapshot(filename)
+
+  def testParseShard(self):
+    self.assertEqual(mini_ruthen.ParseShard("0/1"), (0, 1))
+    self.assertEqual(mini_ruthen.ParseShard("2/3"), (2, 3))
+    for shard in ("1", "a/b", "1/2/3", "2/2", "-1/2", "0/0", "1.5/2"):
+      with self.assertRaises(argparse.ArgumentTypeError):
+        mini_ruthen.ParseShard(shard)
+
+  def testMergeSnapshots(self):
+    metadata, batches = mini_ruthen.MergeSnapshots([self.Snapshot(10, 1, 2), self.Snapshot(10, 0, 2)])
+    self.assertEqual(metadata["lives"], 10)
+    self.assertEqual(len(batches), 2)
+    unsharded = mini_ruthen.MergeBatches(mini_ruthen.RunPopulationBatches(self.default_strategy, person.FEMALE, 10, False, True, False, batches=2, seed="shards"))
+    merged = mini_ruthen.MergeBatches(batches)
+    self.assertEqual(merged.fraction_persons_ruined.n, 10)
+    # Only means and variances merge the same whatever the order; quantile
+    # sketches don't
+    for component in mini_ruthen.FITNESS_COMPONENTS:
+      if component.statistic in (mini_ruthen.MEAN, mini_ruthen.STDDEV):
+        expected = mini_ruthen.ComponentValue(unsharded, component)[0]
+        self.assertAlmostEqual(mini_ruthen.ComponentValue(merged, component)[0], expected, delta=1e-9 * abs(expected), msg=component.name)
+
+  def testMergeSnapshotsFromDifferentRuns(self):
+    snapshot = self.Snapshot(10, 0, 2)
+    with self.assertRaises(ValueError):
+      mini_ruthen.MergeSnapshots([snapshot, snapshot])
+    metadata, batches = self.Snapshot(10, 1, 2)
+    with self.assertRaises(ValueError):
+      mini_ruthen.MergeSnapshots([snapshot, (dict(metadata, seed="other"), batches)])
+
+
+class LibraryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.default_strategy = person.Strategy(
+        planned_retirement_age=65,
+        savings_threshold=0,
+        savings_rate=0.1,
+        savings_rrsp_fraction=0.1,
+        savings_tfsa_fraction=0.2,
+        working_period_drawdown_tfsa_fraction=0.5,
+        working_period_drawdown_nonreg_fraction=0.5,
+        oas_bridging_fraction=1.0,
+        drawdown_ced_fraction=0.8,
+        initial_cd_fraction=0.04,
+        drawdown_preferred_rrsp_fraction=0.35,
+        drawdown_preferred_tfsa_fraction=0.5,
+        )
+
+  def Simulate(self, n=6, use_multiprocessing=False, **kwargs):
+    return mini_ruthen.Simulate(self.default_strategy, n, weights={"ConsumptionAvgLifetime": 1, "FractionPersonsRuined": -1000},
+                                batches=2, seed="library", use_multiprocessing=use_multiprocessing, **kwargs)
+
+  def testSimulateSparseWeights(self):
+    results = self.Simulate(tables=("strategy", "fitness"))
+    self.assertEqual(results.lives, 6)
+    self.assertEqual(results.weights["ConsumptionAvgLifetime"], 1)
+    self.assertEqual(results.weights["ConsumptionAvgWorking"], 0)
+    self.assertEqual(len(results.batch_accumulators), 2)
+    self.assertFalse(hasattr(results.accumulators, "working_consumption_summary"))
+
+  def testSimulateUnknownWeight(self):
+    with self.assertRaises(ValueError):
+      mini_ruthen.Simulate(self.default_strategy, 2, weights={"NotAComponent": 1}, use_multiprocessing=False)
+
+  def testResults(self):
+    results = self.Simulate(tables=("strategy", "fitness"))
+    accumulators = results.accumulators
+    self.assertEqual(accumulators.lifetime_consumption_summary.n, sum(batch.lifetime_consumption_summary.n for batch in results.batch_accumulators))
+    self.assertAlmostEqual(results.Fitness(), accumulators.lifetime_consumption_summary.mean - 1000 * accumulators.fraction_persons_ruined.mean)
+
+    rows = results.FitnessRows()
+    self.assertEqual(len(rows), len(mini_ruthen.FITNESS_COMPONENTS) + 1)
+    self.assertEqual(rows[-1].component, mini_ruthen.TOTAL)
+    self.assertAlmostEqual(rows[-1].contribution, results.Fitness())
+    self.assertIsNotNone(rows[-1].ci_low)
+
+    self.assertEqual(list(results.Tables()), ["strategy", "fitness"])
+    self.assertEqual(list(results.Tables(["fitness"])), ["fitness"])
+    with self.assertRaises(ValueError):
+      results.Tables(["age"])
+    out = io.StringIO()
+    results.Write(out, ["strategy"])
+    self.assertIn("Planned Retirement Age", out.getvalue())
+
+  def testResultsSeeded(self):
+    self.assertEqual(self.Simulate(tables=("fitness",)).Fitness(), self.Simulate(tables=("fitness",)).Fitness())
+
+  def testOptimize(self):
+    def Optimize():
+      return mini_ruthen.Optimize({"ConsumptionAvgLifetime": 1}, n=4, population_size=4, max_generations=2, seed="optimize", use_multiprocessing=False)
+    result = Optimize()
+    self.assertEqual(len(result.generations), 3)
+    self.assertEqual(result.fitness, max(row.best_fitness for row in result.generations))
+    self.assertIsNone(result.ci_low)
+    self.assertEqual(mini_ruthen.ValidateStrategy(result.strategy), result.strategy)
+    self.assertEqual(Optimize(), result)
+
+  def testInterrupted(self):
+    # Rounds of 4 lives, as for --report_every, with the second interrupted
+    # after its first two lives
+    interrupt = multiprocessing.Event()
+    rounds = []
+    with InterruptAt(interrupt, 4):
+      results = self.Simulate(12, tables=("fitness",), use_multiprocessing=True, backend=mini_ruthen.THREADS, workers=1, chunk_size=1,
+                              round_size=4, progress=lambda results, lives: rounds.append(lives), interrupt=interrupt)
+    self.assertTrue(results.interrupted)
+    self.assertEqual(rounds, [4, 6])
+    self.assertEqual(results.lives, 6)
+    self.assertEqual(results.accumulators.fraction_persons_ruined.n, 6)
+    expected = self.Simulate(tables=("fitness",))
+    self.assertFalse(expected.interrupted)
+    self.assertAlmostEqual(results.accumulators.lifetime_consumption_summary.mean, expected.accumulators.lifetime_consumption_summary.mean)
+    self.assertAlmostEqual(results.Fitness(), expected.Fitness())
+
+
+class StderrTargetsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.weights = mini_ruthen.Weights({"ConsumptionAvgLifetime": 1, "FractionPersonsRuined": -1000})
+
+  def Batches(self, consumptions, lives_per_batch=10):
+    """Returns accumulators for batches of lives, all consuming the same in
+    each batch and none ruined."""
+    batches = []
+    for consumption in consumptions:
+      batch = utils.AccumulatorBundle(schema=mini_ruthen.SubscribedSchema(self.weights, ()))
+      for _ in range(lives_per_batch):
+        batch.lifetime_consumption_summary.UpdateOneValue(consumption)
+        batch.fraction_persons_ruined.UpdateOneValue(0)
+      batches.append(batch)
+    return batches
+
+  def testParse(self):
+    self.assertEqual(mini_ruthen.ParseStderrTargets("100,FractionPersonsRuined=0.5%"),
+                     [mini_ruthen.StderrTarget(mini_ruthen.TOTAL, 100, False),
+                      mini_ruthen.StderrTarget("FractionPersonsRuined", 0.005, True)])
+    self.assertEqual(mini_ruthen.ParseStderrTargets("%s=2%%" % mini_ruthen.TOTAL), [mini_ruthen.StderrTarget(mini_ruthen.TOTAL, 0.02, True)])
+    for targets in ("NotAComponent=1", "abc", "1%%", "0", "-1", "nan"):
+      with self.assertRaises(argparse.ArgumentTypeError):
+        mini_ruthen.ParseStderrTargets(targets)
+
+  def testAbsoluteTarget(self):
+    # Batch means 9000 and 11000 have a standard error of 1000
+    batches = self.Batches([9000, 11000])
+    self.assertEqual(mini_ruthen.LivesForStderrTargets(batches, self.weights, [mini_ruthen.StderrTarget(mini_ruthen.TOTAL, 500, False)], 20), 80)
+    self.assertEqual(mini_ruthen.LivesForStderrTargets(batches, self.weights, [mini_ruthen.StderrTarget(mini_ruthen.TOTAL, 2000, False)], 20), 20)
+
+  def testRelativeTarget(self):
+    batches = self.Batches([9000, 11000])
+    # 5% of the mean of 10000 is 500
+    self.assertEqual(mini_ruthen.LivesForStderrTargets(batches, self.weights, [mini_ruthen.StderrTarget(mini_ruthen.TOTAL, 0.05, True)], 20), 80)
+
+  def testNamedComponent(self):
+    weights = dict(self.weights, ConsumptionAvgLifetime=2)
+    batches = self.Batches([9000, 11000])
+    # The fitness function value's standard error is twice the component's
+    total = [mini_ruthen.StderrTarget(mini_ruthen.TOTAL, 1000, False)]
+    component = [mini_ruthen.StderrTarget("ConsumptionAvgLifetime", 1000, False)]
+    self.assertEqual(mini_ruthen.LivesForStderrTargets(batches, weights, total, 20), 80)
+    self.assertEqual(mini_ruthen.LivesForStderrTargets(batches, weights, component, 20), 20)
+    self.assertEqual(mini_ruthen.LivesForStderrTargets(batches, weights, total + component, 20), 80)
+
+  def testZeroVariance(self):
+    targets = [mini_ruthen.StderrTarget("FractionPersonsRuined", 0.01, False)]
+    # No spread over a few lives per batch isn't enough to stop on
+    batches = self.Batches([10000, 11000], lives_per_batch=1)
+    self.assertEqual(mini_ruthen.LivesForStderrTargets(batches, self.weights, targets, 2), 2 * mini_ruthen.MIN_LIVES_PER_BATCH)
+    batches = self.Batches([10000, 11000], lives_per_batch=mini_ruthen.MIN_LIVES_PER_BATCH)
+    self.assertEqual(mini_ruthen.LivesForStderrTargets(batches, self.weights, targets, 2 * mini_ruthen.MIN_LIVES_PER_BATCH), 2 * mini_ruthen.MIN_LIVES_PER_BATCH)
+
+  def testNaN(self):
+    batches = self.Batches([10000, math.nan])
+    for target in (mini_ruthen.StderrTarget(mini_ruthen.TOTAL, 100, False), mini_ruthen.StderrTarget("ConsumptionAvgLifetime", 0.01, True)):
+      self.assertEqual(mini_ruthen.LivesForStderrTargets(batches, self.weights, [target], 10), math.inf)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -30,26 +30,54 @@ INVOLUNTARILY_RETIRED = 3
 
 class Person(object):
   
-  def __init__(self, strategy, gender=FEMALE, basic_only=False, real_values=True):
+  def __init__(self, strategy, gender=FEMALE, basic_only=False, real_values=True, economy=None, quantile_sketches=None, schema=utils.ACCUMULATOR_SCHEMA, accumulators=None, rng=random, nominal_accumulators=None):
+    """With an AccumulatorBundle in accumulators, the person updates it directly,
+    instead of having a bundle of their own. Otherwise basic_only,
+    quantile_sketches and schema describe the person's own bundle.
+
+    With nominal_accumulators too, a bundle with the same accumulators, the
+    person also updates it with nominal dollar amounts as they go, which
+    saves living the same life again to get them.
+
+    The person's random draws come from rng, a random.Random or the random
+    module itself.
+    """
     self.year = world.BASE_YEAR
     self.age = world.START_AGE
     self.gender = gender
     self.strategy = strategy
     self.cpi = 1  # Ignoring factor of 100 and StatsCan rounding rules here.
     self.cpi_history = []
+    self.wage_index = 1  # Real wage level relative to the base year, which indexes YMPE and other earnings-based amounts
+    self.wage_index_history = []
     self.basic_only=basic_only
     self.real_values=real_values
+    self.rng = rng
+    self.economy = economy  # An economy.ScenarioPath, or None to draw each year at random
     self.employed_last_year = True
     self.retired = False
     # CAUTION: GIS must be the last income in the list.
-    self.incomes = [incomes.Earnings(), incomes.EI(), incomes.CPP(), incomes.OAS(), incomes.GIS()]
+    self.incomes = [incomes.Earnings(rng), incomes.EI(), incomes.CPP(), incomes.OAS(), incomes.GIS()]
     self.funds = {"wp_tfsa": funds.TFSA(), "wp_rrsp": funds.RRSP(), "wp_nonreg": funds.NonRegistered()}
-    self.involuntary_retirement_random = random.random()
+    self.involuntary_retirement_random = self.rng.random()
     self.tfsa_room = world.TFSA_INITIAL_CONTRIBUTION_LIMIT
     self.rrsp_room = world.RRSP_INITIAL_LIMIT
     self.capital_loss_carry_forward = 0
 
-    self.accumulators = utils.AccumulatorBundle()
+    if accumulators is None:
+      accumulators = utils.AccumulatorBundle(basic_only=basic_only, quantile_sketches=quantile_sketches, schema=schema)
+    self.accumulators = accumulators
+    # Only work out the measures for tables if the bundle has accumulators for them
+    self.accumulate_tables = bool(self.accumulators.usages - {utils.FITNESS})
+    # This life's own consumption, which the bundle may be mixing with other lives'
+    self.track_consumption = "retirement_consumption_shortfall" in self.accumulators.measures
+    self.working_consumption = utils.SummaryStatsAccumulator()
+    self.retired_consumption = utils.SummaryStatsAccumulator()
+    # Each bundle to update, whether it holds real values, and the life's own
+    # working and retired consumption in the same dollars
+    self.bundles = [(self.accumulators, self.real_values, self.working_consumption, self.retired_consumption)]
+    if nominal_accumulators is not None:
+      self.bundles.append((nominal_accumulators, False, utils.SummaryStatsAccumulator(), utils.SummaryStatsAccumulator()))
     self.has_been_ruined = False
     self.has_received_gis = False
     self.has_experienced_income_under_lico = False
@@ -88,7 +116,7 @@ class Person(object):
         year_rec.deposits.append(funds.DepositReceipt(withdrawn, funds.FUND_TYPE_RRSP))
         self.rrsp_room -= withdrawn
 
-      self.bridging_withdrawal_table = world.GenerateCEDDrawdownTable(self.age, world.CPP_EXPECTED_RETIREMENT_AGE)
+      self.bridging_withdrawal_table = world.CEDDrawdownTable(self.age, world.CPP_EXPECTED_RETIREMENT_AGE)
 
     # Split each fund into a CED and a CD fund
     self.funds["cd_rrsp"], self.funds["ced_rrsp"] = funds.SplitFund(self.funds["wp_rrsp"], funds.RRSP(), self.strategy.drawdown_ced_fraction * self.funds["wp_rrsp"].amount)
@@ -104,8 +132,9 @@ class Person(object):
 
     self.assets_at_retirement = sum(fund.amount for fund in self.funds.values()) / year_rec.cpi
 
-    if not self.basic_only:
-      self.accumulators.fraction_persons_involuntarily_retired.UpdateOneValue(1 if self.age < self.strategy.planned_retirement_age else 0)
+    for accumulators, _, _, _ in self.bundles:
+      accumulators.Update(utils.PHASE_RETIREMENT, {
+          "involuntarily_retired": 1 if self.age < self.strategy.planned_retirement_age else 0})
 
 
   def AnnualSetup(self):
@@ -116,13 +145,23 @@ class Person(object):
     year_rec = utils.YearRecord()
     year_rec.age = self.age
     year_rec.year = self.year
-    year_rec.inflation = random.normalvariate(world.INFLATION_MEAN, world.INFLATION_STDDEV)
+    if self.economy is not None:
+      year_rec.inflation = self.economy.Inflation(self.year - world.BASE_YEAR)
+      year_rec.real_wage_growth = self.economy.RealWageGrowth(self.year - world.BASE_YEAR)
+    else:
+      year_rec.inflation = self.rng.normalvariate(world.INFLATION_MEAN, world.INFLATION_STDDEV)
     if self.year == world.BASE_YEAR:
       self.cpi = 1
     else:
       self.cpi = self.cpi * (1 + year_rec.inflation)
     self.cpi_history.append(self.cpi)
     year_rec.cpi = self.cpi
+    if self.year == world.BASE_YEAR:
+      self.wage_index = 1
+    else:
+      self.wage_index = self.wage_index * (1 + year_rec.real_wage_growth)
+    self.wage_index_history.append(self.wage_index)
+    year_rec.wage_index = self.wage_index
 
 
     # Reap souls
@@ -131,7 +170,7 @@ class Person(object):
     elif self.gender == FEMALE:
       p_mortality = world.FEMALE_MORTALITY[self.age] * world.MORTALITY_MULTIPLIER
 
-    if random.random() < p_mortality:
+    if self.rng.random() < p_mortality:
       year_rec.is_dead = True
       return year_rec
     else:
@@ -147,10 +186,13 @@ class Person(object):
     year_rec.is_retired = self.retired
 
     # Employment
-    year_rec.is_employed = not self.retired and random.random() > world.UNEMPLOYMENT_PROBABILITY
+    year_rec.is_employed = not self.retired and self.rng.random() > world.UNEMPLOYMENT_PROBABILITY
 
     # Growth
-    year_rec.growth_rate = random.normalvariate(world.MEAN_INVESTMENT_RETURN, world.STD_INVESTMENT_RETURN)
+    if self.economy is not None:
+      year_rec.growth_rate = self.economy.InvestmentReturn(self.year - world.BASE_YEAR)
+    else:
+      year_rec.growth_rate = self.rng.normalvariate(world.MEAN_INVESTMENT_RETURN, world.STD_INVESTMENT_RETURN)
 
     # Fund room
     self.tfsa_room += world.TFSA_ANNUAL_CONTRIBUTION_LIMIT * self.cpi
@@ -164,11 +206,11 @@ class Person(object):
     # CPP employee contribution
     earnings = sum(receipt.amount for receipt in year_rec.incomes
                    if receipt.income_type == incomes.INCOME_TYPE_EARNINGS)
-    year_rec.pensionable_earnings = max(0, min(utils.Indexed(world.YMPE, year_rec.year, 1 + world.PARGE) * year_rec.cpi, earnings) - world.YBE)
+    year_rec.pensionable_earnings = max(0, min(world.YMPE * year_rec.wage_index * year_rec.cpi, earnings) - world.YBE)
     year_rec.cpp_contribution = year_rec.pensionable_earnings * world.CPP_EMPLOYEE_RATE
 
     # EI premium
-    year_rec.insurable_earnings = min(earnings, utils.Indexed(world.EI_MAX_INSURABLE_EARNINGS, year_rec.year, 1 + world.PARGE) * year_rec.cpi)
+    year_rec.insurable_earnings = min(earnings, world.EI_MAX_INSURABLE_EARNINGS * year_rec.wage_index * year_rec.cpi)
     year_rec.ei_premium = year_rec.insurable_earnings * world.EI_PREMIUM_RATE
 
     return year_rec
@@ -200,7 +242,7 @@ class Person(object):
     # Employment Insurance Social Benefits Repayment
     ei_benefits = sum(receipt.amount for receipt in year_rec.incomes
                      if receipt.income_type == incomes.INCOME_TYPE_EI)
-    ei_base_amount = utils.Indexed(world.EI_MAX_INSURABLE_EARNINGS, year_rec.year, 1 + world.PARGE) * world.EI_REPAYMENT_BASE_FRACTION * year_rec.cpi
+    ei_base_amount = world.EI_MAX_INSURABLE_EARNINGS * year_rec.wage_index * world.EI_REPAYMENT_BASE_FRACTION * year_rec.cpi
     ei_benefit_repayment = min(max(0, net_income_before_adjustments - ei_base_amount), ei_benefits) * world.EI_REPAYMENT_REDUCTION_RATE
 
     # Old Age Security and Net Federal Supplements Repayment
@@ -293,7 +335,7 @@ class Person(object):
     earnings = sum(receipt.amount for receipt in year_rec.incomes
                    if receipt.income_type == incomes.INCOME_TYPE_EARNINGS)
     self.rrsp_room += min(earnings * world.RRSP_ACCRUAL_FRACTION,
-                          utils.Indexed(world.RRSP_LIMIT, year_rec.year, 1 + world.PARGE) * year_rec.cpi)
+                          world.RRSP_LIMIT * year_rec.wage_index * year_rec.cpi)
     year_rec.rrsp_room = self.rrsp_room
 
     # Do withdrawals
@@ -322,7 +364,7 @@ class Person(object):
       year_rec.ced_drawdown_amount = withdrawn
       self.total_retirement_withdrawals += withdrawn / year_rec.cpi
     else:
-      target_cash = utils.Indexed(world.YMPE, year_rec.year, 1 + world.PARGE) * year_rec.cpi * self.strategy.savings_threshold * world.EARNINGS_YMPE_FRACTION
+      target_cash = world.YMPE * year_rec.wage_index * year_rec.cpi * self.strategy.savings_threshold * world.EARNINGS_YMPE_FRACTION
       if cash < target_cash:
         # Attempt to withdraw difference from savings
         amount_to_withdraw = target_cash - cash
@@ -388,9 +430,7 @@ class Person(object):
     """End of year calculations for a live person"""
     period = self.Period(year_rec)
     self.period_years[period] += 1
-    cpi = year_rec.cpi if self.real_values else 1
 
-    self.accumulators.UpdateConsumption(year_rec.consumption/cpi, self.year, self.retired, period)
     earnings = sum(receipt.amount for receipt in year_rec.incomes
                    if receipt.income_type == incomes.INCOME_TYPE_EARNINGS)
     cpp = sum(receipt.amount for receipt in year_rec.incomes
@@ -417,120 +457,98 @@ class Person(object):
     nonreg_deposits = sum(receipt.amount for receipt in year_rec.deposits
                           if receipt.fund_type == funds.FUND_TYPE_NONREG)
     savings = rrsp_deposits + tfsa_deposits + nonreg_deposits
-    ympe = utils.Indexed(world.YMPE, year_rec.year, 1 + world.PARGE)
+    ympe = world.YMPE * year_rec.wage_index
 
     if gross_income < world.LICO_SINGLE_CITY_WP * year_rec.cpi:
       self.gross_income_below_lico_years += 1
+      if self.retired:
+        self.has_experienced_income_under_lico = True
 
     if assets <= 0:
       self.no_assets_years += 1
+      if self.retired:
+        self.has_been_ruined = True
 
-    if self.age >= world.MINIMUM_RETIREMENT_AGE and not self.retired:
-      self.accumulators.earnings_late_working_summary.UpdateOneValue(earnings/cpi)
-    self.accumulators.lifetime_withdrawals_less_savings.UpdateOneValue((total_withdrawals-savings)/cpi)
-
-    if self.retired:
-      self.accumulators.lico_gap_retired.UpdateOneValue(max(0, world.LICO_SINGLE_CITY_WP*year_rec.cpi-gross_income)/cpi)
-      if assets <= 0:
-        self.has_been_ruined=True
-        self.accumulators.fraction_retirement_years_ruined.UpdateOneValue(1)
-      else:
-        self.accumulators.fraction_retirement_years_ruined.UpdateOneValue(0)
-      self.accumulators.fraction_retirement_years_below_ympe.UpdateOneValue(1 if assets < ympe else 0)
-      self.accumulators.fraction_retirement_years_below_twice_ympe.UpdateOneValue(1 if assets < 2*ympe else 0)
-      if gross_income < world.LICO_SINGLE_CITY_WP * year_rec.cpi:
-        self.has_experienced_income_under_lico = True
-        self.accumulators.fraction_retirement_years_below_lico.UpdateOneValue(1)
-      else:
-        self.accumulators.fraction_retirement_years_below_lico.UpdateOneValue(0)
-      self.accumulators.retirement_taxes.UpdateOneValue(year_rec.taxes_payable/cpi)
-      if cpp > 0:
-        self.accumulators.positive_cpp_benefits.UpdateOneValue(cpp/cpi)
-    else: # Working period
-      self.accumulators.lico_gap_working.UpdateOneValue(max(0, world.LICO_SINGLE_CITY_WP*year_rec.cpi-gross_income)/cpi)
-      self.accumulators.earnings_working.UpdateOneValue(earnings/cpi)
-      self.accumulators.working_annual_ei_cpp_deductions.UpdateOneValue(
-          (year_rec.cpp_contribution + year_rec.ei_premium)/cpi)
-      self.accumulators.working_taxes.UpdateOneValue(year_rec.taxes_payable/cpi)
+    if not self.retired:
       if earnings > 0:
         self.positive_earnings_years += 1
-        self.accumulators.fraction_earnings_saved.UpdateOneValue(savings/earnings)
       if ei_benefits > 0:
         self.ei_years += 1
-        self.accumulators.positive_ei_benefits.UpdateOneValue(ei_benefits/cpi)
-
-    if self.age >= world.MAXIMUM_RETIREMENT_AGE:
-      if gis > 0:
-        self.gis_years += 1
-        self.has_received_gis = True
-        self.accumulators.fraction_retirement_years_receiving_gis.UpdateOneValue(1)
-        self.accumulators.positive_gis_benefits.UpdateOneValue(gis/cpi)
-      else:
-        self.accumulators.fraction_retirement_years_receiving_gis.UpdateOneValue(0)
-      self.accumulators.benefits_gis.UpdateOneValue(gis/cpi)
 
-    if not self.basic_only:
+    if self.age >= world.MAXIMUM_RETIREMENT_AGE and gis > 0:
+      self.gis_years += 1
+      self.has_received_gis = True
+
+    if self.accumulate_tables:
       self.net_government_revenue += (year_rec.taxes_payable + year_rec.sales_taxes - gis - oas) / year_rec.cpi
 
-      self.accumulators.period_earnings.UpdateOneValue(earnings/cpi, period)
-      self.accumulators.period_cpp_benefits.UpdateOneValue(cpp/cpi, period)
-      self.accumulators.period_oas_benefits.UpdateOneValue(oas/cpi, period)
-      self.accumulators.period_taxable_gains.UpdateOneValue(year_rec.taxable_capital_gains/cpi, period)
-      self.accumulators.period_gis_benefits.UpdateOneValue(gis/cpi, period)
-      self.accumulators.period_social_benefits_repaid.UpdateOneValue(year_rec.total_social_benefit_repayment/cpi, period)
-      self.accumulators.period_rrsp_withdrawals.UpdateOneValue(rrsp_withdrawals/cpi, period)
-      self.accumulators.period_tfsa_withdrawals.UpdateOneValue(tfsa_withdrawals/cpi, period)
-      self.accumulators.period_nonreg_withdrawals.UpdateOneValue(nonreg_withdrawals/cpi, period)
-      self.accumulators.period_cpp_contributions.UpdateOneValue(year_rec.cpp_contribution/cpi, period)
-      self.accumulators.period_ei_premiums.UpdateOneValue(year_rec.ei_premium/cpi, period)
-      self.accumulators.period_taxable_income.UpdateOneValue(year_rec.taxable_income/cpi, period)
-      self.accumulators.period_income_tax.UpdateOneValue(year_rec.taxes_payable/cpi, period)
-      self.accumulators.period_sales_tax.UpdateOneValue(year_rec.sales_taxes/cpi, period)
-      self.accumulators.period_rrsp_savings.UpdateOneValue(rrsp_deposits/cpi, period)
-      self.accumulators.period_tfsa_savings.UpdateOneValue(tfsa_deposits/cpi, period)
-      self.accumulators.period_nonreg_savings.UpdateOneValue(nonreg_deposits/cpi, period)
-      self.accumulators.period_fund_growth.UpdateOneValue(
-          sum(rec.growth_amount for rec in year_rec.growth_records) / cpi, period)
-
-      self.accumulators.persons_alive_by_age.UpdateOneValue(1, self.age)
-      self.accumulators.gross_earnings_by_age.UpdateOneValue(earnings/cpi, self.age)
-      self.accumulators.income_tax_by_age.UpdateOneValue(year_rec.taxes_payable/cpi, self.age)
-      self.accumulators.sales_tax_by_age.UpdateOneValue(year_rec.sales_taxes/cpi, self.age)
-      self.accumulators.ei_premium_by_age.UpdateOneValue(year_rec.ei_premium/cpi, self.age)
-      self.accumulators.cpp_contributions_by_age.UpdateOneValue(year_rec.cpp_contribution/cpi, self.age)
-      self.accumulators.ei_benefits_by_age.UpdateOneValue(ei_benefits/cpi, self.age)
-      self.accumulators.cpp_benefits_by_age.UpdateOneValue(cpp/cpi, self.age)
-      self.accumulators.oas_benefits_by_age.UpdateOneValue(oas/cpi, self.age)
-      self.accumulators.gis_benefits_by_age.UpdateOneValue(gis/cpi, self.age)
-      self.accumulators.savings_by_age.UpdateOneValue(savings/cpi, self.age)
-      self.accumulators.rrsp_withdrawals_by_age.UpdateOneValue(rrsp_withdrawals/cpi, self.age)
-      self.accumulators.tfsa_withdrawals_by_age.UpdateOneValue(tfsa_withdrawals/cpi, self.age)
-      self.accumulators.nonreg_withdrawals_by_age.UpdateOneValue(nonreg_withdrawals/cpi, self.age)
-      self.accumulators.rrsp_assets_by_age.UpdateOneValue(
-          sum(fund.amount for fund in self.funds.values() if fund.fund_type == funds.FUND_TYPE_RRSP)/cpi, self.age)
-      self.accumulators.bridging_assets_by_age.UpdateOneValue(
-          sum(fund.amount for fund in self.funds.values() if fund.fund_type == funds.FUND_TYPE_BRIDGING)/cpi, self.age)
-      self.accumulators.tfsa_assets_by_age.UpdateOneValue(
-          sum(fund.amount for fund in self.funds.values() if fund.fund_type == funds.FUND_TYPE_TFSA)/cpi, self.age)
-      self.accumulators.nonreg_assets_by_age.UpdateOneValue(
-          sum(fund.amount for fund in self.funds.values() if fund.fund_type == funds.FUND_TYPE_NONREG)/cpi, self.age)
-      if self.retired:
-        self.accumulators.cd_withdrawals_by_age.UpdateOneValue(year_rec.cd_drawdown_amount/cpi, self.age)
-        self.accumulators.ced_withdrawals_by_age.UpdateOneValue(year_rec.ced_drawdown_amount/cpi, self.age)
-        self.accumulators.cd_requested_by_age.UpdateOneValue(year_rec.cd_drawdown_request/cpi, self.age)
-        self.accumulators.ced_requested_by_age.UpdateOneValue(year_rec.ced_drawdown_request/cpi, self.age)
-    
-        self.accumulators.rrsp_ced_assets_by_age.UpdateOneValue(self.funds["ced_rrsp"].amount/cpi, self.age)
-        self.accumulators.tfsa_ced_assets_by_age.UpdateOneValue(self.funds["ced_tfsa"].amount/cpi, self.age)
-        self.accumulators.nonreg_ced_assets_by_age.UpdateOneValue(self.funds["ced_nonreg"].amount/cpi, self.age)
-        self.accumulators.rrsp_cd_assets_by_age.UpdateOneValue(self.funds["cd_rrsp"].amount/cpi, self.age)
-        self.accumulators.tfsa_cd_assets_by_age.UpdateOneValue(self.funds["cd_tfsa"].amount/cpi, self.age)
-        self.accumulators.nonreg_cd_assets_by_age.UpdateOneValue(self.funds["cd_nonreg"].amount/cpi, self.age)
-
-        self.accumulators.ced_ruined_by_age.UpdateOneValue(
-            1 if sum(fund.amount for name, fund in self.funds.items() if name.startswith("ced")) == 0 else 0, self.age)
-        self.accumulators.cd_ruined_by_age.UpdateOneValue(
-            1 if sum(fund.amount for name, fund in self.funds.items() if name.startswith("cd")) == 0 else 0, self.age)
+    for accumulators, real_values, working_consumption, retired_consumption in self.bundles:
+      cpi = year_rec.cpi if real_values else 1
+      measures = utils.ConsumptionMeasures(year_rec.consumption/cpi, self.year, self.retired, period)
+      if self.track_consumption:
+        if self.retired:
+          retired_consumption.UpdateOneValue(measures["consumption"])
+        else:
+          working_consumption.UpdateOneValue(measures["consumption"])
+      measures.update(
+          late_working=self.age >= world.MINIMUM_RETIREMENT_AGE and not self.retired,
+          past_maximum_retirement_age=self.age >= world.MAXIMUM_RETIREMENT_AGE,
+          earnings=earnings/cpi,
+          receiving_earnings=earnings > 0,
+          cpp=cpp/cpi,
+          receiving_cpp=cpp > 0,
+          ei_benefits=ei_benefits/cpi,
+          receiving_ei=ei_benefits > 0,
+          gis=gis/cpi,
+          receiving_gis=1 if gis > 0 else 0,
+          withdrawals_less_savings=(total_withdrawals-savings)/cpi,
+          lico_gap=max(0, world.LICO_SINGLE_CITY_WP*year_rec.cpi-gross_income)/cpi,
+          ruined=1 if assets <= 0 else 0,
+          below_ympe=1 if assets < ympe else 0,
+          below_twice_ympe=1 if assets < 2*ympe else 0,
+          below_lico=1 if gross_income < world.LICO_SINGLE_CITY_WP * year_rec.cpi else 0,
+          taxes=year_rec.taxes_payable/cpi,
+          ei_cpp_deductions=(year_rec.cpp_contribution + year_rec.ei_premium)/cpi,
+          fraction_earnings_saved=savings/earnings if earnings > 0 else 0)
+
+      if self.accumulate_tables:
+        measures.update(
+            alive=1,
+            oas=oas/cpi,
+            taxable_capital_gains=year_rec.taxable_capital_gains/cpi,
+            social_benefits_repaid=year_rec.total_social_benefit_repayment/cpi,
+            rrsp_withdrawals=rrsp_withdrawals/cpi,
+            tfsa_withdrawals=tfsa_withdrawals/cpi,
+            nonreg_withdrawals=nonreg_withdrawals/cpi,
+            cpp_contribution=year_rec.cpp_contribution/cpi,
+            ei_premium=year_rec.ei_premium/cpi,
+            taxable_income=year_rec.taxable_income/cpi,
+            sales_taxes=year_rec.sales_taxes/cpi,
+            rrsp_deposits=rrsp_deposits/cpi,
+            tfsa_deposits=tfsa_deposits/cpi,
+            nonreg_deposits=nonreg_deposits/cpi,
+            savings=savings/cpi,
+            fund_growth=sum(rec.growth_amount for rec in year_rec.growth_records) / cpi,
+            rrsp_assets=sum(fund.amount for fund in self.funds.values() if fund.fund_type == funds.FUND_TYPE_RRSP)/cpi,
+            bridging_assets=sum(fund.amount for fund in self.funds.values() if fund.fund_type == funds.FUND_TYPE_BRIDGING)/cpi,
+            tfsa_assets=sum(fund.amount for fund in self.funds.values() if fund.fund_type == funds.FUND_TYPE_TFSA)/cpi,
+            nonreg_assets=sum(fund.amount for fund in self.funds.values() if fund.fund_type == funds.FUND_TYPE_NONREG)/cpi)
+        if self.retired:
+          measures.update(
+              cd_drawdown_amount=year_rec.cd_drawdown_amount/cpi,
+              ced_drawdown_amount=year_rec.ced_drawdown_amount/cpi,
+              cd_drawdown_request=year_rec.cd_drawdown_request/cpi,
+              ced_drawdown_request=year_rec.ced_drawdown_request/cpi,
+              rrsp_ced_assets=self.funds["ced_rrsp"].amount/cpi,
+              tfsa_ced_assets=self.funds["ced_tfsa"].amount/cpi,
+              nonreg_ced_assets=self.funds["ced_nonreg"].amount/cpi,
+              rrsp_cd_assets=self.funds["cd_rrsp"].amount/cpi,
+              tfsa_cd_assets=self.funds["cd_tfsa"].amount/cpi,
+              nonreg_cd_assets=self.funds["cd_nonreg"].amount/cpi,
+              ced_ruined=1 if sum(fund.amount for name, fund in self.funds.items() if name.startswith("ced")) == 0 else 0,
+              cd_ruined=1 if sum(fund.amount for name, fund in self.funds.items() if name.startswith("cd")) == 0 else 0)
+
+      accumulators.Update(utils.PHASE_YEAR, measures)
 
     self.age += 1
     self.year += 1
@@ -538,45 +556,47 @@ class Person(object):
 
   def EndOfLifeCalcs(self, year_rec):
     """Calculations that happen upon death"""
-    cpi = year_rec.cpi if self.real_values else 1
     if self.retired:
       asset_comparison_level = self.assets_at_retirement
     else:
       asset_comparison_level = sum(fund.amount for fund in self.funds.values()) / year_rec.cpi
     estate = self.CalcEndOfLifeEstate(year_rec)
-    self.accumulators.distributable_estate.UpdateOneValue(estate/cpi)
-    self.accumulators.fraction_persons_ruined.UpdateOneValue(1 if self.has_been_ruined else 0)
-    self.accumulators.fraction_retirees_receiving_gis.UpdateOneValue(1 if self.has_received_gis else 0)
-    self.accumulators.fraction_retirees_ever_below_lico.UpdateOneValue(1 if self.has_experienced_income_under_lico else 0)
-
-    self.accumulators.fraction_persons_with_withdrawals_below_retirement_assets.UpdateOneValue(
-        1 if self.total_retirement_withdrawals < asset_comparison_level else 0)
-    if self.retired:
-      self.accumulators.fraction_retirees_with_withdrawals_below_retirement_assets.UpdateOneValue(
-          1 if self.total_retirement_withdrawals < asset_comparison_level else 0)
-    self.accumulators.retirement_consumption_less_working_consumption.UpdateOneValue(
-        min(0, self.accumulators.retired_consumption_summary.mean - world.FRACTION_WORKING_CONSUMPTION*self.accumulators.working_consumption_summary.mean))
-
-    if not self.basic_only:
+    if self.accumulate_tables:
       self.net_government_revenue += year_rec.estate_taxes / year_rec.cpi
 
-      self.accumulators.age_at_death.UpdateOneValue(self.age)
-      self.accumulators.years_worked_with_earnings.UpdateOneValue(self.positive_earnings_years)
-      self.accumulators.fraction_persons_dying_before_retiring.UpdateOneValue(0 if self.retired else 1)
-      self.accumulators.positive_savings_years.UpdateOneValue(self.positive_savings_years)
-      self.accumulators.years_receiving_ei.UpdateOneValue(self.ei_years)
-      self.accumulators.years_receiving_gis.UpdateOneValue(self.gis_years)
-      self.accumulators.years_income_below_lico.UpdateOneValue(self.gross_income_below_lico_years)
-      self.accumulators.years_with_no_assets.UpdateOneValue(self.no_assets_years)
-      self.accumulators.net_government_revenue.UpdateOneValue(self.net_government_revenue)
-
-      for period in self.period_years:
-        self.accumulators.period_years.UpdateOneValue(self.period_years[period], period)
-      period = self.Period(year_rec)
-      self.accumulators.period_gross_estate.UpdateOneValue(year_rec.gross_estate/cpi, period)
-      self.accumulators.period_estate_taxes.UpdateOneValue(year_rec.estate_taxes/cpi, period)
-      self.accumulators.period_executor_funeral_costs.UpdateOneValue(year_rec.funeral_and_executor_fee/cpi, period)
-      self.accumulators.period_distributable_estate.UpdateOneValue(estate/cpi, period)
+    for accumulators, real_values, working_consumption, retired_consumption in self.bundles:
+      cpi = year_rec.cpi if real_values else 1
+      measures = {
+          "retired": self.retired,
+          "estate": estate/cpi,
+          "has_been_ruined": 1 if self.has_been_ruined else 0,
+          "has_received_gis": 1 if self.has_received_gis else 0,
+          "has_experienced_income_under_lico": 1 if self.has_experienced_income_under_lico else 0,
+          "withdrawals_below_retirement_assets": 1 if self.total_retirement_withdrawals < asset_comparison_level else 0,
+      }
+      if self.track_consumption:
+        measures["retirement_consumption_shortfall"] = min(0, retired_consumption.mean - world.FRACTION_WORKING_CONSUMPTION*working_consumption.mean)
+
+      if self.accumulate_tables:
+        if hasattr(accumulators, "period_years"):
+          for period in self.period_years:
+            accumulators.period_years.UpdateOneValue(self.period_years[period], period)
+        measures.update(
+            age=self.age,
+            period=self.Period(year_rec),
+            positive_earnings_years=self.positive_earnings_years,
+            died_before_retiring=0 if self.retired else 1,
+            positive_savings_years=self.positive_savings_years,
+            ei_years=self.ei_years,
+            gis_years=self.gis_years,
+            gross_income_below_lico_years=self.gross_income_below_lico_years,
+            no_assets_years=self.no_assets_years,
+            net_government_revenue=self.net_government_revenue,
+            gross_estate=year_rec.gross_estate/cpi,
+            estate_taxes=year_rec.estate_taxes/cpi,
+            funeral_and_executor_fee=year_rec.funeral_and_executor_fee/cpi)
+
+      accumulators.Update(utils.PHASE_DEATH, measures)
 
   def LiveLife(self):
     """Run through one lifetime"""
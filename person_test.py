@@ -1,5 +1,7 @@
+import random
 import unittest
 import unittest.mock
+import economy
 import person
 import incomes
 import funds
@@ -34,6 +36,38 @@ class PersonTest(unittest.TestCase):
          incomes.INCOME_TYPE_OAS,
          incomes.INCOME_TYPE_GIS])
 
+  def testSharedAccumulators(self):
+    accumulators = utils.AccumulatorBundle(basic_only=True)
+    for _ in range(2):
+      j_canuck = person.Person(strategy=self.default_strategy, accumulators=accumulators)
+      self.assertIs(j_canuck.accumulators, accumulators)
+      j_canuck.LiveLife()
+
+    self.assertEqual(accumulators.fraction_persons_ruined.n, 2)
+    self.assertEqual(accumulators.retirement_consumption_less_working_consumption.n, 2)
+    # The shortfall compares each life's own retired and working consumption
+    self.assertLessEqual(accumulators.retirement_consumption_less_working_consumption.mean, 0)
+    self.assertEqual(j_canuck.working_consumption.n + j_canuck.retired_consumption.n, j_canuck.age - world.START_AGE)
+
+  def testRandomSource(self):
+    lives = []
+    for _ in range(2):
+      j_canuck = person.Person(strategy=self.default_strategy, basic_only=True, rng=random.Random(42))
+      j_canuck.LiveLife()
+      lives.append((j_canuck.age, j_canuck.accumulators.lifetime_consumption_summary.mean))
+    self.assertEqual(lives[0], lives[1])
+
+  def testNominalAccumulators(self):
+    real = utils.AccumulatorBundle()
+    nominal = utils.AccumulatorBundle()
+    person.Person(strategy=self.default_strategy, accumulators=real, nominal_accumulators=nominal, rng=random.Random(42)).LiveLife()
+    nominal_only = utils.AccumulatorBundle()
+    person.Person(strategy=self.default_strategy, real_values=False, accumulators=nominal_only, rng=random.Random(42)).LiveLife()
+
+    self.assertEqual(nominal.ToBytes(), nominal_only.ToBytes())
+    self.assertEqual(real.lifetime_consumption_summary.n, nominal.lifetime_consumption_summary.n)
+    self.assertLess(real.lifetime_consumption_summary.mean, nominal.lifetime_consumption_summary.mean)
+
   def testCreatePersonHasFunds(self):
     j_canuck = person.Person(strategy=self.default_strategy)
 
@@ -197,6 +231,32 @@ class PersonTest(unittest.TestCase):
     _ = j_canuck.AnnualSetup()
     self.assertEqual(j_canuck.cpi_history, [1, 1.02])
 
+  @unittest.mock.patch('random.random', return_value=0.5)
+  def testAnnualSetupScenarioPath(self, _):
+    path = economy.ScenarioPath([0.01, 0.04, 0.02, 0.03, 0.06, 0.005])
+    j_canuck = person.Person(strategy=self.default_strategy, economy=path)
+    year_rec = j_canuck.AnnualSetup()
+    self.assertEqual(year_rec.inflation, 0.01)
+    self.assertEqual(year_rec.growth_rate, 0.04)
+    self.assertEqual(year_rec.real_wage_growth, 0.02)
+    j_canuck.year = world.BASE_YEAR + 1
+    year_rec = j_canuck.AnnualSetup()
+    self.assertEqual(year_rec.inflation, 0.03)
+    self.assertEqual(year_rec.growth_rate, 0.06)
+    self.assertEqual(year_rec.real_wage_growth, 0.005)
+    self.assertAlmostEqual(year_rec.cpi, 1.03)
+    self.assertAlmostEqual(year_rec.wage_index, 1.005)
+
+  @unittest.mock.patch('random.normalvariate', return_value=0.02)
+  def testAnnualSetupWageIndex(self, mock_random):
+    j_canuck = person.Person(strategy=self.default_strategy)
+    year_rec = j_canuck.AnnualSetup()
+    self.assertEqual(year_rec.wage_index, 1)
+    j_canuck.year = world.BASE_YEAR + 1
+    year_rec = j_canuck.AnnualSetup()
+    self.assertAlmostEqual(year_rec.wage_index, 1 + world.PARGE)
+    self.assertEqual(j_canuck.wage_index_history, [1, 1 + world.PARGE])
+
   def testAnnualSetupRoomTransfer(self):
     j_canuck = person.Person(strategy=self.default_strategy)
     j_canuck.tfsa_room = 30
@@ -0,0 +1,151 @@
+"""Compares the quantile sketches in utils, and the previous QuantileAccumulator
+implementation which inserted and merged one value at a time, on cost per
+update and merge and on accuracy against exact quantiles.
+
+Accuracy is reported as rank error: the difference between the requested
+quantile and the fraction of values below the estimate, which is what the
+sketches' documented error bounds are stated in."""
+
+import argparse
+import bisect
+import random
+import time
+
+import utils
+
+
+class LegacyQuantileAccumulator(object):
+  """The QuantileAccumulator implementation before batched ingestion."""
+  def __init__(self, max_bins=100):
+    self.max_bins = max_bins
+    self.bins = []
+
+  def _Merge(self):
+    zero_diffs = [(self.bins[i+1][0] - self.bins[i][0], i) for i in range(len(self.bins)-1) if not self.bins[i+1][0] - self.bins[i][0]]
+    for _, i in reversed(zero_diffs):
+      self.bins[i:i+2] = [(self.bins[i][0], self.bins[i][1]+self.bins[i+1][1])]
+
+    diffs = [(self.bins[i+1][0] - self.bins[i][0], i) for i in range(len(self.bins)-1)]
+    removed = []
+    while len(self.bins) > self.max_bins:
+      sep, i = min(diffs)
+      i_adjustment = bisect.bisect_left(removed, i)
+      removed.insert(i_adjustment, i)
+      i -= i_adjustment
+
+      self.bins[i:i+2] = [(
+          (self.bins[i][0]*self.bins[i][1] + self.bins[i+1][0]*self.bins[i+1][1])/(self.bins[i][1]+self.bins[i+1][1]),
+          self.bins[i][1]+self.bins[i+1][1])]
+      if i:
+        diffs[i-1:i+1] = [(self.bins[i][0] - self.bins[i-1][0], diffs[i-1][1])]
+      else:
+        diffs[0:2] = [(self.bins[1][0] - self.bins[0][0], diffs[1][1])]
+
+  def UpdateOneValue(self, value):
+    bisect.insort_left(self.bins, (value, 1))
+    self._Merge()
+
+  def UpdateHistogram(self, bins):
+    self.bins.extend(bins)
+    self.bins.sort()
+    self._Merge()
+
+  def UpdateAccumulator(self, acc):
+    self.UpdateHistogram(acc.bins)
+
+  def Quantile(self, q):
+    bin_counts = [0] + [b[1] for b in self.bins] + [0]
+    cumsums = [0]
+    for i in range(1, len(bin_counts)):
+      bin_count = (bin_counts[i] + bin_counts[i-1])/2
+      cumsums.append(cumsums[-1] + bin_count)
+
+    n_points = q * cumsums[-1]
+    i = bisect.bisect(cumsums, n_points)-1
+
+    if i <= 0:
+      return self.bins[0][0]
+    elif i >= len(self.bins):
+      return self.bins[-1][0]
+    else:
+      bin_frac = (n_points - cumsums[i])/(cumsums[i+1] - cumsums[i])
+      return self.bins[i-1][0] + bin_frac * (self.bins[i][0] - self.bins[i-1][0])
+
+
+QUANTILES = (0.01, 0.1, 0.2, 0.5, 0.9)
+
+
+def ExactQuantile(sorted_values, q):
+  """Linearly interpolated quantile of a sorted list."""
+  position = q * (len(sorted_values) - 1)
+  i = int(position)
+  if i + 1 >= len(sorted_values):
+    return sorted_values[-1]
+  return sorted_values[i] + (position - i) * (sorted_values[i+1] - sorted_values[i])
+
+
+def RankError(sorted_values, q, estimate):
+  """Distance between q and the fraction of values below estimate."""
+  return abs(bisect.bisect_left(sorted_values, estimate) / len(sorted_values) - q)
+
+
+def Benchmark(name, factory, values, merge_group_size):
+  """Times updates, merges of small accumulators and quantile queries."""
+  start = time.perf_counter()
+  acc = factory()
+  for v in values:
+    acc.UpdateOneValue(v)
+  update_time = time.perf_counter() - start
+
+  # Merge many small accumulators, as workers do with per-person bundles
+  parts = []
+  for i in range(0, len(values), merge_group_size):
+    part = factory()
+    for v in values[i:i+merge_group_size]:
+      part.UpdateOneValue(v)
+    parts.append(part)
+  start = time.perf_counter()
+  merged = factory()
+  for part in parts:
+    merged.UpdateAccumulator(part)
+  merge_time = time.perf_counter() - start
+
+  start = time.perf_counter()
+  estimates = [acc.Quantile(q) for q in QUANTILES]
+  quantile_time = time.perf_counter() - start
+
+  print("%s: update %.2fus/value, merge %.2fus/accumulator, quantile %.2fus/query" % (
+      name,
+      1e6 * update_time / len(values),
+      1e6 * merge_time / len(parts),
+      1e6 * quantile_time / len(QUANTILES)))
+  return estimates
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark quantile accumulators')
+  parser.add_argument('--number', type=int, default=10**6, help='Number of values to accumulate')
+  parser.add_argument('--merge_group_size', type=int, default=50, help='Values per accumulator when benchmarking merges')
+  parser.add_argument('--seed', type=int, default=0, help='Random seed for the values')
+  parser.add_argument('--skip_legacy', action='store_true', default=False, help="Don't run the slow previous implementation")
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  # Roughly the shape of annual consumption
+  values = [rng.lognormvariate(10.5, 0.4) for _ in range(args.number)]
+  exact = sorted(values)
+
+  factories = []
+  if not args.skip_legacy:
+    factories.append(("legacy", LegacyQuantileAccumulator))
+  factories.append(("histogram", utils.QuantileAccumulator))
+  factories.append(("tdigest", utils.TDigestAccumulator))
+  factories.append(("kll", utils.KLLAccumulator))
+  factories.append(("grid", utils.FixedGridHistogramAccumulator))
+  results = [(name, Benchmark(name, factory, values, args.merge_group_size)) for name, factory in factories]
+
+  print()
+  print("quantile,exact," + ",".join("%s,%s rank error" % (name, name) for name, _ in results))
+  for i, q in enumerate(QUANTILES):
+    print("%s,%s,%s" % (q, ExactQuantile(exact, q), ",".join(
+        "%s,%.5f" % (estimates[i], RankError(exact, q, estimates[i])) for _, estimates in results)))
@@ -1,8 +1,17 @@
 """Utils holds miscellaneous classes and functions that don't fit elsewhere."""
 
+import array
 import bisect
 import collections
+import functools
+import heapq
+import itertools
+import json
 import math
+import os
+import struct
+import sys
+import zlib
 import world
 
 class YearRecord(object):
@@ -19,6 +28,8 @@ class YearRecord(object):
     self.age = world.START_AGE
     self.cpi = 1
     self.inflation = 0
+    self.real_wage_growth = world.PARGE
+    self.wage_index = 1
     self.rrsp_room = 0
     self.tfsa_room = 0
 
@@ -32,6 +43,28 @@ LifetimeRecord = collections.namedtuple('LifetimeRecord',
 def Indexed(base, current_year, rate=1+world.PARGE):
   return base * (rate ** (current_year - world.BASE_YEAR))
 
+def _PackDoubles(out, values):
+  """Appends values to the bytearray out as a count and little endian doubles."""
+  values = array.array('d', values)
+  if sys.byteorder == 'big':
+    values.byteswap()
+  out += struct.pack('<I', len(values))
+  out += values.tobytes()
+
+def _UnpackDoubles(data, offset):
+  """Returns the array of doubles packed at offset by _PackDoubles, and the offset after it."""
+  count, = struct.unpack_from('<I', data, offset)
+  offset += 4
+  values = array.array('d')
+  values.frombytes(data[offset:offset + 8*count])
+  if sys.byteorder == 'big':
+    values.byteswap()
+  return values, offset + 8*count
+
+def _Number(value):
+  """Turns a float that holds a whole number back into an int."""
+  return int(value) if value.is_integer() else value
+
 class SummaryStatsAccumulator(object):
   """This uses a generalization of Welford's Algorithm by Chan et al [1] to
   calculate mean, variance, and standard deviation in one pass, with the ability
@@ -51,6 +84,31 @@ class SummaryStatsAccumulator(object):
     self.mean += delta / self.n
     self.M2 += delta * (value - self.mean)
 
+  def UpdateArray(self, values, weights=None):
+    """Updates from a sequence of values, such as a list or an array.array.
+
+    The batch is summarized with two compensated passes, one for its mean and
+    one for its M2, and then combined like any other subsample. weights are
+    frequency weights: a value with weight 3 counts as 3 observations. The
+    summary statistics of an AccumulatorBundle keep integer counts, so need
+    whole number weights.
+    """
+    if weights is None:
+      n = len(values)
+      if not n:
+        return
+      mean = math.fsum(values) / n
+      M2 = math.fsum((v - mean) * (v - mean) for v in values)
+    else:
+      if len(weights) != len(values):
+        raise ValueError("expected one weight per value, got %d weights for %d values" % (len(weights), len(values)))
+      n = _Number(math.fsum(weights))
+      if not n:
+        return
+      mean = math.fsum(w * v for v, w in zip(values, weights)) / n
+      M2 = math.fsum(w * (v - mean) * (v - mean) for v, w in zip(values, weights))
+    self.UpdateSubsample(n, mean, M2)
+
   def UpdateSubsample(self, n, mean, M2):
     if not (self.n or n):
       return
@@ -102,47 +160,120 @@ class QuantileAccumulator(object):
   Ben-Haim and Yom-Tov in [1] to accumulate values, and uses this histogram to
   provide quantile approximations.
 
+  New values and histograms are buffered, then added to the histogram in one
+  batch using the paper's merge procedure. Candidate merges are kept in a heap
+  ordered by the distance between neighbouring bins, so merging down to
+  max_bins costs O(b log b) for b bins rather than a scan per merge.
+
   [1] http://jmlr.org/papers/volume11/ben-haim10a/ben-haim10a.pdf
   """
-  def __init__(self, max_bins=100):
+  # Constructor arguments, which are packed along with the histogram
+  _PARAMS = ("max_bins", "buffer_size")
+
+  def __init__(self, max_bins=100, buffer_size=None):
     self.max_bins = max_bins
-    self.bins = []
+    self.buffer_size = buffer_size or max_bins
+    self._centroids = []
+    self._counts = []
+    self._pending = []
+    self._cumsums = None
+
+  @property
+  def bins(self):
+    """The histogram as a sorted list of (centroid, count) tuples."""
+    self._Flush()
+    return list(zip(self._centroids, self._counts))
+
+  @bins.setter
+  def bins(self, bins):
+    self._centroids = [b[0] for b in bins]
+    self._counts = [b[1] for b in bins]
+    self._pending = []
+    self._cumsums = None
+
+  def _State(self):
+    """Returns the histogram as sequences of numbers, for packing."""
+    self._Flush()
+    return self._centroids, self._counts
+
+  def _SetState(self, centroids, counts):
+    self._centroids = centroids.tolist()
+    self._counts = [int(count) for count in counts]
+    self._pending = []
+    self._cumsums = None
 
-  def _Merge(self):
-    """Merges bins if there are more than max_bins. Expects self.bins to be sorted"""
+  def _Flush(self):
+    """Adds the buffered bins to the histogram and merges it down to max_bins."""
+    if not self._pending:
+      return
+    self._pending.sort()
 
     # Merge bins with identical centroids first, regardless of self.max_bins
-    zero_diffs = [(self.bins[i+1][0] - self.bins[i][0], i) for i in range(len(self.bins)-1) if not self.bins[i+1][0] - self.bins[i][0]]
-    for _, i in reversed(zero_diffs):
-      self.bins[i:i+2] = [(self.bins[i][0], self.bins[i][1]+self.bins[i+1][1])]
-
-    # Now merge other bins until we have at most self.max_bins
-    diffs = [(self.bins[i+1][0] - self.bins[i][0], i) for i in range(len(self.bins)-1)]
-    removed = []
-    while len(self.bins) > self.max_bins:
-      # Find the two closest bins
-      sep, i = min(diffs)
-      i_adjustment = bisect.bisect_left(removed, i)
-      removed.insert(i_adjustment, i)
-      i -= i_adjustment
-
-      # Merge them
-      self.bins[i:i+2] = [(
-          (self.bins[i][0]*self.bins[i][1] + self.bins[i+1][0]*self.bins[i+1][1])/(self.bins[i][1]+self.bins[i+1][1]),
-          self.bins[i][1]+self.bins[i+1][1])]
-      if i:
-        diffs[i-1:i+1] = [(self.bins[i][0] - self.bins[i-1][0], diffs[i-1][1])]
+    centroids = []
+    counts = []
+    for centroid, count in heapq.merge(zip(self._centroids, self._counts), self._pending):
+      if centroids and centroids[-1] == centroid:
+        counts[-1] += count
       else:
-        diffs[0:2] = [(self.bins[1][0] - self.bins[0][0], diffs[1][1])]
+        centroids.append(centroid)
+        counts.append(count)
+
+    if len(centroids) > self.max_bins:
+      centroids, counts = self._Merge(centroids, counts)
+    self._centroids = centroids
+    self._counts = counts
+    self._pending = []
+    self._cumsums = None
+
+  def _Merge(self, centroids, counts):
+    """Merges the closest pair of bins until there are at most max_bins.
+
+    Expects centroids to be sorted. Returns the merged centroids and counts.
+    """
+    size = len(centroids)
+    following = list(range(1, size + 1))
+    preceding = list(range(-1, size - 1))
+    merged = [False] * size
+
+    # Heap entries are (separation, left bin, right bin). Entries go stale when
+    # either bin is merged away or a centroid moves, and are skipped when popped.
+    gaps = [(centroids[i+1] - centroids[i], i, i+1) for i in range(size - 1)]
+    heapq.heapify(gaps)
+
+    bins = size
+    while bins > self.max_bins:
+      sep, i, j = heapq.heappop(gaps)
+      if merged[i] or following[i] != j or centroids[j] - centroids[i] != sep:
+        continue
+
+      # Merge bin j into bin i
+      count = counts[i] + counts[j]
+      centroids[i] = (centroids[i]*counts[i] + centroids[j]*counts[j]) / count
+      counts[i] = count
+      merged[j] = True
+      bins -= 1
+
+      k = following[j]
+      following[i] = k
+      if k < size:
+        preceding[k] = i
+        heapq.heappush(gaps, (centroids[k] - centroids[i], i, k))
+      h = preceding[i]
+      if h >= 0:
+        heapq.heappush(gaps, (centroids[i] - centroids[h], h, i))
+
+    return ([c for c, m in zip(centroids, merged) if not m],
+            [n for n, m in zip(counts, merged) if not m])
 
   def UpdateOneValue(self, value):
-    bisect.insort_left(self.bins, (value, 1))
-    self._Merge()
+    self._pending.append((value, 1))
+    if len(self._pending) >= self.buffer_size:
+      self._Flush()
 
   def UpdateHistogram(self, bins):
-    self.bins.extend(bins)
-    self.bins.sort()
-    self._Merge()
+    self._pending.extend(bins)
+    if len(self._pending) >= self.buffer_size:
+      self._Flush()
 
   def UpdateAccumulator(self, acc):
     self.UpdateHistogram(acc.bins)
@@ -151,15 +282,19 @@ class QuantileAccumulator(object):
     if q < 0 or 1 < q:
       raise ValueError("quantile should be a number between 0 and 1, inclusive")
 
-    if len(self.bins) == 0:
+    self._Flush()
+    if len(self._centroids) == 0:
       return float('nan')
 
     # Cumulative sum of the counts at each bin point, treating the point as the center of the bin
-    bin_counts = [0] + [b[1] for b in self.bins] + [0]
-    cumsums = [0]
-    for i in range(1, len(bin_counts)):
-      bin_count = (bin_counts[i] + bin_counts[i-1])/2
-      cumsums.append(cumsums[-1] + bin_count)
+    if self._cumsums is None:
+      bin_counts = [0] + self._counts + [0]
+      cumsums = [0]
+      for i in range(1, len(bin_counts)):
+        bin_count = (bin_counts[i] + bin_counts[i-1])/2
+        cumsums.append(cumsums[-1] + bin_count)
+      self._cumsums = cumsums
+    cumsums = self._cumsums
 
     # Find the index of the interval in which the desired quantile lies
     n_points = q * cumsums[-1]
@@ -167,13 +302,381 @@ class QuantileAccumulator(object):
 
     if i <= 0:
       # special case, quantile falls before first bin
-      return self.bins[0][0]
-    elif i >= len(self.bins):
+      return self._centroids[0]
+    elif i >= len(self._centroids):
       # Special case, quantile falls at or after last bin
-      return self.bins[-1][0]
+      return self._centroids[-1]
     else:
       bin_frac = (n_points - cumsums[i])/(cumsums[i+1] - cumsums[i])
-      return self.bins[i-1][0] + bin_frac * (self.bins[i][0] - self.bins[i-1][0])
+      return self._centroids[i-1] + bin_frac * (self._centroids[i] - self._centroids[i-1])
+
+
+class TDigestAccumulator(object):
+  """This is the merging t-digest of Dunning and Ertl [1], which summarizes
+  values as weighted centroids that are small in the tails and large near the
+  median, and uses them to provide quantile approximations.
+
+  compression (delta in [1]) trades size for accuracy. The digest keeps at most
+  about compression centroids, and with the k1 scale function a centroid near
+  quantile q holds at most about 2*pi*sqrt(q*(1-q))/compression of the values.
+  Interpolating within a centroid gives a rank error of at most about half
+  that, pi*sqrt(q*(1-q))/compression, which is 0.94% of the values at q=0.1
+  for the default compression of 100. This bound is a property of the
+  construction rather than a worst case guarantee.
+
+  [1] https://arxiv.org/abs/1902.04023
+  """
+  _PARAMS = ("compression", "buffer_size")
+
+  def __init__(self, compression=100, buffer_size=None):
+    self.compression = compression
+    self.buffer_size = buffer_size or 5 * compression
+    self.n = 0
+    self.min = float('inf')
+    self.max = float('-inf')
+    self._means = []
+    self._weights = []
+    self._pending = []
+    self._centers = None
+
+  def _State(self):
+    """Returns the digest as sequences of numbers, for packing."""
+    self._Flush()
+    return (self.n, self.min, self.max), self._means, self._weights
+
+  def _SetState(self, totals, means, weights):
+    n, self.min, self.max = totals
+    self.n = int(n)
+    self._means = means.tolist()
+    self._weights = weights.tolist()
+    self._pending = []
+    self._centers = None
+
+  def _QuantileLimit(self, q):
+    """Returns the largest quantile a centroid starting at quantile q may reach."""
+    k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+    angle = 2 * math.pi * k / self.compression
+    if angle >= math.pi / 2:
+      return 1
+    return (math.sin(angle) + 1) / 2
+
+  def _Flush(self):
+    """Merges the buffered centroids into the digest."""
+    if not self._pending:
+      return
+    self._pending.sort()
+
+    means = []
+    weights = []
+    q_start = 0
+    q_limit = self._QuantileLimit(q_start)
+    mean = weight = None
+    for next_mean, next_weight in heapq.merge(zip(self._means, self._weights), self._pending):
+      if weight is None:
+        mean, weight = next_mean, next_weight
+      elif q_start + (weight + next_weight) / self.n <= q_limit:
+        weight += next_weight
+        mean += (next_mean - mean) * next_weight / weight
+      else:
+        means.append(mean)
+        weights.append(weight)
+        q_start += weight / self.n
+        q_limit = self._QuantileLimit(q_start)
+        mean, weight = next_mean, next_weight
+    means.append(mean)
+    weights.append(weight)
+
+    self._means = means
+    self._weights = weights
+    self._pending = []
+    self._centers = None
+
+  def UpdateOneValue(self, value):
+    self.n += 1
+    self.min = min(self.min, value)
+    self.max = max(self.max, value)
+    self._pending.append((value, 1))
+    if len(self._pending) >= self.buffer_size:
+      self._Flush()
+
+  def UpdateAccumulator(self, acc):
+    acc._Flush()
+    self.n += acc.n
+    self.min = min(self.min, acc.min)
+    self.max = max(self.max, acc.max)
+    self._pending.extend(zip(acc._means, acc._weights))
+    if len(self._pending) >= self.buffer_size:
+      self._Flush()
+
+  def Quantile(self, q):
+    if q < 0 or 1 < q:
+      raise ValueError("quantile should be a number between 0 and 1, inclusive")
+
+    self._Flush()
+    if not self.n:
+      return float('nan')
+
+    # Centroids are treated as point masses at their centers, with the extreme
+    # values standing in for the edges of the first and last centroids
+    if self._centers is None:
+      centers = []
+      cumulative = 0
+      for weight in self._weights:
+        centers.append(cumulative + weight / 2)
+        cumulative += weight
+      self._centers = centers
+    centers = self._centers
+
+    target = q * self.n
+    if target <= centers[0]:
+      return self.min + (self._means[0] - self.min) * target / centers[0]
+    if target >= centers[-1]:
+      tail = self.n - centers[-1]
+      return self.max - (self.max - self._means[-1]) * (self.n - target) / tail
+    i = bisect.bisect_right(centers, target)
+    frac = (target - centers[i-1]) / (centers[i] - centers[i-1])
+    return self._means[i-1] + frac * (self._means[i] - self._means[i-1])
+
+
+class KLLAccumulator(object):
+  """This is the KLL sketch of Karnin, Lang and Liberty [1], which keeps a
+  hierarchy of compactors. When a compactor fills, it sorts its values and
+  promotes every other one, chosen at random, to the next level with twice the
+  weight.
+
+  k trades size for accuracy: the sketch keeps O(k) values. The rank error is
+  proportional to 1/k; the same construction in [2] has a normalized rank error
+  below 1.65% with 99% confidence at the default k of 200. Unlike the other
+  sketches, this bound holds for any input order and any sequence of merges.
+
+  The random choices are a hash of the sketch's state, rather than draws from
+  a random number generator, so they don't disturb the random draws that drive
+  the simulation, and a sketch fed the same values and merges is the same in
+  every run and every process.
+
+  [1] https://arxiv.org/abs/1603.05346
+  [2] https://datasketches.apache.org/docs/KLL/KLLAccuracyAndSize.html
+  """
+  _PARAMS = ("k",)
+
+  def __init__(self, k=200):
+    self.k = k
+    self.n = 0
+    self.min = float('inf')
+    self.max = float('-inf')
+    self._compactors = [[]]
+    self._size = 0
+    self._max_size = self._Capacity(0)
+    self._sorted = None
+
+  def _State(self):
+    """Returns the sketch as sequences of numbers, for packing."""
+    return ((self.n, self.min, self.max),
+            [len(compactor) for compactor in self._compactors],
+            [value for compactor in self._compactors for value in compactor])
+
+  def _SetState(self, totals, sizes, values):
+    n, self.min, self.max = totals
+    self.n = int(n)
+    self._compactors = []
+    start = 0
+    for size in sizes:
+      self._compactors.append(values[start:start + int(size)].tolist())
+      start += int(size)
+    self._size = len(values)
+    self._max_size = sum(self._Capacity(h) for h in range(len(sizes)))
+    self._sorted = None
+
+  def _Capacity(self, level):
+    """Lower levels have geometrically less room than the top level."""
+    depth = len(self._compactors) - level - 1
+    return max(int(math.ceil(self.k * (2/3) ** depth)), 2)
+
+  def _Grow(self):
+    self._compactors.append([])
+    self._max_size = sum(self._Capacity(h) for h in range(len(self._compactors)))
+
+  def _Compress(self):
+    while self._size >= self._max_size:
+      for h, compactor in enumerate(self._compactors):
+        if len(compactor) >= self._Capacity(h):
+          if h + 1 == len(self._compactors):
+            self._Grow()
+          compactor.sort()
+          # An odd value out stays behind so that total weight is preserved
+          kept = len(compactor) % 2
+          coin = hash((self.n, h, compactor[0], compactor[-1])) & 1
+          self._compactors[h+1].extend(compactor[kept + coin::2])
+          self._compactors[h] = compactor[:kept]
+          self._size = sum(len(c) for c in self._compactors)
+          break
+
+  def UpdateOneValue(self, value):
+    self.n += 1
+    self.min = min(self.min, value)
+    self.max = max(self.max, value)
+    self._compactors[0].append(value)
+    self._size += 1
+    self._sorted = None
+    if self._size >= self._max_size:
+      self._Compress()
+
+  def UpdateAccumulator(self, acc):
+    while len(self._compactors) < len(acc._compactors):
+      self._Grow()
+    for h, compactor in enumerate(acc._compactors):
+      self._compactors[h].extend(compactor)
+    self.n += acc.n
+    self.min = min(self.min, acc.min)
+    self.max = max(self.max, acc.max)
+    self._size = sum(len(c) for c in self._compactors)
+    self._sorted = None
+    self._Compress()
+
+  def Quantile(self, q):
+    if q < 0 or 1 < q:
+      raise ValueError("quantile should be a number between 0 and 1, inclusive")
+
+    if not self.n:
+      return float('nan')
+    if q == 0:
+      return self.min
+    if q == 1:
+      return self.max
+
+    # Values at level h stand for 2**h original values
+    if self._sorted is None:
+      self._sorted = sorted((value, 2**h) for h, compactor in enumerate(self._compactors) for value in compactor)
+    target = q * self.n
+    cumulative = 0
+    for value, weight in self._sorted:
+      cumulative += weight
+      if cumulative >= target:
+        return value
+    return self.max
+
+
+class FixedGridHistogramAccumulator(object):
+  """Counts values in n_bins log-spaced bins between low and high, plus an
+  underflow bin for values below low (including negative ones) and an
+  overflow bin for values of high or more.
+
+  Updates and merges only touch occupied bins, which are stored sparsely, so a
+  histogram holding a single value is as cheap to merge as a counter. Within
+  the grid, a quantile estimate is never further from a value of the same rank
+  than one bin, a relative error of at most (high/low)**(1/n_bins) - 1, which
+  is 2.3% with the defaults. Outside the grid, estimates interpolate towards
+  the smallest and largest values seen.
+  """
+  _PARAMS = ("low", "high", "n_bins")
+
+  def __init__(self, low=1000, high=10**6, n_bins=300):
+    self.low = low
+    self.high = high
+    self.n_bins = n_bins
+    self.n = 0
+    self.min = float('inf')
+    self.max = float('-inf')
+    self.counts = {}
+    self._log_low = math.log(low)
+    self._log_ratio = (math.log(high) - self._log_low) / n_bins
+
+  def _State(self):
+    """Returns the histogram as sequences of numbers, for packing."""
+    return (self.n, self.min, self.max), self.counts.keys(), self.counts.values()
+
+  def _SetState(self, totals, bins, counts):
+    n, self.min, self.max = totals
+    self.n = int(n)
+    self.counts = dict(zip(map(int, bins), map(int, counts)))
+
+  def _Bin(self, value):
+    """Returns 0 for underflow, 1 to n_bins within the grid, and n_bins+1 for overflow."""
+    if value < self.low:
+      return 0
+    if value >= self.high:
+      return self.n_bins + 1
+    return min(int((math.log(value) - self._log_low) / self._log_ratio), self.n_bins - 1) + 1
+
+  def _Edges(self, i):
+    if i == 0:
+      return self.min, min(self.low, self.max)
+    if i == self.n_bins + 1:
+      return max(self.high, self.min), self.max
+    lower = math.exp(self._log_low + (i - 1) * self._log_ratio)
+    upper = math.exp(self._log_low + i * self._log_ratio)
+    return max(lower, self.min), min(upper, self.max)
+
+  def UpdateOneValue(self, value):
+    self.n += 1
+    if value < self.min:
+      self.min = value
+    if value > self.max:
+      self.max = value
+    i = self._Bin(value)
+    self.counts[i] = self.counts.get(i, 0) + 1
+
+  def UpdateAccumulator(self, acc):
+    if (acc.low, acc.high, acc.n_bins) != (self.low, self.high, self.n_bins):
+      raise ValueError("can't merge histograms with different grids")
+    self.n += acc.n
+    self.min = min(self.min, acc.min)
+    self.max = max(self.max, acc.max)
+    counts = self.counts
+    for i, count in acc.counts.items():
+      counts[i] = counts.get(i, 0) + count
+
+  def Quantile(self, q):
+    if q < 0 or 1 < q:
+      raise ValueError("quantile should be a number between 0 and 1, inclusive")
+
+    if not self.n:
+      return float('nan')
+    if q == 0:
+      return self.min
+
+    target = q * self.n
+    cumulative = 0
+    for i in sorted(self.counts):
+      count = self.counts[i]
+      if cumulative + count >= target:
+        frac = (target - cumulative) / count
+        lower, upper = self._Edges(i)
+        if 0 < lower:
+          return lower * math.pow(upper / lower, frac)
+        return lower + frac * (upper - lower)
+      cumulative += count
+    return self.max
+
+
+# Quantile sketches by name, with the name of each one's size parameter
+QUANTILE_SKETCHES = {
+    "histogram": (QuantileAccumulator, "max_bins"),
+    "tdigest": (TDigestAccumulator, "compression"),
+    "kll": (KLLAccumulator, "k"),
+    "grid": (FixedGridHistogramAccumulator, "n_bins"),
+}
+
+# Tags that identify each quantile sketch in packed bundles, by position
+_PACKED_SKETCHES = (QuantileAccumulator, TDigestAccumulator, KLLAccumulator, FixedGridHistogramAccumulator)
+
+def _PackSketch(sketch, out):
+  out += struct.pack('<B', _PACKED_SKETCHES.index(type(sketch)))
+  _PackDoubles(out, [getattr(sketch, param) for param in sketch._PARAMS])
+  for values in sketch._State():
+    _PackDoubles(out, values)
+
+def _UnpackSketch(data, offset):
+  """Returns the quantile sketch packed at offset by _PackSketch, and the offset after it."""
+  sketch_class = _PACKED_SKETCHES[data[offset]]
+  params, offset = _UnpackDoubles(data, offset + 1)
+  sketch = sketch_class(**{name: _Number(value) for name, value in zip(sketch_class._PARAMS, params)})
+  state = []
+  for _ in sketch._State():
+    values, offset = _UnpackDoubles(data, offset)
+    state.append(values)
+  sketch._SetState(*state)
+  return sketch, offset
 
 
 class PicklableLambda(object):
@@ -208,142 +711,722 @@ class KeyedAccumulator(object):
       result.UpdateAccumulator(self._accumulators.get(key, default))
     return result        
 
+  def _Pack(self, out):
+    """Packs a KeyedAccumulator of quantile sketches with integer keys.
 
-class AccumulatorBundle(object):
-  def __init__(self, basic_only=False):
+    The subaccumulators all have the same type and parameters, so those are
+    packed once. Then come the keys, and each part of the subaccumulators'
+    state as the sizes of that part followed by all of them laid end to end.
+    """
+    _PackSketch(self.default_factory(), out)
+    _PackDoubles(out, self._accumulators.keys())
+    states = [accumulator._State() for accumulator in self._accumulators.values()]
+    for part in zip(*states):
+      _PackDoubles(out, [len(values) for values in part])
+      _PackDoubles(out, [value for values in part for value in values])
+
+  @classmethod
+  def _Unpack(cls, data, offset):
+    prototype, offset = _UnpackSketch(data, offset)
+    sketch_class = type(prototype)
+    keyed = cls(sketch_class, {param: getattr(prototype, param) for param in prototype._PARAMS})
+    keys, offset = _UnpackDoubles(data, offset)
+    parts = []
+    for _ in (prototype._State() if keys else ()):
+      sizes, offset = _UnpackDoubles(data, offset)
+      values, offset = _UnpackDoubles(data, offset)
+      starts = list(itertools.accumulate(map(int, sizes), initial=0))
+      parts.append([values[start:end] for start, end in zip(starts, starts[1:])])
+    for key, state in zip(keys, zip(*parts)):
+      # Skip the constructor, since the prototype already holds the derived parameters
+      accumulator = sketch_class.__new__(sketch_class)
+      accumulator.__dict__.update(prototype.__dict__)
+      accumulator._SetState(*state)
+      keyed._accumulators[int(key)] = accumulator
+    return keyed, offset
+
+
+class DenseKeyedAccumulator(object):
+  """A KeyedAccumulator of SummaryStatsAccumulators for a fixed range of small
+  integer keys, such as ages or periods.
+
+  The count, mean and M2 for each key live in parallel arrays indexed by key,
+  so updates touch three array slots, merges combine the arrays slot by slot,
+  and the whole accumulator pickles as three compact arrays. Counts are kept
+  as integers, like SummaryStatsAccumulator's.
+  """
+
+  def __init__(self, keys):
+    self.keys = keys
+    self._n = array.array('q', bytes(8 * len(keys)))
+    self._mean = array.array('d', bytes(8 * len(keys)))
+    self._M2 = array.array('d', bytes(8 * len(keys)))
+
+  def _Index(self, key):
+    i = key - self.keys.start
+    if not 0 <= i < len(self.keys):
+      raise KeyError("key %r is outside %r" % (key, self.keys))
+    return i
+
+  def UpdateOneValue(self, value, key):
+    i = self._Index(key)
+    n = self._n[i] + 1
+    delta = value - self._mean[i]
+    mean = self._mean[i] + delta / n
+    self._M2[i] += delta * (value - mean)
+    self._mean[i] = mean
+    self._n[i] = n
+
+  def UpdateAccumulator(self, acc):
+    if acc.keys != self.keys:
+      raise ValueError("can't merge accumulators over %r and %r" % (self.keys, acc.keys))
+    self_n, self_mean, self_M2 = self._n, self._mean, self._M2
+    for i, n in enumerate(acc._n):
+      if not n:
+        continue
+      total = self_n[i] + n
+      delta = acc._mean[i] - self_mean[i]
+      self_M2[i] += acc._M2[i] + delta * delta * self_n[i] * n / total
+      self_mean[i] += delta * n / total
+      self_n[i] = total
+
+  def Query(self, keys):
+    """Returns a SummaryStatsAccumulator resulting from the merge of the statistics for the given keys."""
+    result = SummaryStatsAccumulator()
+    for key in keys:
+      i = key - self.keys.start
+      if 0 <= i < len(self.keys) and self._n[i]:
+        result.UpdateSubsample(self._n[i], self._mean[i], self._M2[i])
+    return result
+
+
+# Ages a person can live through, and the period codes in person.py, from
+# EMPLOYED to INVOLUNTARILY_RETIRED
+AGES = range(world.START_AGE, max(max(world.MALE_MORTALITY), max(world.FEMALE_MORTALITY)) + 1)
+PERIODS = range(4)
+
+# Measures that key accumulators, and the keys they take
+KEY_RANGES = {"age": AGES, "period": PERIODS}
+
+# Kinds of accumulator
+SUMMARY_STATS = "summary_stats"
+QUANTILE = "quantile"
+
+# Phases of a life that feed accumulators
+PHASE_YEAR = "year"  # Every year the person is alive
+PHASE_RETIREMENT = "retirement"  # The year the person retires
+PHASE_DEATH = "death"  # The year the person dies
+PHASES = (PHASE_YEAR, PHASE_RETIREMENT, PHASE_DEATH)
+
+# What accumulators are used for. Basic bundles only hold FITNESS accumulators.
+FITNESS = "fitness"
+SUMMARY_TABLE = "summary_table"
+PERIOD_TABLE = "period_table"
+AGE_TABLE = "age_table"
+
+AccumulatorSpec = collections.namedtuple("AccumulatorSpec",
+                                         ["name",
+                                          "kind",
+                                          "measure",
+                                          "phase",
+                                          "usage",
+                                          "key",
+                                          "condition"],
+                                         defaults=(None, ()))
+AccumulatorSpec.__doc__ = """Describes one accumulator in an AccumulatorBundle.
+
+In phase, the accumulator is updated with the value of measure, keyed by the
+value of the key measure if there is one, provided all the measures named in
+condition are true.
+"""
+
+def _Year(name, measure, usage, key=None, condition=(), kind=SUMMARY_STATS):
+  return AccumulatorSpec(name, kind, measure, PHASE_YEAR, usage, key, condition)
+
+def _Death(name, measure, usage, key=None, condition=()):
+  return AccumulatorSpec(name, SUMMARY_STATS, measure, PHASE_DEATH, usage, key, condition)
+
+ACCUMULATOR_SCHEMA = (
     # Accumulators needed for fitness function
-    self.lifetime_consumption_summary = SummaryStatsAccumulator()
-    self.lifetime_consumption_hist = QuantileAccumulator()
-    self.working_consumption_summary = SummaryStatsAccumulator()
-    self.working_consumption_hist = QuantileAccumulator()
-    self.retired_consumption_summary = SummaryStatsAccumulator()
-    self.retired_consumption_hist = QuantileAccumulator()
-    self.pre_disability_retired_consumption_summary = SummaryStatsAccumulator()
-    self.discounted_lifetime_consumption_summary = SummaryStatsAccumulator()
-    self.earnings_late_working_summary = SummaryStatsAccumulator()
-    self.fraction_persons_ruined = SummaryStatsAccumulator()
-    self.fraction_retirement_years_ruined = SummaryStatsAccumulator()
-    self.fraction_retirement_years_below_ympe = SummaryStatsAccumulator()
-    self.fraction_retirement_years_below_twice_ympe = SummaryStatsAccumulator()
-    self.fraction_retirees_receiving_gis = SummaryStatsAccumulator()
-    self.fraction_retirement_years_receiving_gis = SummaryStatsAccumulator()
-    self.benefits_gis = SummaryStatsAccumulator()
-    self.fraction_retirees_ever_below_lico = SummaryStatsAccumulator()
-    self.fraction_retirement_years_below_lico = SummaryStatsAccumulator()
-    self.lico_gap_working = SummaryStatsAccumulator()
-    self.lico_gap_retired = SummaryStatsAccumulator()
-    self.fraction_persons_with_withdrawals_below_retirement_assets = SummaryStatsAccumulator()
-    self.fraction_retirees_with_withdrawals_below_retirement_assets = SummaryStatsAccumulator()
-    self.lifetime_withdrawals_less_savings = SummaryStatsAccumulator()
-    self.retirement_consumption_less_working_consumption = SummaryStatsAccumulator()
-    self.distributable_estate = SummaryStatsAccumulator()
-
-    if basic_only:
-      return
+    _Year("lifetime_consumption_summary", "consumption", FITNESS),
+    _Year("lifetime_consumption_hist", "consumption", FITNESS, kind=QUANTILE),
+    _Year("working_consumption_summary", "consumption", FITNESS, condition=("working",)),
+    _Year("working_consumption_hist", "consumption", FITNESS, condition=("working",), kind=QUANTILE),
+    _Year("retired_consumption_summary", "consumption", FITNESS, condition=("retired",)),
+    _Year("retired_consumption_hist", "consumption", FITNESS, condition=("retired",), kind=QUANTILE),
+    _Year("pre_disability_retired_consumption_summary", "consumption", FITNESS, condition=("retired", "pre_disability")),
+    _Year("discounted_lifetime_consumption_summary", "discounted_consumption", FITNESS),
+    _Year("earnings_late_working_summary", "earnings", FITNESS, condition=("late_working",)),
+    _Death("fraction_persons_ruined", "has_been_ruined", FITNESS),
+    _Year("fraction_retirement_years_ruined", "ruined", FITNESS, condition=("retired",)),
+    _Year("fraction_retirement_years_below_ympe", "below_ympe", FITNESS, condition=("retired",)),
+    _Year("fraction_retirement_years_below_twice_ympe", "below_twice_ympe", FITNESS, condition=("retired",)),
+    _Death("fraction_retirees_receiving_gis", "has_received_gis", FITNESS),
+    _Year("fraction_retirement_years_receiving_gis", "receiving_gis", FITNESS, condition=("past_maximum_retirement_age",)),
+    _Year("benefits_gis", "gis", FITNESS, condition=("past_maximum_retirement_age",)),
+    _Death("fraction_retirees_ever_below_lico", "has_experienced_income_under_lico", FITNESS),
+    _Year("fraction_retirement_years_below_lico", "below_lico", FITNESS, condition=("retired",)),
+    _Year("lico_gap_working", "lico_gap", FITNESS, condition=("working",)),
+    _Year("lico_gap_retired", "lico_gap", FITNESS, condition=("retired",)),
+    _Death("fraction_persons_with_withdrawals_below_retirement_assets", "withdrawals_below_retirement_assets", FITNESS),
+    _Death("fraction_retirees_with_withdrawals_below_retirement_assets", "withdrawals_below_retirement_assets", FITNESS, condition=("retired",)),
+    _Year("lifetime_withdrawals_less_savings", "withdrawals_less_savings", FITNESS),
+    _Death("retirement_consumption_less_working_consumption", "retirement_consumption_shortfall", FITNESS),
+    _Death("distributable_estate", "estate", FITNESS),
 
     # Accumulators needed for summary table
-    self.age_at_death = SummaryStatsAccumulator()
-    self.years_worked_with_earnings = SummaryStatsAccumulator()
-    self.earnings_working = SummaryStatsAccumulator()
-    self.fraction_persons_involuntarily_retired = SummaryStatsAccumulator()
-    self.fraction_persons_dying_before_retiring = SummaryStatsAccumulator()
-    self.working_annual_ei_cpp_deductions = SummaryStatsAccumulator()
-    self.working_taxes = SummaryStatsAccumulator()
-    self.retirement_taxes = SummaryStatsAccumulator()
-    self.positive_savings_years = SummaryStatsAccumulator()
-    self.fraction_earnings_saved = SummaryStatsAccumulator()
-    self.years_receiving_ei = SummaryStatsAccumulator()
-    self.positive_ei_benefits = SummaryStatsAccumulator()
-    self.years_receiving_gis = SummaryStatsAccumulator()
-    self.positive_gis_benefits = SummaryStatsAccumulator()
-    self.positive_cpp_benefits = SummaryStatsAccumulator()
-    self.years_income_below_lico = SummaryStatsAccumulator()
-    self.years_with_no_assets = SummaryStatsAccumulator()
-    self.years_with_negative_consumption = SummaryStatsAccumulator()
-    self.net_government_revenue = SummaryStatsAccumulator()
-
-    # Accumulators for period specific tables
-    self.period_years = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_earnings = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_cpp_benefits = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_oas_benefits = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_taxable_gains = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_gis_benefits = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_social_benefits_repaid = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_rrsp_withdrawals = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_tfsa_withdrawals = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_nonreg_withdrawals = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_cpp_contributions = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_ei_premiums = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_taxable_income = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_income_tax = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_sales_tax = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_consumption = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_rrsp_savings = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_tfsa_savings = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_nonreg_savings = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_fund_growth = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_gross_estate = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_estate_taxes = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_executor_funeral_costs = KeyedAccumulator(SummaryStatsAccumulator)
-    self.period_distributable_estate = KeyedAccumulator(SummaryStatsAccumulator)
+    _Death("age_at_death", "age", SUMMARY_TABLE),
+    _Death("years_worked_with_earnings", "positive_earnings_years", SUMMARY_TABLE),
+    _Year("earnings_working", "earnings", SUMMARY_TABLE, condition=("working",)),
+    AccumulatorSpec("fraction_persons_involuntarily_retired", SUMMARY_STATS, "involuntarily_retired", PHASE_RETIREMENT, SUMMARY_TABLE),
+    _Death("fraction_persons_dying_before_retiring", "died_before_retiring", SUMMARY_TABLE),
+    _Year("working_annual_ei_cpp_deductions", "ei_cpp_deductions", SUMMARY_TABLE, condition=("working",)),
+    _Year("working_taxes", "taxes", SUMMARY_TABLE, condition=("working",)),
+    _Year("retirement_taxes", "taxes", SUMMARY_TABLE, condition=("retired",)),
+    _Death("positive_savings_years", "positive_savings_years", SUMMARY_TABLE),
+    _Year("fraction_earnings_saved", "fraction_earnings_saved", SUMMARY_TABLE, condition=("working", "receiving_earnings")),
+    _Death("years_receiving_ei", "ei_years", SUMMARY_TABLE),
+    _Year("positive_ei_benefits", "ei_benefits", SUMMARY_TABLE, condition=("working", "receiving_ei")),
+    _Death("years_receiving_gis", "gis_years", SUMMARY_TABLE),
+    _Year("positive_gis_benefits", "gis", SUMMARY_TABLE, condition=("past_maximum_retirement_age", "receiving_gis")),
+    _Year("positive_cpp_benefits", "cpp", SUMMARY_TABLE, condition=("retired", "receiving_cpp")),
+    _Death("years_income_below_lico", "gross_income_below_lico_years", SUMMARY_TABLE),
+    _Death("years_with_no_assets", "no_assets_years", SUMMARY_TABLE),
+    _Year("years_with_negative_consumption", "negative_consumption", SUMMARY_TABLE),
+    _Death("net_government_revenue", "net_government_revenue", SUMMARY_TABLE),
+
+    # Accumulators for period specific tables. Person updates period_years
+    # itself, once for each period.
+    AccumulatorSpec("period_years", SUMMARY_STATS, None, None, PERIOD_TABLE, "period"),
+    _Year("period_earnings", "earnings", PERIOD_TABLE, "period"),
+    _Year("period_cpp_benefits", "cpp", PERIOD_TABLE, "period"),
+    _Year("period_oas_benefits", "oas", PERIOD_TABLE, "period"),
+    _Year("period_taxable_gains", "taxable_capital_gains", PERIOD_TABLE, "period"),
+    _Year("period_gis_benefits", "gis", PERIOD_TABLE, "period"),
+    _Year("period_social_benefits_repaid", "social_benefits_repaid", PERIOD_TABLE, "period"),
+    _Year("period_rrsp_withdrawals", "rrsp_withdrawals", PERIOD_TABLE, "period"),
+    _Year("period_tfsa_withdrawals", "tfsa_withdrawals", PERIOD_TABLE, "period"),
+    _Year("period_nonreg_withdrawals", "nonreg_withdrawals", PERIOD_TABLE, "period"),
+    _Year("period_cpp_contributions", "cpp_contribution", PERIOD_TABLE, "period"),
+    _Year("period_ei_premiums", "ei_premium", PERIOD_TABLE, "period"),
+    _Year("period_taxable_income", "taxable_income", PERIOD_TABLE, "period"),
+    _Year("period_income_tax", "taxes", PERIOD_TABLE, "period"),
+    _Year("period_sales_tax", "sales_taxes", PERIOD_TABLE, "period"),
+    _Year("period_consumption", "consumption", PERIOD_TABLE, "period"),
+    _Year("period_rrsp_savings", "rrsp_deposits", PERIOD_TABLE, "period"),
+    _Year("period_tfsa_savings", "tfsa_deposits", PERIOD_TABLE, "period"),
+    _Year("period_nonreg_savings", "nonreg_deposits", PERIOD_TABLE, "period"),
+    _Year("period_fund_growth", "fund_growth", PERIOD_TABLE, "period"),
+    _Death("period_gross_estate", "gross_estate", PERIOD_TABLE, "period"),
+    _Death("period_estate_taxes", "estate_taxes", PERIOD_TABLE, "period"),
+    _Death("period_executor_funeral_costs", "funeral_and_executor_fee", PERIOD_TABLE, "period"),
+    _Death("period_distributable_estate", "estate", PERIOD_TABLE, "period"),
 
     # Accumulators for age specific table
-    self.persons_alive_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.gross_earnings_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.income_tax_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.sales_tax_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.ei_premium_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.cpp_contributions_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.ei_benefits_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.cpp_benefits_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.oas_benefits_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.gis_benefits_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.savings_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.rrsp_withdrawals_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.tfsa_withdrawals_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.nonreg_withdrawals_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.consumption_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.consumption_hist_by_age = KeyedAccumulator(QuantileAccumulator)
-    self.rrsp_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.bridging_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.tfsa_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.nonreg_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.ced_withdrawals_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.cd_withdrawals_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.ced_requested_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.cd_requested_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.rrsp_ced_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.tfsa_ced_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.nonreg_ced_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.rrsp_cd_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.tfsa_cd_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.nonreg_cd_assets_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.ced_ruined_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    self.cd_ruined_by_age = KeyedAccumulator(SummaryStatsAccumulator)
-    
+    _Year("persons_alive_by_age", "alive", AGE_TABLE, "age"),
+    _Year("gross_earnings_by_age", "earnings", AGE_TABLE, "age"),
+    _Year("income_tax_by_age", "taxes", AGE_TABLE, "age"),
+    _Year("sales_tax_by_age", "sales_taxes", AGE_TABLE, "age"),
+    _Year("ei_premium_by_age", "ei_premium", AGE_TABLE, "age"),
+    _Year("cpp_contributions_by_age", "cpp_contribution", AGE_TABLE, "age"),
+    _Year("ei_benefits_by_age", "ei_benefits", AGE_TABLE, "age"),
+    _Year("cpp_benefits_by_age", "cpp", AGE_TABLE, "age"),
+    _Year("oas_benefits_by_age", "oas", AGE_TABLE, "age"),
+    _Year("gis_benefits_by_age", "gis", AGE_TABLE, "age"),
+    _Year("savings_by_age", "savings", AGE_TABLE, "age"),
+    _Year("rrsp_withdrawals_by_age", "rrsp_withdrawals", AGE_TABLE, "age"),
+    _Year("tfsa_withdrawals_by_age", "tfsa_withdrawals", AGE_TABLE, "age"),
+    _Year("nonreg_withdrawals_by_age", "nonreg_withdrawals", AGE_TABLE, "age"),
+    _Year("consumption_by_age", "consumption", AGE_TABLE, "age"),
+    _Year("consumption_hist_by_age", "consumption", AGE_TABLE, "age", kind=QUANTILE),
+    _Year("rrsp_assets_by_age", "rrsp_assets", AGE_TABLE, "age"),
+    _Year("bridging_assets_by_age", "bridging_assets", AGE_TABLE, "age"),
+    _Year("tfsa_assets_by_age", "tfsa_assets", AGE_TABLE, "age"),
+    _Year("nonreg_assets_by_age", "nonreg_assets", AGE_TABLE, "age"),
+    _Year("ced_withdrawals_by_age", "ced_drawdown_amount", AGE_TABLE, "age", ("retired",)),
+    _Year("cd_withdrawals_by_age", "cd_drawdown_amount", AGE_TABLE, "age", ("retired",)),
+    _Year("ced_requested_by_age", "ced_drawdown_request", AGE_TABLE, "age", ("retired",)),
+    _Year("cd_requested_by_age", "cd_drawdown_request", AGE_TABLE, "age", ("retired",)),
+    _Year("rrsp_ced_assets_by_age", "rrsp_ced_assets", AGE_TABLE, "age", ("retired",)),
+    _Year("tfsa_ced_assets_by_age", "tfsa_ced_assets", AGE_TABLE, "age", ("retired",)),
+    _Year("nonreg_ced_assets_by_age", "nonreg_ced_assets", AGE_TABLE, "age", ("retired",)),
+    _Year("rrsp_cd_assets_by_age", "rrsp_cd_assets", AGE_TABLE, "age", ("retired",)),
+    _Year("tfsa_cd_assets_by_age", "tfsa_cd_assets", AGE_TABLE, "age", ("retired",)),
+    _Year("nonreg_cd_assets_by_age", "nonreg_cd_assets", AGE_TABLE, "age", ("retired",)),
+    _Year("ced_ruined_by_age", "ced_ruined", AGE_TABLE, "age", ("retired",)),
+    _Year("cd_ruined_by_age", "cd_ruined", AGE_TABLE, "age", ("retired",)),
+)
+
+def SubscribedSchema(names=(), usages=(), schema=ACCUMULATOR_SCHEMA):
+  """Returns the specs in schema for the named accumulators, and for all the
+  accumulators with one of the given usages, so that a bundle built from it
+  only accumulates what will be reported."""
+  return tuple(spec for spec in schema if spec.name in names or spec.usage in usages)
+
+# Names of the AccumulatorBundle accumulators that estimate quantiles
+QUANTILE_ACCUMULATORS = tuple(spec.name for spec in ACCUMULATOR_SCHEMA if spec.kind == QUANTILE)
+
+# Sketches used when AccumulatorBundle isn't told otherwise. Per-age histograms
+# hold one value per person, and are merged once per life, so they use the
+# cheaply merged fixed grid.
+DEFAULT_QUANTILE_SKETCHES = {
+    "consumption_hist_by_age": "grid",
+}
+
+
+def ConsumptionMeasures(consumption, year, is_retired, period):
+  """Returns the measures that feed the consumption accumulators."""
+  age = year - world.BASE_YEAR + world.START_AGE
+  return {
+      "consumption": consumption,
+      "discounted_consumption": Indexed(consumption, year, 1-world.DISCOUNT_RATE),
+      "negative_consumption": 1 if consumption < 0 else 0,
+      "retired": is_retired,
+      "working": not is_retired,
+      "pre_disability": age <= world.AVG_DISABILITY_AGE,
+      "age": age,
+      "period": period,
+  }
+
+
+class _SummaryStatsSlot(SummaryStatsAccumulator):
+  """A SummaryStatsAccumulator whose statistics are one key of a DenseKeyedAccumulator."""
+
+  def __init__(self, dense, key):
+    self._dense = dense
+    self._index = key - dense.keys.start
+
+  @property
+  def n(self):
+    return self._dense._n[self._index]
+
+  @n.setter
+  def n(self, value):
+    self._dense._n[self._index] = value
+
+  @property
+  def mean(self):
+    return self._dense._mean[self._index]
+
+  @mean.setter
+  def mean(self, value):
+    self._dense._mean[self._index] = value
+
+  @property
+  def M2(self):
+    return self._dense._M2[self._index]
+
+  @M2.setter
+  def M2(self, value):
+    self._dense._M2[self._index] = value
+
+  def UpdateOneValue(self, value):
+    self._dense.UpdateOneValue(value, self._index + self._dense.keys.start)
+
+  def UpdateArray(self, values, weights=None):
+    if weights is not None and not all(float(weight).is_integer() for weight in weights):
+      raise ValueError("weights must be whole numbers, as the counts are integers")
+    SummaryStatsAccumulator.UpdateArray(self, values, weights)
+
+
+class AccumulatorBundle(object):
+  """The accumulators described by a schema, each stored as an attribute named
+  after its spec.
+
+  The unkeyed summary statistics all live in one DenseKeyedAccumulator, keyed
+  by their position in the schema, so merging or pickling them is a handful of
+  flat arrays. Each phase of a life updates its accumulators in a single pass
+  over a precomputed list, from a dict of the measures for that phase.
+  """
+
+  def __init__(self, basic_only=False, quantile_sketches=None, schema=ACCUMULATOR_SCHEMA):
+    """quantile_sketches maps names in QUANTILE_ACCUMULATORS to the sketch each
+    should use: a name from QUANTILE_SKETCHES, or a (name, size) pair. Others
+    use the default size sketch in DEFAULT_QUANTILE_SKETCHES, or the
+    Ben-Haim/Yom-Tov histogram.
+    """
+    def QuantileSketch(name):
+      spec = (quantile_sketches or {}).get(name, DEFAULT_QUANTILE_SKETCHES.get(name, "histogram"))
+      if isinstance(spec, str):
+        return QUANTILE_SKETCHES[spec][0], None
+      sketch_class, size_arg = QUANTILE_SKETCHES[spec[0]]
+      return sketch_class, {size_arg: spec[1]}
+
+    self.basic_only = basic_only
+    self.specs = self._Specs(schema, basic_only)
+    self._summary_stats = DenseKeyedAccumulator(range(sum(1 for spec in self.specs if self._IsSlot(spec))))
+    for spec in self.specs:
+      if self._IsSlot(spec):
+        continue
+      elif spec.kind == SUMMARY_STATS:
+        accumulator = DenseKeyedAccumulator(KEY_RANGES[spec.key])
+      elif spec.key is None:
+        sketch_class, args = QuantileSketch(spec.name)
+        accumulator = sketch_class(**(args or {}))
+      else:
+        accumulator = KeyedAccumulator(*QuantileSketch(spec.name))
+      setattr(self, spec.name, accumulator)
+    self._Link()
+
+  @staticmethod
+  def _Specs(schema, basic_only):
+    return tuple(spec for spec in schema if spec.usage == FITNESS or not basic_only)
+
+  @staticmethod
+  def _IsSlot(spec):
+    return spec.kind == SUMMARY_STATS and spec.key is None
+
+  def _Link(self):
+    """Sets up the unkeyed summary statistics, the update lists for each phase,
+    and the usages and measures of the bundle's accumulators."""
+    slot = 0
+    self._updaters = {phase: [] for phase in PHASES}
+    self.usages = frozenset(spec.usage for spec in self.specs)
+    self.measures = frozenset(name for spec in self.specs
+                              for name in (spec.measure, spec.key) + spec.condition if name is not None)
+    for spec in self.specs:
+      if self._IsSlot(spec):
+        setattr(self, spec.name, _SummaryStatsSlot(self._summary_stats, slot))
+        slot += 1
+      if spec.phase is not None:
+        self._updaters[spec.phase].append(
+            (getattr(self, spec.name).UpdateOneValue, spec.measure, spec.key, spec.condition))
+
+  def __getstate__(self):
+    return {attr: value for attr, value in self.__dict__.items()
+            if attr not in ('_updaters', 'usages', 'measures') and not isinstance(value, _SummaryStatsSlot)}
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._Link()
+
+  @staticmethod
+  def _Run(updaters, measures):
+    for update, measure, key, condition in updaters:
+      for c in condition:
+        if not measures[c]:
+          break
+      else:
+        if key is None:
+          update(measures[measure])
+        else:
+          update(measures[measure], measures[key])
+
+  def Update(self, phase, measures):
+    """Updates every accumulator fed in phase from a dict of measures."""
+    self._Run(self._updaters[phase], measures)
+
   def UpdateConsumption(self, consumption, year, is_retired, period):
-    discounted_consumption = Indexed(consumption, year, 1-world.DISCOUNT_RATE)
-    age = year - world.BASE_YEAR + world.START_AGE
-
-    self.lifetime_consumption_summary.UpdateOneValue(consumption)
-    self.lifetime_consumption_hist.UpdateOneValue(consumption)
-    self.discounted_lifetime_consumption_summary.UpdateOneValue(discounted_consumption)
-    self.years_with_negative_consumption.UpdateOneValue(1 if consumption < 0 else 0)
-    if is_retired:
-      self.retired_consumption_summary.UpdateOneValue(consumption)
-      self.retired_consumption_hist.UpdateOneValue(consumption)
-      if age <= world.AVG_DISABILITY_AGE:
-        self.pre_disability_retired_consumption_summary.UpdateOneValue(consumption)
-    else:
-      self.working_consumption_summary.UpdateOneValue(consumption)
-      self.working_consumption_hist.UpdateOneValue(consumption)
-    if hasattr(self, 'consumption_by_age'):
-      self.consumption_by_age.UpdateOneValue(consumption, age)
-      self.consumption_hist_by_age.UpdateOneValue(consumption, age)
-      self.period_consumption.UpdateOneValue(consumption, period)
+    """Updates only the accumulators fed by ConsumptionMeasures.
+
+    Lives update every accumulator a year feeds at once with Update. This is
+    kept on purpose for callers, like the tests, that only have a year's
+    consumption, since Update needs all the measures of a year.
+    """
+    measures = ConsumptionMeasures(consumption, year, is_retired, period)
+    def FedByMeasures(updater):
+      _, measure, key, condition = updater
+      return all(name in measures for name in (measure, key or measure) + condition)
+    self._Run([updater for updater in self._updaters[PHASE_YEAR] if FedByMeasures(updater)], measures)
+
+  # Packed bundles start with this magic number and format version
+  _MAGIC = b'MRAB'
+  _VERSION = 1
+  _HEADER = struct.Struct('<4sHBI')
+
+  def _DenseAccumulators(self):
+    """Returns the DenseKeyedAccumulators holding summary statistics, in schema order."""
+    return [self._summary_stats] + [getattr(self, spec.name) for spec in self.specs
+                                    if spec.kind == SUMMARY_STATS and spec.key is not None]
+
+  @staticmethod
+  @functools.lru_cache()
+  def _Checksum(specs):
+    return zlib.crc32(repr([(spec.name, spec.kind, spec.key) for spec in specs]).encode())
+
+  def ToBytes(self):
+    """Returns the bundle packed into a flat binary layout of counts and arrays
+    of doubles, for sending between processes without pickling every
+    accumulator object.
+    """
+    out = bytearray(self._HEADER.pack(self._MAGIC, self._VERSION, self.basic_only, self._Checksum(self.specs)))
+
+    # All the summary statistics go in a single array
+    dense = array.array('d')
+    for accumulator in self._DenseAccumulators():
+      dense.fromlist(accumulator._n.tolist())
+      dense.extend(accumulator._mean)
+      dense.extend(accumulator._M2)
+    _PackDoubles(out, dense)
+
+    for spec in self.specs:
+      if spec.kind == QUANTILE:
+        if spec.key is None:
+          _PackSketch(getattr(self, spec.name), out)
+        else:
+          getattr(self, spec.name)._Pack(out)
+    return bytes(out)
+
+  @classmethod
+  def FromBytes(cls, data, schema=ACCUMULATOR_SCHEMA):
+    """Returns the bundle packed into data by ToBytes, with the same schema."""
+    if data[:len(cls._MAGIC)] != cls._MAGIC:
+      raise ValueError("data does not hold a packed AccumulatorBundle")
+    _, version, basic_only, checksum = cls._HEADER.unpack_from(data)
+    if version != cls._VERSION:
+      raise ValueError("packed AccumulatorBundle has format version %d, expected %d" % (version, cls._VERSION))
+    bundle = cls.__new__(cls)
+    bundle.basic_only = bool(basic_only)
+    bundle.specs = cls._Specs(schema, basic_only)
+    if checksum != cls._Checksum(bundle.specs):
+      raise ValueError("packed AccumulatorBundle has a different schema")
+
+    dense, offset = _UnpackDoubles(data, cls._HEADER.size)
+    position = 0
+    def NextDense(keys):
+      nonlocal position
+      accumulator = DenseKeyedAccumulator.__new__(DenseKeyedAccumulator)
+      accumulator.keys = keys
+      for attr in ("_n", "_mean", "_M2"):
+        setattr(accumulator, attr, dense[position:position + len(keys)])
+        position += len(keys)
+      # Counts are packed as doubles, which hold them exactly
+      accumulator._n = array.array('q', map(int, accumulator._n))
+      return accumulator
+
+    bundle._summary_stats = NextDense(range(sum(1 for spec in bundle.specs if cls._IsSlot(spec))))
+    for spec in bundle.specs:
+      if cls._IsSlot(spec):
+        continue
+      elif spec.kind == SUMMARY_STATS:
+        accumulator = NextDense(KEY_RANGES[spec.key])
+      elif spec.key is None:
+        accumulator, offset = _UnpackSketch(data, offset)
+      else:
+        accumulator, offset = KeyedAccumulator._Unpack(data, offset)
+      setattr(bundle, spec.name, accumulator)
+    if position != len(dense):
+      raise ValueError("packed AccumulatorBundle has the wrong number of summary statistics")
+    bundle._Link()
+    return bundle
+
+  def Copy(self):
+    """Returns a copy of the bundle, which can be merged into without changing it."""
+    return self.FromBytes(self.ToBytes(), self.specs)
 
   def Merge(self, bundle):
     """Merge in another AccumulatorBundle."""
-    for attr in self.__dict__:
-      getattr(self, attr).UpdateAccumulator(getattr(bundle, attr))
+    self._summary_stats.UpdateAccumulator(bundle._summary_stats)
+    for spec in self.specs:
+      if not self._IsSlot(spec):
+        getattr(self, spec.name).UpdateAccumulator(getattr(bundle, spec.name))
+
+
+class PairwiseMerger(object):
+  """Merges a stream of AccumulatorBundles as a balanced binary tree.
+
+  Bundles are first merged one after the other into batches of batch_size.
+  Each merge after that combines two partial results covering the same number
+  of batches, like the carries of a binary counter. So only about log2(n)
+  partial results are held at once, and the Welford combines never add a
+  batch to the statistics of thousands of lives.
+  """
+
+  def __init__(self, batch_size=16):
+    self.batch_size = batch_size
+    self._batch = None
+    self._batch_count = 0
+    self._partials = []  # (number of batches, merged bundle), largest first
+
+  def Add(self, bundle):
+    if self._batch is None:
+      self._batch = bundle
+    else:
+      self._batch.Merge(bundle)
+    self._batch_count += 1
+    if self._batch_count == self.batch_size:
+      self._Carry(self._batch)
+      self._batch = None
+      self._batch_count = 0
+
+  def _Carry(self, bundle):
+    count = 1
+    while self._partials and self._partials[-1][0] == count:
+      older_count, older = self._partials.pop()
+      older.Merge(bundle)
+      bundle = older
+      count += older_count
+    self._partials.append((count, bundle))
+
+  def Result(self):
+    """Returns the merge of all the bundles added, or None if there were none."""
+    result = self._batch
+    while self._partials:
+      _, bundle = self._partials.pop()
+      if result is not None:
+        bundle.Merge(result)
+      result = bundle
+    self._batch = None
+    self._batch_count = 0
+    return result
+
+
+# Two-sided 95% critical values of Student's t distribution, indexed by
+# degrees of freedom. More degrees of freedom use the normal distribution's.
+_T_95 = (None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
+def BatchMeansStderr(batch_values):
+  """Returns the standard error of a statistic, from its spread over
+  independent batches of lives, or None if there are fewer than 2 batches."""
+  k = len(batch_values)
+  if k < 2:
+    return None
+  batch_mean = math.fsum(batch_values) / k
+  variance = math.fsum((value - batch_mean)**2 for value in batch_values) / (k - 1)
+  return math.sqrt(variance / k)
+
+def BatchMeansInterval(estimate, batch_values):
+  """Returns a 95% confidence interval around estimate, from the spread of the
+  same statistic over independent batches of lives, or (None, None) if there
+  are fewer than 2 batches.
+
+  This works for statistics without a closed form standard error, like
+  quantiles, standard deviations and weighted sums of them.
+  """
+  stderr = BatchMeansStderr(batch_values)
+  if stderr is None:
+    return None, None
+  k = len(batch_values)
+  t = _T_95[k-1] if k-1 < len(_T_95) else 1.96
+  half_width = t * stderr
+  return estimate - half_width, estimate + half_width
+
+
+def PackBundles(bundles):
+  """Packs a list of AccumulatorBundles into bytes, each packed by ToBytes
+  after its length."""
+  parts = []
+  for bundle in bundles:
+    data = bundle.ToBytes()
+    parts.append(struct.pack('<Q', len(data)))
+    parts.append(data)
+  return b''.join(parts)
+
+def UnpackBundles(data, schema=ACCUMULATOR_SCHEMA, offset=0):
+  """Returns the list of AccumulatorBundles packed by PackBundles into data,
+  from offset on. data can be any bytes-like object, such as a memoryview of
+  shared memory; the bundles don't refer to it afterwards."""
+  bundles = []
+  while offset < len(data):
+    size, = struct.unpack_from('<Q', data, offset)
+    offset += 8
+    bundles.append(AccumulatorBundle.FromBytes(data[offset:offset + size], schema))
+    offset += size
+  return bundles
+
+# Snapshot files start with this magic number and format version
+_SNAPSHOT_MAGIC = b'MRSN'
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<4sHI')
+
+def WriteSnapshot(filename, batches, metadata):
+  """Writes a list of AccumulatorBundles with the same specs, and a dict of
+  metadata that json can serialize, to a snapshot file. An existing file is
+  replaced whole, so a process stopped while writing leaves the old one."""
+  header = json.dumps(dict(metadata, accumulators=[spec.name for spec in batches[0].specs])).encode()
+  with open(filename + '.tmp', 'wb') as f:
+    f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, len(header)))
+    f.write(header)
+    f.write(PackBundles(batches))
+  os.replace(filename + '.tmp', filename)
+
+def ReadSnapshot(filename):
+  """Returns the metadata and the list of AccumulatorBundles in a snapshot
+  file written by WriteSnapshot. The metadata's accumulators entry names the
+  bundles' accumulators."""
+  with open(filename, 'rb') as f:
+    data = f.read()
+  if data[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+    raise ValueError("%s is not a snapshot file" % filename)
+  _, version, header_size = _SNAPSHOT_HEADER.unpack_from(data)
+  if version != _SNAPSHOT_VERSION:
+    raise ValueError("%s has snapshot format version %d, expected %d" % (filename, version, _SNAPSHOT_VERSION))
+  offset = _SNAPSHOT_HEADER.size
+  metadata = json.loads(data[offset:offset + header_size])
+  offset += header_size
+  return metadata, UnpackBundles(data, SubscribedSchema(metadata["accumulators"]), offset)
+
+def _OwnCgroups(proc_cgroup):
+  """Returns the path of this process's cgroup v2 and a dict of the paths of
+  its cgroup v1 hierarchies by controller, read from proc_cgroup. Paths are
+  "/" where the file can't be read."""
+  v2_path = "/"
+  v1_paths = {}
+  try:
+    with open(proc_cgroup) as f:
+      lines = f.read().splitlines()
+  except OSError:
+    lines = []
+  for line in lines:
+    hierarchy, controllers, path = line.split(":", 2)
+    if hierarchy == "0" and not controllers:
+      v2_path = path
+    for controller in controllers.split(","):
+      v1_paths[controller] = path
+  return v2_path, v1_paths
+
+def _CgroupAncestors(hierarchy_root, path):
+  """Yields the directories of the cgroup at path in the hierarchy mounted at
+  hierarchy_root and of each of its ancestors, innermost first."""
+  parts = [part for part in path.split("/") if part not in ("", ".", "..")]
+  for depth in range(len(parts), -1, -1):
+    yield os.path.join(hierarchy_root, *parts[:depth])
+
+def _CgroupCPUQuota(cgroup_root, proc_cgroup):
+  """Returns the CPU quota of this process's cgroup, as a possibly fractional
+  number of CPUs, or None if it has none. Reads cgroup v2's cpu.max, or cgroup
+  v1's cpu.cfs_quota_us and cpu.cfs_period_us, for the process's own cgroup
+  under cgroup_root and every cgroup above it, since the tightest quota
+  applies. The process's cgroups are read from proc_cgroup; those that aren't
+  visible under cgroup_root, as in a container that mounts its own cgroup as
+  the root, are skipped."""
+  v2_path, v1_paths = _OwnCgroups(proc_cgroup)
+  quotas = []
+  found = False
+  for directory in _CgroupAncestors(cgroup_root, v2_path):
+    try:
+      with open(os.path.join(directory, "cpu.max")) as f:
+        quota, period = f.read().split()
+      found = True
+      if quota != "max":
+        quotas.append(int(quota) / int(period))
+    except (OSError, ValueError):
+      continue
+  if not found:
+    for controller in ("cpu", "cpu,cpuacct"):
+      for directory in _CgroupAncestors(os.path.join(cgroup_root, controller), v1_paths.get("cpu", "/")):
+        try:
+          with open(os.path.join(directory, "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+          with open(os.path.join(directory, "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+        except (OSError, ValueError):
+          continue
+        if quota > 0 and period > 0:
+          quotas.append(quota / period)
+  return min(quotas) if quotas else None
+
+def AvailableCPUs(cgroup_root="/sys/fs/cgroup", proc_cgroup="/proc/self/cgroup"):
+  """Returns the number of CPUs this process can make use of: those in its
+  scheduler affinity mask, but no more than its cgroup's CPU quota rounded
+  up, and at least 1."""
+  if hasattr(os, "sched_getaffinity"):
+    cpus = len(os.sched_getaffinity(0))
+  else:
+    cpus = os.cpu_count() or 1
+  quota = _CgroupCPUQuota(cgroup_root, proc_cgroup)
+  if quota is not None:
+    cpus = min(cpus, math.ceil(quota))
+  return max(cpus, 1)
@@ -1,5 +1,14 @@
+import array
+import bisect
 import math
+import os
+import pickle
+import random
+import shutil
+import statistics
+import tempfile
 import unittest
+import unittest.mock
 import utils
 import person
 import world
@@ -109,6 +118,62 @@ class UtilsTest(unittest.TestCase):
     self.assertAlmostEqual(acc1.variance, 216.666666667)
     self.assertAlmostEqual(acc1.stddev, 14.719601444)
   
+  def testSummaryStatsAccumulatorUpdateArray(self):
+    acc = utils.SummaryStatsAccumulator()
+    acc.UpdateOneValue(2)
+    acc.UpdateArray(array.array('d', range(4, 52, 2)))
+
+    self.assertEqual(acc.n, 25)
+    self.assertAlmostEqual(acc.mean, 26)
+    self.assertAlmostEqual(acc.M2, 5200)
+
+  def testSummaryStatsAccumulatorUpdateArrayBigNumbers(self):
+    acc = utils.SummaryStatsAccumulator()
+    acc.UpdateArray([1e9 + i for i in range(2, 52, 2)])
+
+    self.assertEqual(acc.n, 25)
+    self.assertAlmostEqual(acc.mean, 1000000026)
+    self.assertAlmostEqual(acc.M2, 5200)
+
+  def testSummaryStatsAccumulatorUpdateArrayWeighted(self):
+    acc = utils.SummaryStatsAccumulator()
+    acc.UpdateArray([1, 5, 7], weights=[2, 0, 1])
+
+    expected = utils.SummaryStatsAccumulator()
+    for v in (1, 1, 7):
+      expected.UpdateOneValue(v)
+    self.assertEqual(acc.n, 3)
+    self.assertAlmostEqual(acc.mean, expected.mean)
+    self.assertAlmostEqual(acc.M2, expected.M2)
+
+  def testSummaryStatsAccumulatorUpdateArrayFractionalWeights(self):
+    acc = utils.SummaryStatsAccumulator()
+    acc.UpdateArray([1, 5], weights=[0.5, 1.5])
+    self.assertEqual(acc.n, 2)
+    self.assertAlmostEqual(acc.mean, 4)
+
+    # Bundles keep integer counts
+    bundle = utils.AccumulatorBundle()
+    bundle.lifetime_consumption_summary.UpdateArray([1, 5, 7], weights=[2.0, 0, 1])
+    self.assertEqual(bundle.lifetime_consumption_summary.n, 3)
+    self.assertAlmostEqual(bundle.lifetime_consumption_summary.mean, 3)
+    with self.assertRaises(ValueError):
+      bundle.lifetime_consumption_summary.UpdateArray([1, 5], weights=[0.5, 1.5])
+    self.assertEqual(bundle.lifetime_consumption_summary.n, 3)
+
+  def testSummaryStatsAccumulatorUpdateArrayEmpty(self):
+    acc = utils.SummaryStatsAccumulator()
+    acc.UpdateArray([])
+    acc.UpdateArray([3], weights=[0])
+
+    self.assertEqual(acc.n, 0)
+    self.assertEqual(acc.mean, 0)
+
+  def testSummaryStatsAccumulatorUpdateArrayWrongNumberOfWeights(self):
+    acc = utils.SummaryStatsAccumulator()
+    with self.assertRaises(ValueError):
+      acc.UpdateArray([1, 2], weights=[1])
+
   def assertHistogramsEqual(self, hist1, hist2, places=7):
     """Compares two lists of (float, int) tuples for equality."""
     fail = False
@@ -221,10 +286,199 @@ class UtilsTest(unittest.TestCase):
     self.assertAlmostEqual(acc.Quantile(0.5), 2)
     self.assertAlmostEqual(acc.Quantile(0.6), 2.3333333)
 
+  def testQuantileAccumulatorMergesClosestBinsInOrder(self):
+    # After 1 and 2 merge, the merged bin is 3 away from 4.5 and not 2.5
+    acc = utils.QuantileAccumulator(max_bins=3)
+    acc.UpdateHistogram([(1, 1), (2, 1), (4.5, 1), (10, 1), (12.2, 1)])
+
+    self.assertHistogramsEqual(acc.bins, [(1.5, 2), (4.5, 1), (11.1, 2)])
+
+  def testQuantileAccumulatorMatchesPairwiseMerging(self):
+    rng = random.Random(4)
+    values = [rng.lognormvariate(10, 1) for _ in range(500)]
+    acc = utils.QuantileAccumulator(max_bins=20, buffer_size=500)
+    for v in values:
+      acc.UpdateOneValue(v)
+
+    # Reference: repeatedly merge the closest pair of bins
+    expected = sorted((v, 1) for v in values)
+    while len(expected) > 20:
+      _, i = min((expected[i+1][0] - expected[i][0], i) for i in range(len(expected)-1))
+      (c1, n1), (c2, n2) = expected[i:i+2]
+      expected[i:i+2] = [((c1*n1 + c2*n2)/(n1 + n2), n1 + n2)]
+
+    self.assertHistogramsEqual(acc.bins, expected)
+
+  def testQuantileAccumulatorBuffersValues(self):
+    acc = utils.QuantileAccumulator(max_bins=2, buffer_size=10)
+    for v in (5, 22, 9):
+      acc.UpdateOneValue(v)
+    self.assertEqual(len(acc._pending), 3)
+
+    self.assertHistogramsEqual(acc.bins, [(7, 2), (22, 1)])
+    self.assertEqual(len(acc._pending), 0)
+
+  def testQuantileAccumulatorQuantileAfterUpdate(self):
+    acc = utils.QuantileAccumulator()
+    acc.bins = [(1, 10), (2, 5), (3, 10)]
+    self.assertAlmostEqual(acc.Quantile(0.5), 2)
+
+    acc.UpdateHistogram([(3, 30)])
+    self.assertAlmostEqual(acc.Quantile(0.5), 2.6666667)
+
   def testQuantileAccumulatorNeverUpdated(self):
     acc = utils.QuantileAccumulator()
     self.assertTrue(math.isnan(acc.Quantile(0.1)), msg="expected NaN")
 
+  def assertRankErrorBelow(self, acc, values, bound):
+    values = sorted(values)
+    for q in (0.01, 0.1, 0.2, 0.5, 0.9, 0.99):
+      rank = bisect.bisect_left(values, acc.Quantile(q)) / len(values)
+      self.assertLess(abs(rank - q), bound, msg="quantile %s" % q)
+
+  def testTDigestAccumulatorFewValues(self):
+    acc = utils.TDigestAccumulator()
+    for v in (3, 1, 2):
+      acc.UpdateOneValue(v)
+
+    self.assertEqual(acc.Quantile(0), 1)
+    self.assertEqual(acc.Quantile(0.5), 2)
+    self.assertEqual(acc.Quantile(1), 3)
+
+  def testTDigestAccumulatorRankError(self):
+    rng = random.Random(2)
+    values = [rng.lognormvariate(10, 0.5) for _ in range(20000)]
+    acc = utils.TDigestAccumulator(compression=100)
+    for v in values:
+      acc.UpdateOneValue(v)
+
+    acc._Flush()
+    self.assertLessEqual(len(acc._means), 100)
+    self.assertRankErrorBelow(acc, values, 0.01)
+
+  def testTDigestAccumulatorUpdateAccumulator(self):
+    rng = random.Random(3)
+    values = [rng.lognormvariate(10, 0.5) for _ in range(20000)]
+    acc = utils.TDigestAccumulator()
+    for i in range(0, len(values), 50):
+      part = utils.TDigestAccumulator()
+      for v in values[i:i+50]:
+        part.UpdateOneValue(v)
+      acc.UpdateAccumulator(part)
+
+    self.assertEqual(acc.n, len(values))
+    self.assertEqual(acc.Quantile(0), min(values))
+    self.assertRankErrorBelow(acc, values, 0.01)
+
+  def testTDigestAccumulatorNeverUpdated(self):
+    acc = utils.TDigestAccumulator()
+    self.assertTrue(math.isnan(acc.Quantile(0.1)), msg="expected NaN")
+
+  def testKLLAccumulatorFewValues(self):
+    acc = utils.KLLAccumulator()
+    for v in (3, 1, 2):
+      acc.UpdateOneValue(v)
+
+    self.assertEqual(acc.Quantile(0), 1)
+    self.assertEqual(acc.Quantile(0.5), 2)
+    self.assertEqual(acc.Quantile(1), 3)
+
+  def testKLLAccumulatorRankError(self):
+    rng = random.Random(2)
+    values = [rng.lognormvariate(10, 0.5) for _ in range(20000)]
+    acc = utils.KLLAccumulator(k=200)
+    for v in values:
+      acc.UpdateOneValue(v)
+
+    self.assertLess(acc._size, 3 * 200)
+    self.assertRankErrorBelow(acc, values, 0.0165)
+
+  def testKLLAccumulatorUpdateAccumulator(self):
+    rng = random.Random(3)
+    values = [rng.lognormvariate(10, 0.5) for _ in range(20000)]
+    acc = utils.KLLAccumulator()
+    for i in range(0, len(values), 50):
+      part = utils.KLLAccumulator()
+      for v in values[i:i+50]:
+        part.UpdateOneValue(v)
+      acc.UpdateAccumulator(part)
+
+    self.assertEqual(acc.n, len(values))
+    self.assertEqual(sum(len(c) * 2**h for h, c in enumerate(acc._compactors)), len(values))
+    self.assertRankErrorBelow(acc, values, 0.0165)
+
+  def testKLLAccumulatorDoesNotUseSimulationRandomState(self):
+    state = random.getstate()
+    acc = utils.KLLAccumulator(k=8)
+    for i in range(100):
+      acc.UpdateOneValue(i)
+    self.assertEqual(random.getstate(), state)
+
+  def testKLLAccumulatorReproducible(self):
+    rng = random.Random(4)
+    values = [rng.lognormvariate(10, 0.5) for _ in range(5000)]
+    states = []
+    for _ in range(2):
+      acc = utils.KLLAccumulator(k=16)
+      for i in range(0, len(values), 100):
+        part = utils.KLLAccumulator(k=16)
+        for v in values[i:i+100]:
+          part.UpdateOneValue(v)
+        acc.UpdateAccumulator(part)
+      states.append(acc._State())
+    self.assertEqual(states[0], states[1])
+
+  def testKLLAccumulatorNeverUpdated(self):
+    acc = utils.KLLAccumulator()
+    self.assertTrue(math.isnan(acc.Quantile(0.1)), msg="expected NaN")
+
+  def testFixedGridHistogramAccumulatorBins(self):
+    acc = utils.FixedGridHistogramAccumulator(low=10, high=1000, n_bins=2)
+    for v in (-5, 5, 10, 99, 100, 999, 1000, 5000):
+      acc.UpdateOneValue(v)
+
+    self.assertEqual(acc.counts, {0: 2, 1: 2, 2: 2, 3: 2})
+    self.assertEqual(acc.Quantile(0), -5)
+    self.assertEqual(acc.Quantile(1), 5000)
+
+  def testFixedGridHistogramAccumulatorInterpolatesWithinBin(self):
+    acc = utils.FixedGridHistogramAccumulator(low=10, high=1000, n_bins=2)
+    acc.UpdateOneValue(10)
+    acc.UpdateOneValue(99)
+
+    self.assertAlmostEqual(acc.Quantile(0.5), 10 * math.sqrt(99 / 10))
+
+  def testFixedGridHistogramAccumulatorRelativeError(self):
+    rng = random.Random(2)
+    values = sorted(rng.lognormvariate(10, 0.5) for _ in range(20000))
+    acc = utils.FixedGridHistogramAccumulator()
+    for v in values:
+      acc.UpdateOneValue(v)
+
+    bin_ratio = (acc.high / acc.low) ** (1 / acc.n_bins)
+    for q in (0.1, 0.5, 0.9):
+      exact = values[int(q * len(values)) - 1]
+      self.assertLess(abs(acc.Quantile(q) / exact - 1), bin_ratio - 1, msg="quantile %s" % q)
+
+  def testFixedGridHistogramAccumulatorUpdateAccumulator(self):
+    acc1 = utils.FixedGridHistogramAccumulator()
+    acc2 = utils.FixedGridHistogramAccumulator()
+    acc1.UpdateOneValue(20000)
+    acc2.UpdateOneValue(20000)
+    acc2.UpdateOneValue(-100)
+
+    acc1.UpdateAccumulator(acc2)
+
+    self.assertEqual(acc1.n, 3)
+    self.assertEqual(acc1.min, -100)
+    self.assertEqual(sorted(acc1.counts.values()), [1, 2])
+    with self.assertRaises(ValueError):
+      acc1.UpdateAccumulator(utils.FixedGridHistogramAccumulator(n_bins=10))
+
+  def testFixedGridHistogramAccumulatorNeverUpdated(self):
+    acc = utils.FixedGridHistogramAccumulator()
+    self.assertTrue(math.isnan(acc.Quantile(0.1)), msg="expected NaN")
+
   def testKeyedAccumulatorSummaryStatsUpdateOneValue(self):
     acc = utils.KeyedAccumulator(utils.SummaryStatsAccumulator)
     for i in range(2, 52, 2):
@@ -296,6 +550,57 @@ class UtilsTest(unittest.TestCase):
     subacc = acc1.Query(['key1'])
     self.assertHistogramsEqual(subacc.bins, [(5, 1), (9, 1)])
 
+  def testDenseKeyedAccumulatorUpdateOneValue(self):
+    acc = utils.DenseKeyedAccumulator(range(30, 40))
+    for i in range(2, 52, 2):
+      acc.UpdateOneValue(i, 31)
+
+    subacc = acc.Query([31])
+
+    self.assertEqual(subacc.n, 25)
+    self.assertIsInstance(subacc.n, int)
+    self.assertAlmostEqual(subacc.mean, 26)
+    self.assertAlmostEqual(subacc.M2, 5200)
+    self.assertEqual(acc.Query([30]).n, 0)
+
+  def testDenseKeyedAccumulatorMultipleKeysQuery(self):
+    acc = utils.DenseKeyedAccumulator(range(4))
+    for i in range(2, 26, 2):
+      acc.UpdateOneValue(i, 0)
+    for i in range(26, 52, 2):
+      acc.UpdateOneValue(i, 3)
+
+    subacc = acc.Query([0, 1, 3, 7])
+
+    self.assertEqual(subacc.n, 25)
+    self.assertAlmostEqual(subacc.mean, 26)
+    self.assertAlmostEqual(subacc.M2, 5200)
+
+  def testDenseKeyedAccumulatorUpdateAccumulator(self):
+    acc1 = utils.DenseKeyedAccumulator(range(4))
+    acc2 = utils.DenseKeyedAccumulator(range(4))
+    expected = utils.KeyedAccumulator(utils.SummaryStatsAccumulator)
+    for i, key in enumerate((0, 1, 1, 3, 1, 0)):
+      (acc1 if i % 2 else acc2).UpdateOneValue(i * i, key)
+      expected.UpdateOneValue(i * i, key)
+
+    acc1.UpdateAccumulator(acc2)
+
+    for key in range(4):
+      self.assertEqual(acc1.Query([key]).n, expected.Query([key]).n)
+      self.assertAlmostEqual(acc1.Query([key]).mean, expected.Query([key]).mean)
+      self.assertAlmostEqual(acc1.Query([key]).M2, expected.Query([key]).M2)
+
+  def testDenseKeyedAccumulatorKeyOutOfRange(self):
+    acc = utils.DenseKeyedAccumulator(range(4))
+    with self.assertRaises(KeyError):
+      acc.UpdateOneValue(1, 4)
+
+  def testDenseKeyedAccumulatorMismatchedKeys(self):
+    acc = utils.DenseKeyedAccumulator(range(4))
+    with self.assertRaises(ValueError):
+      acc.UpdateAccumulator(utils.DenseKeyedAccumulator(range(5)))
+
   def testAccumulatorBundleUpdateConsumptionWorking(self):
     bundle = utils.AccumulatorBundle()
     bundle.UpdateConsumption(100, year=world.BASE_YEAR+1, is_retired=False, period=person.EMPLOYED)
@@ -362,6 +667,312 @@ class UtilsTest(unittest.TestCase):
     self.assertHistogramsEqual(bundle1.retired_consumption_hist.bins, [(200, 1)])
     self.assertEqual(bundle1.pre_disability_retired_consumption_summary.n, 1)
 
+  def testAccumulatorBundleUpdate(self):
+    schema = (
+        utils.AccumulatorSpec("earnings", utils.SUMMARY_STATS, "earnings", utils.PHASE_YEAR, utils.FITNESS),
+        utils.AccumulatorSpec("retired_earnings", utils.SUMMARY_STATS, "earnings", utils.PHASE_YEAR, utils.FITNESS, condition=("retired",)),
+        utils.AccumulatorSpec("earnings_by_age", utils.SUMMARY_STATS, "earnings", utils.PHASE_YEAR, utils.AGE_TABLE, key="age"),
+        utils.AccumulatorSpec("estate_hist", utils.QUANTILE, "estate", utils.PHASE_DEATH, utils.SUMMARY_TABLE),
+    )
+    bundle = utils.AccumulatorBundle(schema=schema)
+    bundle.Update(utils.PHASE_YEAR, {"earnings": 10, "retired": False, "age": 40})
+    bundle.Update(utils.PHASE_YEAR, {"earnings": 20, "retired": True, "age": 41})
+    bundle.Update(utils.PHASE_DEATH, {"estate": 5})
+
+    self.assertEqual(bundle.earnings.n, 2)
+    self.assertEqual(bundle.earnings.mean, 15)
+    self.assertEqual(bundle.retired_earnings.mean, 20)
+    self.assertEqual(bundle.earnings_by_age.Query([41]).mean, 20)
+    self.assertEqual(bundle.estate_hist.Quantile(0.5), 5)
+
+    basic = utils.AccumulatorBundle(basic_only=True, schema=schema)
+    self.assertFalse(hasattr(basic, "earnings_by_age"))
+    basic.Update(utils.PHASE_YEAR, {"earnings": 30, "retired": False})
+    self.assertEqual(basic.earnings.mean, 30)
+
+  def testAccumulatorBundleBasicOnly(self):
+    bundle = utils.AccumulatorBundle(basic_only=True)
+
+    self.assertTrue(hasattr(bundle, "lifetime_consumption_summary"))
+    self.assertFalse(hasattr(bundle, "age_at_death"))
+    self.assertFalse(hasattr(bundle, "consumption_by_age"))
+
+  def testAccumulatorBundlePickle(self):
+    bundle = utils.AccumulatorBundle()
+    bundle.UpdateConsumption(100, year=world.BASE_YEAR + 1, is_retired=False, period=person.EMPLOYED)
+
+    copy = pickle.loads(pickle.dumps(bundle))
+    copy.UpdateConsumption(200, year=world.BASE_YEAR + 2, is_retired=False, period=person.EMPLOYED)
+
+    self.assertEqual(bundle.lifetime_consumption_summary.n, 1)
+    self.assertEqual(copy.lifetime_consumption_summary.n, 2)
+    self.assertEqual(copy.working_consumption_summary.mean, 150)
+    self.assertEqual(copy.period_consumption.Query([person.EMPLOYED]).n, 2)
+
+  def testAccumulatorBundleQuantileSketches(self):
+    bundle = utils.AccumulatorBundle(quantile_sketches={
+        "lifetime_consumption_hist": "kll",
+        "retired_consumption_hist": ("tdigest", 50),
+        "consumption_hist_by_age": ("histogram", 20)})
+
+    self.assertIsInstance(bundle.lifetime_consumption_hist, utils.KLLAccumulator)
+    self.assertIsInstance(bundle.working_consumption_hist, utils.QuantileAccumulator)
+    self.assertEqual(bundle.retired_consumption_hist.compression, 50)
+    self.assertEqual(bundle.consumption_hist_by_age.default_factory().max_bins, 20)
+    self.assertIsInstance(utils.AccumulatorBundle().consumption_hist_by_age.default_factory(), utils.FixedGridHistogramAccumulator)
+
+    other = utils.AccumulatorBundle(quantile_sketches={
+        "lifetime_consumption_hist": "kll",
+        "retired_consumption_hist": ("tdigest", 50),
+        "consumption_hist_by_age": ("histogram", 20)})
+    other.UpdateConsumption(100, year=world.BASE_YEAR + 1, is_retired=False, period=person.EMPLOYED)
+    bundle.Merge(other)
+    self.assertEqual(bundle.lifetime_consumption_hist.Quantile(0.5), 100)
+
+
+  def testSubscribedSchema(self):
+    schema = utils.SubscribedSchema(["lifetime_consumption_hist"], [utils.PERIOD_TABLE])
+    names = [spec.name for spec in schema]
+
+    self.assertIn("lifetime_consumption_hist", names)
+    self.assertIn("period_years", names)
+    self.assertNotIn("lifetime_consumption_summary", names)
+    self.assertNotIn("consumption_by_age", names)
+
+  def testAccumulatorBundleSubscribed(self):
+    bundle = utils.AccumulatorBundle(schema=utils.SubscribedSchema(["retired_consumption_summary"]))
+    bundle.UpdateConsumption(100, year=world.BASE_YEAR + 1, is_retired=False, period=person.EMPLOYED)
+    bundle.UpdateConsumption(200, year=world.BASE_YEAR + 2, is_retired=True, period=person.RETIRED)
+
+    self.assertFalse(hasattr(bundle, "lifetime_consumption_summary"))
+    self.assertEqual(bundle.retired_consumption_summary.mean, 200)
+    self.assertEqual(bundle.usages, {utils.FITNESS})
+    self.assertEqual(bundle.measures, {"consumption", "retired"})
+    copy = utils.AccumulatorBundle.FromBytes(bundle.ToBytes(), bundle.specs)
+    self.assertEqual(copy.retired_consumption_summary.n, 1)
+
+  def testAccumulatorBundleToBytes(self):
+    sim_years = world.AVG_DISABILITY_AGE - world.START_AGE
+    for sketch in utils.QUANTILE_SKETCHES:
+      bundle = utils.AccumulatorBundle(quantile_sketches={name: sketch for name in utils.QUANTILE_ACCUMULATORS})
+      for i in range(300):
+        bundle.UpdateConsumption(1000 * (i % 97 + 1), year=world.BASE_YEAR + i % sim_years, is_retired=i % 2, period=person.EMPLOYED)
+
+      copy = utils.AccumulatorBundle.FromBytes(bundle.ToBytes())
+      self.assertEqual(copy.lifetime_consumption_summary.mean, bundle.lifetime_consumption_summary.mean)
+      self.assertEqual(copy.lifetime_consumption_summary.M2, bundle.lifetime_consumption_summary.M2)
+      self.assertEqual(copy.consumption_by_age.Query([world.START_AGE + 3]).n, bundle.consumption_by_age.Query([world.START_AGE + 3]).n)
+      for q in (0.1, 0.5, 0.9):
+        self.assertEqual(copy.lifetime_consumption_hist.Quantile(q), bundle.lifetime_consumption_hist.Quantile(q))
+        self.assertEqual(copy.consumption_hist_by_age.Query([world.START_AGE + 3]).Quantile(q),
+                         bundle.consumption_hist_by_age.Query([world.START_AGE + 3]).Quantile(q))
+
+      # The copy is a working bundle, not a snapshot
+      copy.Merge(bundle)
+      copy.UpdateConsumption(100, year=world.BASE_YEAR, is_retired=False, period=person.EMPLOYED)
+      self.assertEqual(copy.lifetime_consumption_summary.n, 601)
+      self.assertIsInstance(copy.lifetime_consumption_summary.n, int)
+      self.assertIsInstance(copy.consumption_by_age.Query([world.START_AGE + 3]).n, int)
+
+  def testAccumulatorBundleToBytesBasicOnly(self):
+    bundle = utils.AccumulatorBundle(basic_only=True)
+    bundle.UpdateConsumption(100, year=world.BASE_YEAR + 1, is_retired=False, period=person.EMPLOYED)
+
+    copy = utils.AccumulatorBundle.FromBytes(bundle.ToBytes())
+    self.assertTrue(copy.basic_only)
+    self.assertFalse(hasattr(copy, "consumption_by_age"))
+    self.assertEqual(copy.working_consumption_summary.mean, 100)
+    self.assertEqual(copy.lifetime_consumption_hist.Quantile(0.5), 100)
+
+  def testPackBundles(self):
+    batches = []
+    for sketch in utils.QUANTILE_SKETCHES:
+      bundle = utils.AccumulatorBundle(quantile_sketches={name: sketch for name in utils.QUANTILE_ACCUMULATORS})
+      for i in range(50):
+        bundle.UpdateConsumption(1000 * (i + 1), year=world.BASE_YEAR + i % 20, is_retired=i % 2, period=person.EMPLOYED)
+      batches.append(bundle)
+
+    # Unpacking works from a buffer, as from shared memory, and keeps no view of it
+    buffer = bytearray(utils.PackBundles(batches))
+    view = memoryview(buffer)
+    read = utils.UnpackBundles(view)
+    view.release()
+    buffer[:] = bytes(len(buffer))
+    self.assertEqual(len(read), len(batches))
+    for copy, bundle in zip(read, batches):
+      self.assertEqual(copy.lifetime_consumption_summary.mean, bundle.lifetime_consumption_summary.mean)
+      self.assertEqual(copy.consumption_hist_by_age.Query([world.START_AGE + 3]).Quantile(0.5),
+                       bundle.consumption_hist_by_age.Query([world.START_AGE + 3]).Quantile(0.5))
+    self.assertEqual(utils.UnpackBundles(utils.PackBundles([])), [])
+
+  def testAccumulatorBundleFromBytesRejectsOtherData(self):
+    data = utils.AccumulatorBundle().ToBytes()
+    with self.assertRaises(ValueError):
+      utils.AccumulatorBundle.FromBytes(b'not a bundle')
+    with self.assertRaises(ValueError):
+      utils.AccumulatorBundle.FromBytes(data[:4] + b'\xff' + data[5:])
+    schema = utils.ACCUMULATOR_SCHEMA[:-1]
+    with self.assertRaises(ValueError):
+      utils.AccumulatorBundle.FromBytes(data, schema=schema)
+
+
+  def testPairwiseMerger(self):
+    for n, batch_size in ((1, 1), (5, 1), (13, 2), (40, 16)):
+      merger = utils.PairwiseMerger(batch_size)
+      for i in range(n):
+        bundle = utils.AccumulatorBundle(basic_only=True)
+        bundle.UpdateConsumption(100 * (i + 1), year=world.BASE_YEAR + 1, is_retired=False, period=person.EMPLOYED)
+        merger.Add(bundle)
+      result = merger.Result()
+
+      self.assertEqual(result.lifetime_consumption_summary.n, n)
+      self.assertAlmostEqual(result.lifetime_consumption_summary.mean, 50 * (n + 1))
+      if n > 1:
+        self.assertAlmostEqual(result.lifetime_consumption_summary.variance, statistics.variance(range(100, 100 * (n + 1), 100)))
+      self.assertIsNone(merger.Result())
+
+  def testPairwiseMergerHoldsFewPartials(self):
+    merger = utils.PairwiseMerger(1)
+    for _ in range(1000):
+      merger.Add(utils.AccumulatorBundle(basic_only=True))
+      self.assertLessEqual(len(merger._partials), 10)
+
+
+  def testBatchMeansInterval(self):
+    low, high = utils.BatchMeansInterval(10, [9, 10, 11])
+    half_width = 4.303 * 1 / math.sqrt(3)
+    self.assertAlmostEqual(low, 10 - half_width)
+    self.assertAlmostEqual(high, 10 + half_width)
+
+    self.assertEqual(utils.BatchMeansInterval(10, [10] * 50), (10, 10))
+    self.assertEqual(utils.BatchMeansInterval(10, [10]), (None, None))
+
+  def testBatchMeansStderr(self):
+    self.assertAlmostEqual(utils.BatchMeansStderr([9, 10, 11]), 1 / math.sqrt(3))
+    self.assertEqual(utils.BatchMeansStderr([10] * 50), 0)
+    self.assertIsNone(utils.BatchMeansStderr([10]))
+
+  def testBatchMeansIntervalCoverage(self):
+    rng = random.Random(1)
+    covered = 0
+    for _ in range(400):
+      batch_means = [statistics.fmean(rng.gauss(0, 1) for _ in range(20)) for _ in range(5)]
+      low, high = utils.BatchMeansInterval(statistics.fmean(batch_means), batch_means)
+      covered += low <= 0 <= high
+    self.assertAlmostEqual(covered / 400, 0.95, delta=0.03)
+
+  def testAccumulatorBundleCopy(self):
+    bundle = utils.AccumulatorBundle()
+    bundle.UpdateConsumption(100, year=world.BASE_YEAR + 1, is_retired=False, period=person.EMPLOYED)
+
+    copy = bundle.Copy()
+    copy.Merge(bundle)
+    self.assertEqual(bundle.lifetime_consumption_summary.n, 1)
+    self.assertEqual(copy.lifetime_consumption_summary.n, 2)
+    self.assertEqual(bundle.consumption_hist_by_age.Query([world.START_AGE + 1]).n, 1)
+
+
+  def testSnapshot(self):
+    schema = utils.SubscribedSchema(["lifetime_consumption_summary", "lifetime_consumption_hist"])
+    batches = [utils.AccumulatorBundle(schema=schema) for _ in range(3)]
+    for i, bundle in enumerate(batches):
+      bundle.UpdateConsumption(100 * i, year=world.BASE_YEAR + 1, is_retired=False, period=person.EMPLOYED)
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+      utils.WriteSnapshot(filename, batches, {"lives": 3, "shard": [0, 1]})
+      metadata, read = utils.ReadSnapshot(filename)
+    finally:
+      os.remove(filename)
+
+    self.assertEqual(metadata["lives"], 3)
+    self.assertEqual(metadata["shard"], [0, 1])
+    self.assertEqual(metadata["accumulators"], ["lifetime_consumption_summary", "lifetime_consumption_hist"])
+    self.assertEqual([bundle.lifetime_consumption_summary.mean for bundle in read], [0, 100, 200])
+    self.assertEqual(read[2].lifetime_consumption_hist.Quantile(0.5), 200)
+    self.assertFalse(hasattr(read[0], "working_consumption_summary"))
+
+  def testNotASnapshot(self):
+    with tempfile.NamedTemporaryFile() as f:
+      f.write(b'not a snapshot')
+      f.flush()
+      with self.assertRaises(ValueError):
+        utils.ReadSnapshot(f.name)
+
+
+class AvailableCPUsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.cgroup_root = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.cgroup_root)
+
+  def Write(self, path, contents):
+    path = os.path.join(self.cgroup_root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+      f.write(contents)
+
+  def Affinity(self):
+    with unittest.mock.patch.object(os, "sched_getaffinity", return_value={0, 1, 2, 3, 4, 5, 6, 7}, create=True):
+      return utils.AvailableCPUs(self.cgroup_root, os.path.join(self.cgroup_root, "proc_self_cgroup"))
+
+  def testNoCgroup(self):
+    self.assertEqual(self.Affinity(), 8)
+
+  def testCgroupV2Quota(self):
+    self.Write("cpu.max", "250000 100000\n")
+    self.assertEqual(self.Affinity(), 3)
+
+  def testCgroupV2Unlimited(self):
+    self.Write("cpu.max", "max 100000\n")
+    self.assertEqual(self.Affinity(), 8)
+
+  def testCgroupV1Quota(self):
+    self.Write("cpu,cpuacct/cpu.cfs_quota_us", "400000\n")
+    self.Write("cpu,cpuacct/cpu.cfs_period_us", "100000\n")
+    self.assertEqual(self.Affinity(), 4)
+
+  def testCgroupV1Unlimited(self):
+    self.Write("cpu/cpu.cfs_quota_us", "-1\n")
+    self.Write("cpu/cpu.cfs_period_us", "100000\n")
+    self.assertEqual(self.Affinity(), 8)
+
+  def testQuotaAboveAffinity(self):
+    self.Write("cpu.max", "1600000 100000\n")
+    self.assertEqual(self.Affinity(), 8)
+
+  def testSmallQuota(self):
+    self.Write("cpu.max", "10000 100000\n")
+    self.assertEqual(self.Affinity(), 1)
+
+  def testCgroupV2Nested(self):
+    self.Write("proc_self_cgroup", "0::/user.slice/job.scope\n")
+    self.Write("cpu.max", "max 100000\n")
+    self.Write("user.slice/cpu.max", "max 100000\n")
+    self.Write("user.slice/job.scope/cpu.max", "200000 100000\n")
+    self.assertEqual(self.Affinity(), 2)
+
+  def testCgroupV2AncestorQuota(self):
+    self.Write("proc_self_cgroup", "0::/user.slice/job.scope\n")
+    self.Write("cpu.max", "max 100000\n")
+    self.Write("user.slice/cpu.max", "300000 100000\n")
+    self.Write("user.slice/job.scope/cpu.max", "500000 100000\n")
+    self.assertEqual(self.Affinity(), 3)
+
+  def testCgroupV2OwnCgroupMountedAsRoot(self):
+    self.Write("proc_self_cgroup", "0::/docker/0123abcd\n")
+    self.Write("cpu.max", "150000 100000\n")
+    self.assertEqual(self.Affinity(), 2)
+
+  def testCgroupV1Nested(self):
+    self.Write("proc_self_cgroup", "4:memory:/other\n3:cpu,cpuacct:/docker/0123abcd\n0::/\n")
+    self.Write("cpu,cpuacct/cpu.cfs_quota_us", "-1\n")
+    self.Write("cpu,cpuacct/cpu.cfs_period_us", "100000\n")
+    self.Write("cpu,cpuacct/docker/0123abcd/cpu.cfs_quota_us", "200000\n")
+    self.Write("cpu,cpuacct/docker/0123abcd/cpu.cfs_period_us", "100000\n")
+    self.assertEqual(self.Affinity(), 2)
 
 if __name__ == '__main__':
   unittest.main()
@@ -1,6 +1,7 @@
 # Parameter/Constant definitions for mini-Ruthen
 
 import collections
+import functools
 
 # Unless otherwise noted, all dollar amounts are real dollar amounts
 
@@ -161,7 +162,7 @@ LICO_SINGLE_CITY_WP = 24312 # Low Income Cut-Off; nominal, indexed by personal C
 SALES_TAX_EXEMPTION = 8000 # Assumed amount of spending deemed NOT subject to HST sales tax; nominal, indexed by personal CPI
 HST_RATE = 0.13 # Harmonized Sales Tax rate is the sum of 0.05 GST rate(federal) and 0.08 PST rate(provincial)
 DISCOUNT_RATE = 0.03 # Annual discount rate applied to consumption to reflect time preference
-PARGE = 0.01 # Projected annual real growth in earnings
+PARGE = 0.01 # Projected annual real growth in earnings, for lives without an economic scenario path
 YMPE_STDDEV = 0.1 # Standard deviation for earnings as a fraction of current YMPE
 AVG_DISABILITY_AGE = 77 # Age after which subject is considered likely disabled
 
@@ -408,6 +409,12 @@ CED_TABLE_MIN_AGE = 60
 CED_TABLE_MAX_AGE = 111
 CED_PROPORTION = GenerateCEDDrawdownTable(CED_TABLE_MIN_AGE, CED_TABLE_MAX_AGE)
 
+@functools.lru_cache(maxsize=None)
+def CEDDrawdownTable(index_min, index_max):
+  """Like GenerateCEDDrawdownTable, but generates each table only once per
+  process. The table returned is shared, and must not be modified."""
+  return GenerateCEDDrawdownTable(index_min, index_max)
+
 # Fate
 INVOLUNTARY_RETIREMENT_INCREMENT = 0.08
 MINIMUM_RETIREMENT_AGE = 60
@@ -416,3 +423,9 @@ UNEMPLOYMENT_PROBABILITY = 0.08
 
 # Fitness component constants
 FRACTION_WORKING_CONSUMPTION = 0.8
+
+def PreloadTables():
+  """Generates the drawdown tables for bridging funds, which lives otherwise
+  generate on retirement, so a worker process does it once before any lives."""
+  for age in range(MINIMUM_RETIREMENT_AGE, CPP_EXPECTED_RETIREMENT_AGE):
+    CEDDrawdownTable(age, CPP_EXPECTED_RETIREMENT_AGE)
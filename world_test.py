@@ -25,6 +25,12 @@ class ExtendedDictTest(unittest.TestCase):
     self.assertAlmostEqual(world.CED_PROPORTION[110], 1.0)
     self.assertAlmostEqual(world.CED_PROPORTION[120], 1.0)
 
+  def testCEDDrawdownTableIsGeneratedOnce(self):
+    world.PreloadTables()
+    table = world.CEDDrawdownTable(62, world.CPP_EXPECTED_RETIREMENT_AGE)
+    self.assertIs(world.CEDDrawdownTable(62, world.CPP_EXPECTED_RETIREMENT_AGE), table)
+    self.assertEqual(table, world.GenerateCEDDrawdownTable(62, world.CPP_EXPECTED_RETIREMENT_AGE))
+
   def testTaxSchedule(self):
     self.assertEqual(world.FEDERAL_TAX_SCHEDULE[0], 0)
     self.assertEqual(world.FEDERAL_TAX_SCHEDULE[87907], 16263)